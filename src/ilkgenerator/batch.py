@@ -0,0 +1,133 @@
+'''
+Generation of the solvers for many robots and queries, in a single process.
+
+The jobs are listed in a manifest file (YAML or JSON), like this:
+
+    jobs:
+      - robot: models/ur5.urdf
+        params: models/ur5-params.yaml   # optional
+        query: queries/ur5-fk.yaml       # optional, default query otherwise
+        output-dir: gen/ur5-fk
+
+Relative paths are interpreted with respect to the directory of the manifest.
+Each robot model is loaded only once, even when several jobs refer to it.
+'''
+
+import logging, os, argparse, json, time
+import yaml
+
+from ilkgenerator import main as ilkmain
+
+log = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, robot, odir, query=None, params=None):
+        self.robot  = robot
+        self.odir   = odir
+        self.query  = query
+        self.params = params
+
+    @staticmethod
+    def fromDict(data, basedir):
+        def path(key):
+            value = data.get(key)
+            if value is None :
+                return None
+            return os.path.join(basedir, value)
+        if 'robot' not in data or 'output-dir' not in data :
+            raise ValueError("A job must specify at least 'robot' and 'output-dir' (found {0})".format(data))
+        return Job(robot=path('robot'), odir=path('output-dir'), query=path('query'), params=path('params'))
+
+    def __str__(self):
+        return "robot {0}, query {1}, output {2}".format(self.robot, self.query, self.odir)
+
+
+def jobsFromManifest(manifestFile):
+    istream = open(manifestFile)
+    data = yaml.safe_load(istream) # JSON is a subset of YAML
+    istream.close()
+    basedir = os.path.dirname(manifestFile)
+    return [Job.fromDict(job, basedir) for job in data['jobs']]
+
+
+def run(jobs, options):
+    '''Runs all the given jobs, with the given generation options (see
+    main.defaultGenerationOptions()).
+
+    A failing job does not stop the others. Returns a report, i.e. a dictionary
+    with the outcome and the timings of each job.
+    '''
+    ilkmain.setupGeneration(options)
+
+    robots = {}  # (robot file, params file) -> models
+    report = {'jobs': []}
+    start = time.perf_counter()
+    for job in jobs :
+        entry = {'robot': job.robot, 'query': job.query, 'output-dir': job.odir}
+        t0 = time.perf_counter()
+        try:
+            key = (job.robot, job.params)
+            if key not in robots :
+                robots[key] = ilkmain.loadRobotModels(job.robot, job.params, options.parametricConstants)
+                entry['robot-load-seconds'] = time.perf_counter() - t0
+            models = robots[key]
+            userq = ilkmain.loadQuery(job.query, models)
+            solverSpecs = ilkmain.validateQuery(models, userq)
+            generated = ilkmain.generate(models, solverSpecs, job.odir, options)
+            entry['files'] = generated.files
+            if options.cacheDir :
+                entry['cache'] = {name : ('hit' if hit else 'miss') for name, hit in generated.cacheReport}
+            if generated.fusion is not None :
+                entry['fusion'] = generated.fusion._asdict()
+            if generated.cost is not None :
+                # in batch mode, the cost is part of the report of the job
+                entry['cost'] = generated.cost
+            entry['status'] = 'ok'
+        except (Exception, SystemExit) as e:
+            # The robot-model tools exit on loading errors
+            log.error("Job failed ({0}): {1}".format(job, e))
+            entry['status'] = 'failed'
+            entry['error'] = "{0}: {1}".format(e.__class__.__name__, e)
+        entry['seconds'] = time.perf_counter() - t0
+        report['jobs'].append(entry)
+
+    report['robots-loaded'] = len(robots)
+    report['seconds'] = time.perf_counter() - start
+    report['failed'] = len([e for e in report['jobs'] if e['status'] != 'ok'])
+    return report
+
+
+def reportAsText(report):
+    lines = []
+    for entry in report['jobs'] :
+        lines.append("{0:>8.3f}s  {1:<6}  {2}".format(entry['seconds'], entry['status'], entry['output-dir']))
+    lines.append("{0:>8.3f}s  total, {1} jobs ({2} failed), {3} robot models loaded".format(
+        report['seconds'], len(report['jobs']), report['failed'], report['robots-loaded']))
+    return "\n".join(lines)
+
+
+def main():
+    ilkmain.setupLogging()
+
+    argparser = argparse.ArgumentParser(prog="ilkgen-batch",
+                    description='Generate ILK solver models for many robots and queries')
+    argparser.add_argument('manifest', metavar='MANIFEST',
+            help='the YAML/JSON file listing the jobs')
+    argparser.add_argument('-r', '--report', metavar='FILE', dest='report',
+            help='where to write the summary report, in JSON format')
+    ilkmain.addGenerationArgs(argparser)
+    args = argparser.parse_args()
+
+    report = run(jobsFromManifest(args.manifest), args)
+    print(reportAsText(report))
+    if args.report :
+        ostream = open(args.report, mode='w')
+        json.dump(report, ostream, indent=2)
+        ostream.close()
+
+    return -1 if report['failed'] > 0 else 0
+
+
+if __name__ == "__main__" :
+    exit(main())
@@ -0,0 +1,271 @@
+'''
+A NumPy reference evaluator of the batched FK solvers.
+
+The evaluator executes the same ops the generator writes in the ILK text of a
+solver (see generator.SweepingSolverGenerator), each one on a whole batch of N
+joint configurations at once. It serves as a reference for the batched form
+and for the code compiled from it, rather than as a fast solver.
+
+The conventions are the ones of the ILK text:
+
+- the pose 'T__R' is the homogeneous transform from the coordinates of frame T
+  to the coordinates of frame R
+- the velocity 'v__T__R' is the twist of T relative to R, in the coordinates of
+  T, with the angular part first
+- the columns of the geometric Jacobian 'J_T_R' are in the coordinates of R,
+  with the angular part first
+- the bias acceleration 'a__T__R' is in the same coordinates as 'v__T__R'
+'''
+
+import os, unittest
+import numpy as np
+
+from ilkgenerator import generator
+from ilkgenerator import robotconstants
+from ilkgenerator.generator import poseIdentifier, velocityIdentifier, gJacobianIdentifier, accelerationIdentifier
+
+from robmodel.connectivity import JointKind
+
+
+def jointTransforms(joint, q):
+    '''The N x 4 x 4 transforms from the coordinates of the successor frame to
+    the coordinates of the joint frame, for the N values `q` of the joint
+    position'''
+    X = np.zeros( (q.shape[0], 4, 4) )
+    X[:,3,3] = 1.0
+    if joint.kind == JointKind.revolute :
+        c = np.cos(q)
+        s = np.sin(q)
+        X[:,0,0] = c
+        X[:,0,1] = -s
+        X[:,1,0] = s
+        X[:,1,1] = c
+        X[:,2,2] = 1.0
+    elif joint.kind == JointKind.prismatic :
+        X[:,0,0] = X[:,1,1] = X[:,2,2] = 1.0
+        X[:,2,3] = q
+    else :
+        raise RuntimeError("Unsupported joint kind '{0}', for joint '{1}'".format(joint.kind, joint.name))
+    return X
+
+
+def jointTwists(joint, qd):
+    '''The N x 6 twists of the successor relative to the predecessor of the
+    given joint, in successor coordinates, for the N joint velocities `qd`'''
+    twists = np.zeros( (qd.shape[0], 6) )
+    if joint.kind == JointKind.revolute :
+        twists[:,2] = qd
+    elif joint.kind == JointKind.prismatic :
+        twists[:,5] = qd
+    # the twist across a fixed joint is zero
+    return twists
+
+
+def transformTwists(X, twists):
+    '''The given twists in the coordinates of the frame A, given the transform
+    X from the coordinates of B to the coordinates of A, and the twists in B
+    coordinates. Both arguments may or may not have the batch dimension.'''
+    R = X[...,0:3,0:3]
+    p = X[...,0:3,3]
+    w = np.einsum('...ij,...j->...i', R, twists[...,0:3])
+    v = np.einsum('...ij,...j->...i', R, twists[...,3:6]) + np.cross(p, w)
+    return np.concatenate( (w, v), axis=-1 )
+
+
+def crossTwists(v, u):
+    '''The cross product of the twists v and u, that is the derivative of u
+    when it moves with velocity v'''
+    w1, v1 = v[...,0:3], v[...,3:6]
+    w2, v2 = u[...,0:3], u[...,3:6]
+    return np.concatenate( (np.cross(w1, w2), np.cross(w1, v2) + np.cross(v1, w2)), axis=-1 )
+
+
+class BatchEvaluator:
+    '''Evaluates the outputs of a FK solver, for a batch of joint status.
+
+    The arguments are the solvermodel.FKSolverModel and the geometry model of
+    the robot, which gives the values of the constant poses.
+    '''
+
+    def __init__(self, solverModel, robotGeometryModel):
+        self.generator = generator.SweepingSolverGenerator(solverModel, batched=True)
+        self.solverModel = solverModel
+        constants = robotconstants.numericTransforms(robotGeometryModel)
+        self.constants = {poseIdentifier(pose) : constants[poseIdentifier(pose)]
+                          for pose in self.generator.constantPoses}
+        self.constants['_identity_'] = np.identity(4)
+        self.dofs = len(self.generator.usableJoints)
+
+    def needsVelocities(self):
+        output = self.solverModel.output
+        return len(output['velocity']) > 0 or len(output['jdot_qdot']) > 0
+
+    def evaluate(self, q, qd=None):
+        '''The outputs of the solver for the joint positions `q` and velocities
+        `qd`, both arrays of shape N x dofs, in the order of the coordinates of
+        the joints. The velocities are required only by velocity and bias
+        acceleration outputs.
+
+        Returns a dictionary with the identifier of each output as the key. The
+        values are arrays with the batch dimension first: N x 4 x 4 for the
+        poses, N x 6 for the velocities and accelerations, N x 6 x columns for
+        the Jacobians.
+        '''
+        q = self._checkedInput(q, 'q')
+        if self.needsVelocities() :
+            if qd is None :
+                raise ValueError("The solver '{0}' requires the joint velocities".format(self.solverModel.name))
+            qd = self._checkedInput(qd, 'qd')
+            if qd.shape != q.shape :
+                raise ValueError("Inconsistent batch size of q ({0}) and qd ({1})".format(q.shape[0], qd.shape[0]))
+
+        gen = self.generator
+        model = self.solverModel
+        N = q.shape[0]
+
+        poses = dict(self.constants)
+        for pose in gen.jointPoses :
+            jq = q[:, gen.jointNum(pose.joint)]
+            if generator.directionTag(pose) == "b_x_a" :
+                jq = -jq
+            poses[poseIdentifier(pose)] = jointTransforms(pose.joint, jq)
+        for c in gen.poseComposes :
+            poses[poseIdentifier(c.result)] = np.matmul(poses[poseIdentifier(c.arg2)], poses[poseIdentifier(c.arg1)])
+
+        vels = {}
+        if qd is not None :
+            for jvel in model.jointVelocities.values() :
+                if jvel.joint.kind == JointKind.fixed :
+                    twists = np.zeros( (N, 6) )
+                else :
+                    twists = jointTwists(jvel.joint, qd[:, gen.jointNum(jvel.joint)])
+                if jvel.polarity == -1 :
+                    ctransform = jvel.joint.name + "__" + jvel.vel.target.name
+                    twists = -transformTwists(poses[ctransform], twists)
+                vels[velocityIdentifier(jvel.vel)] = twists
+            for c in gen.velComposes :
+                vels[velocityIdentifier(c.result)] = (vels[velocityIdentifier(c.arg1)] +
+                    transformTwists(poses[poseIdentifier(c.pose)], vels[velocityIdentifier(c.arg2)]))
+
+        accs = {}
+        for v in model.accBiasZero :
+            accs[accelerationIdentifier(v)] = np.zeros( (N, 6) )
+        def acc(arg):
+            if arg.v in model.jointVelocities.keys() :
+                return np.zeros( (N, 6) )
+            return accs[accelerationIdentifier(arg)]
+        for c in model.accBiasComposes :
+            X = poses[poseIdentifier(c.pose)]
+            v2 = transformTwists(X, vels[velocityIdentifier(c.arg2)])
+            accs[accelerationIdentifier(c.result)] = (acc(c.arg1) + transformTwists(X, acc(c.arg2)) -
+                crossTwists(vels[velocityIdentifier(c.arg1)], v2))
+
+        out = {}
+        for pose in model.output['pose'] :
+            value = poses[poseIdentifier(pose)]
+            out[poseIdentifier(pose)] = np.array( np.broadcast_to(value, (N, 4, 4)) )
+        for v in model.output['velocity'] :
+            out[velocityIdentifier(v)] = vels[velocityIdentifier(v)]
+        for J in model.output['jacobian'] :
+            out[gJacobianIdentifier(J)] = self._jacobian(J, poses, N)
+        for v in model.output['jdot_qdot'] :
+            out[accelerationIdentifier(v)] = accs[accelerationIdentifier(v)]
+        return out
+
+    def _jacobian(self, J, poses, N):
+        target = np.broadcast_to(poses[poseIdentifier(J.targetPose)], (N, 4, 4))
+        columns = np.zeros( (N, 6, len(J.joints)) )
+        for i, (joint, pose, polarity) in enumerate(zip(J.joints, J.jointPoses, J.polarities)) :
+            X = np.broadcast_to(poses[poseIdentifier(pose)], (N, 4, 4))
+            z = X[:,0:3,2]
+            if joint.kind == JointKind.revolute :
+                columns[:,0:3,i] = polarity * z
+                columns[:,3:6,i] = polarity * np.cross(z, target[:,0:3,3] - X[:,0:3,3])
+            elif joint.kind == JointKind.prismatic :
+                columns[:,3:6,i] = polarity * z
+        return columns
+
+    def _checkedInput(self, array, name):
+        array = np.asarray(array, dtype=float)
+        if array.ndim != 2 or array.shape[1] != self.dofs :
+            raise ValueError("Expected an array of shape N x {0} for '{1}', got {2}".format(self.dofs, name, array.shape))
+        return array
+
+
+class TestBatchEvaluator(unittest.TestCase):
+    '''Checks the outputs of the evaluator on the UR5 sample (see
+    sample/models/ur5.urdf) against finite differences'''
+
+    pairs = [('tool', 'base'), ('base', 'tool'), ('wrist_1', 'shoulder'), ('shoulder', 'wrist_3')]
+
+    def setUp(self):
+        # imported here, since main imports this module
+        from ilkgenerator import main, query, solvermodel
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        self.models = main.loadRobotModels( os.path.join(sample, 'models', 'ur5.urdf') )
+        frames = [{'target': t, 'reference': r} for t, r in self.pairs]
+        outputs = {'poses': frames, 'jacs': frames, 'jdot_qdot': frames,
+                   'velocities': [dict(f, kind='6D', cframe='x') for f in frames]}
+        userq = query.queryFromDictionary( {'robot': 'ur5', 'solvers': [{'name': 'fk', 'kind': 'sweeping', 'outputs': outputs}]} )
+        specs, _ = main.validateQuery(self.models, userq)
+        self.evaluator = BatchEvaluator(solvermodel.FKSolverModel(specs[0]), self.models.geometry)
+        rnd = np.random.RandomState(0)
+        self.q  = rnd.uniform(-3, 3, (7, self.evaluator.dofs))
+        self.qd = rnd.uniform(-1, 1, (7, self.evaluator.dofs))
+
+    def test_batch(self):
+        out = self.evaluator.evaluate(self.q, self.qd)
+        for i in range(0, self.q.shape[0]) :
+            single = self.evaluator.evaluate(self.q[i:i+1], self.qd[i:i+1])
+            for key in out :
+                np.testing.assert_allclose(single[key][0], out[key][i], rtol=0, atol=1e-12)
+
+    def test_poses(self):
+        out = self.evaluator.evaluate(self.q, self.qd)
+        np.testing.assert_allclose(np.matmul(out['tool__base'], out['base__tool']),
+                                   np.broadcast_to(np.identity(4), (7, 4, 4)), rtol=0, atol=1e-12)
+        np.testing.assert_allclose(out['tool__base'][:,3,:], np.broadcast_to([0, 0, 0, 1], (7, 4)))
+
+    def test_derivatives(self):
+        # the joints move with constant velocity qd, thus the derivative of
+        # the velocities is the bias acceleration
+        ev = self.evaluator
+        h = 1e-6
+        out   = ev.evaluate(self.q, self.qd)
+        plus  = ev.evaluate(self.q + h*self.qd, self.qd)
+        minus = ev.evaluate(self.q - h*self.qd, self.qd)
+        jacobians = {gJacobianIdentifier(J) : J for J in ev.solverModel.output['jacobian']}
+        for target, reference in self.pairs :
+            pose = target + "__" + reference
+            X  = out[pose]
+            Xd = (plus[pose] - minus[pose]) / (2*h)
+            R  = X[:,0:3,0:3]
+            # the twist in target coordinates, from the derivative of the pose
+            W = np.einsum('nji,njk->nik', R, Xd[:,0:3,0:3])
+            w = np.stack( (W[:,2,1], W[:,0,2], W[:,1,0]), axis=1 )
+            v = np.einsum('nji,nj->ni', R, Xd[:,0:3,3])
+            twist = out['v__' + pose]
+            np.testing.assert_allclose(twist, np.concatenate((w, v), axis=1), rtol=0, atol=1e-7)
+
+            J = jacobians['J_' + target + '_' + reference]
+            # the column of a fixed joint is zero
+            qd = np.stack( [self.qd[:, ev.generator.jointNum(joint)] if joint.kind != JointKind.fixed else np.zeros(7)
+                            for joint in J.joints], axis=1 )
+            Jqd = np.einsum('nij,nj->ni', out['J_' + target + '_' + reference], qd)
+            expected = np.concatenate( (np.einsum('nij,nj->ni', R, w), Xd[:,0:3,3]), axis=1 )
+            np.testing.assert_allclose(Jqd, expected, rtol=0, atol=1e-7)
+
+            acc = (plus['v__' + pose] - minus['v__' + pose]) / (2*h)
+            np.testing.assert_allclose(out['a__' + pose], acc, rtol=0, atol=1e-7)
+
+    def test_inputs(self):
+        with self.assertRaises(ValueError) :
+            self.evaluator.evaluate(self.q)
+        with self.assertRaises(ValueError) :
+            self.evaluator.evaluate(self.q[:,1:], self.qd[:,1:])
+        with self.assertRaises(ValueError) :
+            self.evaluator.evaluate(self.q, self.qd[1:])
+
+
+if __name__ == "__main__" :
+    unittest.main()
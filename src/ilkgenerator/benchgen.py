@@ -0,0 +1,175 @@
+'''
+Benchmark of the generation pipeline, on synthetic robot models.
+
+The robot models are built in memory, from the URDF text of serial chains,
+branched trees and humanoid-like trees with 6 to 500 joints. The query of each
+robot, randomized with a fixed seed, asks for poses, velocities and Jacobians.
+
+Each stage of the pipeline is timed separately:
+
+- validate: the validation of the query (query.QueryParser.validate)
+- solver-model: the construction of the FK solver models, including:
+- compose: the search of the compositions (optcompose.allComposes)
+- generate: the ILK text of the solvers (SweepingSolverGenerator.lua)
+- constants: the Lua table of the constants (robotconstants.asLuaTable)
+
+The timings are the best of a number of repetitions. Run with:
+
+    python -m ilkgenerator.benchgen [--seed S] [--repeat R] [--max-joints J] [--json FILE]
+'''
+
+import argparse, io, json, math, platform, random, sys, time
+
+import robmodel.convert.urdf.imp as urdfin
+
+from ilkgenerator import benchplanners
+from ilkgenerator import generator
+from ilkgenerator import optcompose
+from ilkgenerator import query
+from ilkgenerator import robotconstants
+from ilkgenerator import solvermodel
+from ilkgenerator.main import RobotModels
+
+# The version of the format of the JSON report
+reportVersion = 1
+
+stages = ['validate', 'solver-model', 'compose', 'generate', 'constants']
+
+
+def robotURDF(name, parents, rnd):
+    '''The URDF text of a robot with the given tree (see module benchplanners),
+    with random joint placements. One joint every seven is prismatic.'''
+    lines = ['<robot name="{0}">'.format(name), '<link name="l0"/>']
+    for i in range(1, len(parents)) :
+        kind = "prismatic" if i % 7 == 0 else "revolute"
+        xyz = " ".join( ["{0:.4f}".format(rnd.uniform(-0.3, 0.3)) for _ in range(0, 3)] )
+        rpy = " ".join( ["{0:.4f}".format(rnd.uniform(-math.pi, math.pi)) for _ in range(0, 3)] )
+        lines.append('<link name="l{0}"/>'.format(i))
+        lines.append('<joint name="j{0}" type="{1}"><parent link="l{2}"/><child link="l{0}"/>'
+                     '<origin xyz="{3}" rpy="{4}"/><axis xyz="0 0 1"/>'
+                     '<limit lower="-1" upper="1" effort="1" velocity="1"/></joint>'.format(i, kind, parents[i], xyz, rpy))
+    lines.append('</robot>')
+    return "\n".join(lines)
+
+
+def robotModels(urdfText):
+    '''The RobotModels of the robot with the given URDF text, without any file'''
+    wrapper = urdfin.URDFWrapper(io.StringIO(urdfText))
+    connectivity, tree, frames, geometry, inertia = urdfin.convert(wrapper)
+    return RobotModels(robot=tree, frames=frames, geometry=geometry)
+
+
+def randomQuery(name, parents, rnd):
+    '''The data of a query with a single FK solver, for the robot with the
+    given tree: the poses of all the leaves relative to the base plus some
+    random pairs, some random velocities, the Jacobians of the leaves'''
+    link = lambda n : "l{0}".format(n)
+    leaves = [n for n in range(1, len(parents)) if n not in parents][:10]
+    pairs = [tuple(rnd.sample(range(0, len(parents)), 2)) for _ in range(0, 10)]
+    poses = [(leaf, 0) for leaf in leaves] + pairs
+    vels  = [tuple(rnd.sample(range(0, len(parents)), 2)) for _ in range(0, 5)]
+    outputs = {
+        'poses'     : [{'target': link(t), 'reference': link(r)} for t, r in poses],
+        'velocities': [{'target': link(t), 'reference': link(r), 'kind': '6D', 'cframe': 'x'} for t, r in vels],
+        'jacs'      : [{'target': link(leaf), 'reference': link(0)} for leaf in leaves],
+    }
+    return {'robot': name, 'solvers': [{'name': 'fk', 'kind': 'sweeping', 'outputs': outputs}]}
+
+
+def benchRobots(maxJoints=500):
+    '''The names and the trees of the synthetic robots, with at most the given
+    number of joints'''
+    trees = [('chain-6'  , benchplanners.chainTree(6)),
+             ('chain-50' , benchplanners.chainTree(50)),
+             ('chain-200', benchplanners.chainTree(200)),
+             ('chain-500', benchplanners.chainTree(500)),
+             ('tree-4x10', benchplanners.branchedTree(4, 10)),
+             ('tree-10x50', benchplanners.branchedTree(10, 50)),
+             ('humanoid' , benchplanners.humanoidTree()),
+             ('humanoid-large', benchplanners.humanoidTree(armLength=60, legLength=50))]
+    return [(name, parents) for name, parents in trees if len(parents) - 1 <= maxJoints]
+
+
+def benchCase(name, parents, seed=0, repeat=3):
+    '''The result of the benchmark of a single robot, as a dictionary'''
+    rnd = random.Random(seed)
+    models = robotModels( robotURDF(name, parents, rnd) )
+    userq  = query.queryFromDictionary( randomQuery(name, parents, rnd) )
+    best = {stage: float('inf') for stage in stages}
+    for _ in range(0, repeat) :
+        seconds = {stage: 0.0 for stage in stages}
+        def timedComposes(paths, engine=None):
+            t0 = time.perf_counter()
+            composes = optcompose.allComposes(paths, engine)
+            seconds['compose'] += time.perf_counter() - t0
+            return composes
+
+        t0 = time.perf_counter()
+        qparser = query.QueryParser(models.robot, models.frames, None)
+        sweepingSolvers, _ = qparser.validate(userq)
+        t1 = time.perf_counter()
+        solverModels = [solvermodel.FKSolverModel(specs, planner=timedComposes) for specs in sweepingSolvers]
+        t2 = time.perf_counter()
+        texts = [generator.SweepingSolverGenerator(model).lua() for model in solverModels]
+        t3 = time.perf_counter()
+        robotconstants.asLuaTable(models.geometry)
+        t4 = time.perf_counter()
+
+        seconds['validate'] = t1 - t0
+        seconds['solver-model'] = t2 - t1
+        seconds['generate'] = t3 - t2
+        seconds['constants'] = t4 - t3
+        for stage in stages :
+            best[stage] = min(best[stage], seconds[stage])
+
+    specs = sweepingSolvers[0]
+    return {
+        'name'   : name,
+        'joints' : len(parents) - 1,
+        'outputs': {'poses': len(specs.poses), 'velocities': len(specs.vels), 'jacobians': len(specs.jacs)},
+        'composeOps': sum( [sum(model.composeOpsCount()) for model in solverModels] ),
+        'textBytes' : sum( [len(text) for text in texts] ),
+        'seconds': best,
+    }
+
+
+def run(seed=0, repeat=3, maxJoints=500):
+    '''The report of the whole benchmark, as a JSON-compatible dictionary'''
+    return {
+        'version': reportVersion,
+        'python' : platform.python_version(),
+        'seed'   : seed,
+        'repeat' : repeat,
+        'cases'  : [benchCase(name, parents, seed, repeat) for name, parents in benchRobots(maxJoints)],
+    }
+
+
+def reportAsText(report):
+    lines = ["{0:<16} {1:>6} {2:>5}".format("robot", "joints", "ops") +
+             "".join( ["{0:>13}".format(stage) for stage in stages] )]
+    for case in report['cases'] :
+        lines.append("{0:<16} {1:>6} {2:>5}".format(case['name'], case['joints'], case['composeOps']) +
+             "".join( ["{0:>13.4f}".format(case['seconds'][stage]) for stage in stages] ))
+    return "\n".join(lines)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark the generation pipeline on synthetic robots')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--repeat', type=int, default=3,
+            help='the number of repetitions, of which the best time is reported (defaults to 3)')
+    argparser.add_argument('--max-joints', dest='maxJoints', type=int, default=500,
+            help='skip the robots with more joints than this (defaults to 500)')
+    argparser.add_argument('--json', metavar='FILE', dest='json',
+            help='write the results into FILE, in JSON format')
+    args = argparser.parse_args()
+
+    report = run(args.seed, args.repeat, args.maxJoints)
+    print(reportAsText(report))
+    if args.json :
+        with open(args.json, mode='w') as ostream :
+            json.dump(report, ostream, indent=2)
+
+
+if __name__ == "__main__" :
+    main()
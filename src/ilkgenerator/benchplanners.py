@@ -0,0 +1,176 @@
+'''
+Comparison of the composition planners of module optcompose, in terms of the
+number of binary compositions they yield and of their run time.
+
+The paths are computed on synthetic kinematic trees, where each primitive item
+is the pose of a node relative to an adjacent one. Run with:
+
+    python -m ilkgenerator.benchplanners [--seed S] [--beam-width W]
+
+With --scaling, it measures instead how the run time of the greedy planner
+grows with the number of paths, on random pairs of frames of larger trees.
+'''
+
+import argparse, random, time, math
+
+from ilkgenerator import optcompose
+
+
+def chainTree(n):
+    '''The parent of each node of a serial chain with n joints'''
+    return [None] + list(range(0, n))
+
+def branchedTree(branches, length):
+    '''A base with the given number of serial branches'''
+    parents = [None]
+    for b in range(0, branches) :
+        parents.append(0)
+        for i in range(1, length) :
+            parents.append(len(parents) - 1)
+    return parents
+
+def humanoidTree(armLength=7, legLength=6):
+    '''A floating base with a torso, two arms, two legs and a head'''
+    parents = [None]
+    def branch(root, length):
+        for i in range(0, length) :
+            parents.append(root if i==0 else len(parents)-1)
+        return len(parents) - 1
+    torso = branch(0, 3)
+    branch(torso, armLength)
+    branch(torso, armLength)
+    branch(torso, 2)
+    branch(0, legLength)
+    branch(0, legLength)
+    return parents
+
+
+def _ancestors(parents, node):
+    ret = [node]
+    while parents[node] is not None :
+        node = parents[node]
+        ret.append(node)
+    return ret
+
+def treePath(parents, target, reference):
+    '''The sequence of (node, adjacent node) pairs from target to reference'''
+    up   = _ancestors(parents, target)
+    down = _ancestors(parents, reference)
+    common = set(up) & set(down)
+    up   = [n for n in up   if n not in common] + [next(n for n in down if n in common)]
+    down = [n for n in down if n not in common]
+    nodes = up + list(reversed(down))
+    return [(nodes[i], nodes[i+1]) for i in range(0, len(nodes)-1)]
+
+
+def allWrtBase(parents, rnd):
+    return [(n, 0) for n in range(1, len(parents))]
+
+def randomPairs(parents, rnd, count=20):
+    return [tuple(rnd.sample(range(0, len(parents)), 2)) for _ in range(0, count)]
+
+def leavesJacobians(parents, rnd):
+    '''The poses required by the geometric Jacobians of all the leaves'''
+    leaves = [n for n in range(0, len(parents)) if n not in parents]
+    poses = []
+    for leaf in leaves :
+        poses.append( (leaf, 0) )
+        poses.extend( [(n, 0) for n in _ancestors(parents, leaf)[1:-1]] )
+    return poses
+
+
+def benchCases():
+    trees = [('chain-6', chainTree(6)), ('chain-30', chainTree(30)),
+             ('tree-3x5', branchedTree(3, 5)), ('humanoid', humanoidTree())]
+    requests = [('all-wrt-base', allWrtBase), ('random-pairs', randomPairs),
+                ('jacobians', leavesJacobians)]
+    for tname, parents in trees :
+        for rname, request in requests :
+            yield tname + "/" + rname, parents, request
+
+
+def _paths(parents, poses, interner):
+    return [optcompose.Path(
+                [optcompose.HomogenoeusComposable([ "{0}>{1}".format(*edge) ]) for edge in treePath(parents, *pose)],
+                interner=interner)
+            for pose in set(poses) if pose[0] != pose[1]]
+
+
+def run(seed=0, beamWidth=64):
+    '''Yields, for each case, the name, the number of paths, a lower bound of
+    the number of compositions (one per path), and the number of compositions
+    and the seconds of the greedy and of the optimal planner'''
+    for name, parents, request in benchCases() :
+        poses = request(parents, random.Random(seed))
+        results = []
+        for planner in [optcompose.allComposes, optcompose.optimalComposes] :
+            paths = _paths(parents, poses, optcompose.Interner())
+            t0 = time.perf_counter()
+            if planner is optcompose.optimalComposes :
+                composes = planner(paths, beamWidth=beamWidth)
+            else :
+                composes = planner(paths)
+            results.append( (optcompose.composeOpsCount(composes), time.perf_counter() - t0) )
+        bound = len([p for p in paths if p.len() > 1])
+        yield (name, len(paths), bound) + results[0] + results[1]
+
+
+def scaling(seed=0, counts=(50, 100, 200, 400, 800), engine=None):
+    '''Yields, for each tree and number of random pairs, the name, the number
+    of paths, the number of paths composed in place by the greedy planner
+    (i.e. the total size of the `involved` lists, which is proportional to the
+    size of its output), and its seconds'''
+    trees = [('chain-400', chainTree(400)), ('tree-20x40', branchedTree(20, 40)),
+             ('humanoid-60', humanoidTree(60, 50))]
+    for tname, parents in trees :
+        for count in counts :
+            poses = randomPairs(parents, random.Random(seed), count)
+            paths = _paths(parents, poses, optcompose.Interner())
+            t0 = time.perf_counter()
+            composes = optcompose.allComposes(paths, engine)
+            seconds = time.perf_counter() - t0
+            yield tname, len(paths), sum([len(c.involved) for c in composes]), seconds
+
+
+def _slope(previous, current):
+    '''The exponent of the growth between two (x, y) points'''
+    if previous is None or previous[1] <= 0 :
+        return float('nan')
+    return math.log(current[1] / previous[1]) / math.log(current[0] / previous[0])
+
+
+def mainScaling(args):
+    print("{0:<14} {1:>5} {2:>8} {3:>9} {4:>9} {5:>9}".format(
+        "tree", "paths", "involved", "seconds", "exp-inv", "exp-time"))
+    previous = (None, None, None)
+    for tname, npaths, involved, seconds in scaling(args.seed, engine=optcompose.engines[args.engine]) :
+        if tname != previous[0] :
+            previous = (tname, None, None)
+        print("{0:<14} {1:>5} {2:>8} {3:>9.3f} {4:>9.2f} {5:>9.2f}".format(
+            tname, npaths, involved, seconds,
+            _slope(previous[1], (npaths, involved)), _slope(previous[2], (npaths, seconds))))
+        previous = (tname, (npaths, involved), (npaths, seconds))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Compare the composition planners')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--beam-width', dest='beamWidth', type=int, default=64)
+    argparser.add_argument('--scaling', action='store_true',
+        help='measure the run time of the greedy planner against the number of paths')
+    argparser.add_argument('--engine', default=optcompose.defaultEngine.name,
+        choices=sorted(optcompose.engines.keys()), help='the engine of the --scaling measure')
+    args = argparser.parse_args()
+    if args.scaling :
+        mainScaling(args)
+        return
+
+    print("{0:<26} {1:>5} {2:>6} {3:>8} {4:>8} {5:>6} {6:>9} {7:>9}".format(
+        "case", "paths", "bound", "greedy", "optimal", "saved", "greedy-s", "optimal-s"))
+    for name, npaths, bound, gops, gsec, oops, osec in run(args.seed, args.beamWidth) :
+        print("{0:<26} {1:>5} {2:>6} {3:>8} {4:>8} {5:>6} {6:>9.3f} {7:>9.3f}".format(
+            name, npaths, bound, gops, oops, gops - oops, gsec, osec))
+
+
+if __name__ == "__main__" :
+    main()
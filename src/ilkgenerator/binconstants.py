@@ -0,0 +1,190 @@
+'''
+A compact binary format for the constant transforms of a robot, alongside
+the Lua table of `model-constants.lua`.
+
+The file keeps the full precision of the values, and can be loaded without
+any parsing: the matrices are memory-mapped with numpy.memmap. This module
+depends only on NumPy, so that runtime and offline tools can use it without
+the rest of the generator.
+
+The layout of the file, with all the numbers in little-endian order:
+
+- the header, 20 bytes: the magic string b'ILKC', the format version and the
+  size in bytes of each value (uint16 each; 8 for float64, 4 for float32),
+  the number of matrices, the number of names and the length in bytes of the
+  names block (uint32 each)
+- for each name, the index of its matrix (uint32)
+- the names block: the UTF-8 names separated by newlines
+- padding with zeros, up to a multiple of 8 bytes from the file start
+- the matrices, each one the first three rows of a homogeneous transform,
+  i.e. 3 x 4 values in row-major order
+
+Different names may share the same matrix, like the aliases of the identity.
+
+Writing and loading:
+
+    binconstants.write(ostream, names, matrices, 'float32')
+    constants = binconstants.load('model-constants.bin')
+    constants['base__link1']   # a 3 x 4 array
+'''
+
+import os, struct, tempfile, unittest
+import numpy as np
+
+magic = b'ILKC'
+formatVersion = 1
+
+_header = struct.Struct('<4sHHIII')
+_dtypes = {8: '<f8', 4: '<f4'}
+
+
+def write(ostream, names, matrices, dtype='float64', aliases=None):
+    '''Writes the given transforms into the binary stream.
+
+    `names` is a list with the identifier of each matrix, `matrices` an array
+    of shape N x 4 x 4 (or N x 3 x 4) in the same order. `aliases` maps other
+    names to one of the `names`, whose matrix they share.
+    '''
+    aliases = aliases or {}
+    values = np.ascontiguousarray( np.asarray(matrices)[:,0:3,0:4], dtype=np.dtype(dtype).newbyteorder('<') )
+    index = {name: i for i, name in enumerate(names)}
+    allNames = list(names) + list(aliases.keys())
+    indices = [index[name] for name in names] + [index[target] for target in aliases.values()]
+    namesBlock = "\n".join(allNames).encode('utf-8')
+
+    head = _header.pack(magic, formatVersion, values.itemsize, values.shape[0], len(allNames), len(namesBlock))
+    head += struct.pack('<{0}I'.format(len(indices)), *indices) + namesBlock
+    ostream.write(head)
+    ostream.write(b'\0' * (-len(head) % 8))
+    ostream.write(values.tobytes())
+
+
+class BinaryConstants:
+    '''The transforms of a binary constants file, memory-mapped.
+
+    `matrices` is the read-only N x 3 x 4 array of the file, `index` maps each
+    name to its row in `matrices`.
+    '''
+
+    def __init__(self, matrices, index):
+        self.matrices = matrices
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.matrices[self.index[name]]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def names(self):
+        return list(self.index.keys())
+
+    def homogeneous(self, name):
+        '''The 4 x 4 homogeneous transform with the given name, as float64'''
+        X = np.identity(4)
+        X[0:3,:] = self[name]
+        return X
+
+
+def load(fileName):
+    '''The BinaryConstants in the given file'''
+    with open(fileName, mode='rb') as istream :
+        head = istream.read(_header.size)
+        if len(head) != _header.size :
+            raise ValueError("'{0}' is not a binary constants file".format(fileName))
+        tag, version, itemsize, count, namesCount, namesLength = _header.unpack(head)
+        if tag != magic :
+            raise ValueError("'{0}' is not a binary constants file".format(fileName))
+        if version != formatVersion or itemsize not in _dtypes :
+            raise ValueError("Unsupported binary constants file '{0}' (version {1}, value size {2})".format(
+                fileName, version, itemsize))
+        indices = struct.unpack('<{0}I'.format(namesCount), istream.read(4 * namesCount))
+        names = istream.read(namesLength).decode('utf-8').split("\n") if namesCount > 0 else []
+    offset = _header.size + 4 * namesCount + namesLength
+    offset += -offset % 8
+    if count > 0 :
+        matrices = np.memmap(fileName, dtype=_dtypes[itemsize], mode='r', offset=offset, shape=(count, 3, 4))
+    else :
+        matrices = np.zeros( (0, 3, 4), dtype=_dtypes[itemsize] )
+    return BinaryConstants(matrices, dict(zip(names, indices)))
+
+
+class TestBinaryConstants(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        rnd = np.random.RandomState(0)
+        self.names = ['a__b', 'b__a', 'c__b', '_identity_']
+        self.matrices = rnd.uniform(-1, 1, (4, 4, 4))
+        self.matrices[:,3,:] = [0, 0, 0, 1]
+        self.matrices[3] = np.identity(4)
+        self.aliases = {'d__c': '_identity_', 'c__d': '_identity_'}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def written(self, fileName, *args, **kwargs):
+        path = os.path.join(self.directory.name, fileName)
+        with open(path, mode='wb') as ostream :
+            write(ostream, *args, **kwargs)
+        return path
+
+    def test_roundtrip(self):
+        for dtype, exact in [('float64', True), ('float32', False)] :
+            path = self.written(dtype + '.bin', self.names, self.matrices, dtype, self.aliases)
+            constants = load(path)
+            self.assertEqual(len(constants), 6)
+            self.assertEqual(sorted(constants.names()), sorted(self.names + list(self.aliases.keys())))
+            self.assertEqual(constants.matrices.shape, (4, 3, 4))
+            self.assertEqual(constants.matrices.dtype, np.dtype(dtype))
+            for name, X in zip(self.names, self.matrices) :
+                if exact :
+                    np.testing.assert_array_equal(constants[name], X[0:3,:])
+                else :
+                    np.testing.assert_array_equal(constants[name], X[0:3,:].astype(np.float32))
+                np.testing.assert_allclose(constants.homogeneous(name), X, rtol=0, atol=1e-7)
+            for alias in self.aliases :
+                self.assertIn(alias, constants)
+                np.testing.assert_array_equal(constants.homogeneous(alias), np.identity(4))
+            self.assertNotIn('x__y', constants)
+
+    def test_layout(self):
+        # names of odd lengths, so that the padding is required
+        for names in [['a'], ['ab', 'cde'], ['abc', 'de', 'fghij']] :
+            path = self.written('layout.bin', names, self.matrices[0:len(names)], 'float32')
+            with open(path, mode='rb') as istream :
+                data = istream.read()
+            head = _header.unpack(data[0:_header.size])
+            self.assertEqual(head, (magic, formatVersion, 4, len(names), len(names), len("\n".join(names))))
+            values = len(names) * 12 * 4
+            offset = len(data) - values
+            self.assertEqual(offset % 8, 0)
+            self.assertLess(offset - (_header.size + 4*len(names) + head[5]), 8)
+            np.testing.assert_array_equal(np.frombuffer(data[offset:], dtype='<f4').reshape(-1, 3, 4),
+                                          self.matrices[0:len(names), 0:3, :].astype(np.float32))
+            self.assertEqual(load(path).names(), names)
+
+    def test_empty(self):
+        path = self.written('empty.bin', [], np.zeros((0, 4, 4)))
+        constants = load(path)
+        self.assertEqual(len(constants), 0)
+        self.assertEqual(constants.matrices.shape, (0, 3, 4))
+
+    def test_header(self):
+        path = self.written('good.bin', self.names, self.matrices)
+        with open(path, mode='rb') as istream :
+            data = istream.read()
+        bad = os.path.join(self.directory.name, 'bad.bin')
+        for content in [data[0:10], b'XXXX' + data[4:],
+                        data[0:4] + struct.pack('<H', formatVersion + 1) + data[6:],
+                        data[0:6] + struct.pack('<H', 2) + data[8:]] :
+            with open(bad, mode='wb') as ostream :
+                ostream.write(content)
+            with self.assertRaises(ValueError) :
+                load(bad)
+
+
+if __name__ == "__main__" :
+    unittest.main()
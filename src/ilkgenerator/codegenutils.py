@@ -1,13 +1,126 @@
-import math
+import math, os, time, hashlib, tempfile, unittest
+import importlib.util
+from collections import OrderedDict, namedtuple
 import numpy as np
-from mako.template import Template
 
 
 
+TemplateCacheStats = namedtuple('TemplateCacheStats',
+    ['hits', 'misses', 'diskLoads', 'compileSeconds', 'size'])
+
+class TemplateCache:
+    '''A keyed cache of compiled Mako templates.
+
+    The key is the source text of the template. The cache keeps at most
+    `maxsize` entries, evicting the least recently used one when full.
+
+    If a `moduleDirectory` is given, the Python module Mako generates for a
+    template is also stored in that directory, so that later processes can
+    load it instead of compiling the template source again.
+    '''
+
+    def __init__(self, maxsize=256, moduleDirectory=None):
+        self.maxsize = maxsize
+        self.moduleDirectory = moduleDirectory
+        self._templates = OrderedDict()
+        self.resetStats()
+
+    def configure(self, maxsize=None, moduleDirectory=None):
+        if maxsize is not None :
+            self.maxsize = maxsize
+            while len(self._templates) > self.maxsize :
+                self._templates.popitem(last=False)
+        if moduleDirectory is not None :
+            os.makedirs(moduleDirectory, exist_ok=True)
+            self.moduleDirectory = moduleDirectory
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.diskLoads = 0
+        self.compileSeconds = 0.0
+
+    def stats(self):
+        return TemplateCacheStats(hits=self.hits, misses=self.misses,
+                    diskLoads=self.diskLoads, compileSeconds=self.compileSeconds,
+                    size=len(self._templates))
+
+    def clear(self):
+        self._templates.clear()
+
+    def get(self, templateText):
+        '''The compiled template for the given source text'''
+        tpl = self._templates.get(templateText)
+        if tpl is not None :
+            self.hits += 1
+            self._templates.move_to_end(templateText)
+            return tpl
+
+        self.misses += 1
+        tpl = None
+        if self.moduleDirectory is not None :
+            tpl = self._loadModule(templateText)
+        if tpl is None :
+            # Mako is imported here rather than at module level, so that the
+            # template-free emitters (see module `emitter`) do not require it
+            from mako.template import Template
+            start = time.perf_counter()
+            tpl = Template(templateText)
+            self.compileSeconds += time.perf_counter() - start
+            if self.moduleDirectory is not None :
+                self._storeModule(templateText, tpl)
+
+        self._templates[templateText] = tpl
+        if len(self._templates) > self.maxsize :
+            self._templates.popitem(last=False)
+        return tpl
+
+    def _modulePath(self, templateText):
+        # the module generated by a different version of Mako may not work
+        # with the current one
+        import mako
+        key = hashlib.sha1((mako.__version__ + "\n" + templateText).encode('utf-8')).hexdigest()
+        return os.path.join(self.moduleDirectory, "tpl_" + key + ".py")
+
+    def _loadModule(self, templateText):
+        path = self._modulePath(templateText)
+        if not os.path.isfile(path) :
+            return None
+        spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.diskLoads += 1
+        from mako.template import ModuleTemplate
+        return ModuleTemplate(module, module_filename=path, template_source=templateText)
+
+    def _storeModule(self, templateText, tpl):
+        path = self._modulePath(templateText)
+        fd, tmp = tempfile.mkstemp(dir=self.moduleDirectory, suffix=".tmp")
+        with os.fdopen(fd, mode='w', encoding='utf-8') as ostream :
+            ostream.write(tpl.code)
+        os.replace(tmp, path)
+
+
+# The process-wide cache used by all the generators of this package
+templateCache = TemplateCache()
+
+def compiledTemplate(templateText):
+    '''The compiled Mako template for the given text, from the process-wide
+    cache'''
+    return templateCache.get(templateText)
+
+
+def renderInto(template, ostream, context):
+    '''Renders the given compiled template with the given context (a
+    dictionary) directly into the given file-like object'''
+    from mako.runtime import Context
+    template.render_context( Context(ostream, **context) )
+
+
 def singleItemTemplateRenderer(templateCode, itemNameInTemplate, context):
     '''Given a template with one parameter, returns a function that instantiates
     it (i.e. returns text) with the given item'''
-    tpl = Template(templateCode)
+    tpl = compiledTemplate(templateCode)
 
     def generator(item):
         context[itemNameInTemplate] = item
@@ -30,10 +143,7 @@ def commaSeparated(sequence, renderer):
 
 
 def numericArrayToText(numeric, formatter):
-    text = np.empty( shape=np.shape(numeric), dtype='U16')
-    for index in np.ndindex( np.shape(numeric) ) :
-        text[index] = formatter.float2str( numeric[index] )
-    return text
+    return formatter.array2str(numeric)
 
 
 class FloatsFormatter :
@@ -48,6 +158,10 @@ class FloatsFormatter :
         self.formatStr = '0:' + str(self.round_decimals)
 
     def float2str(self, num, angle=False ) :
+        # a Python float, rounded with the correctly rounded round(); a NumPy
+        # scalar would be rounded with np.round(), which may differ on values
+        # halfway between two roundings
+        num = float(num)
         if angle :
             value = round(num, self.pi_round_decimals)
             sign  = "-" if value<0 else ""
@@ -61,3 +175,126 @@ class FloatsFormatter :
 
         return( ( "{" + self.formatStr + "}" ).format( num ) )
 
+    def array2str(self, numeric, angle=False) :
+        '''Same as float2str(), for all the elements of an array at once.
+        Returns an array of strings with the same shape, as wide as the longest
+        string.'''
+        values = np.asarray(numeric, dtype=float)
+        if values.size == 0 :
+            return np.empty(values.shape, dtype=str)
+        num = _rounded(values, self.round_decimals) + 0.0  # no '-0.0', as above
+        # astype(str) gives the shortest repr, like the format string, which
+        # also right-aligns to the given width
+        text = np.char.rjust(num.astype(str), self.round_decimals)
+        if angle :
+            value = _rounded(values, self.pi_round_decimals)
+            sign  = np.where(value < 0, "-", "")
+            isPI     = np.abs(value) == self.roundedPI
+            isHalfPI = np.abs(value) == self.roundedHalfPI
+            text = text.astype( np.result_type(text, '<U' + str(len(self.pi_string)+5)) )
+            text[isPI]     = np.char.add(sign, self.pi_string)[isPI]
+            text[isHalfPI] = np.char.add(sign, self.pi_string + "/2.0")[isHalfPI]
+        return text
+
+
+def _rounded(values, decimals):
+    '''The values rounded like the built-in round(), with NumPy.
+
+    np.round() scales the values by 10^decimals and rounds to an integer: the
+    result is the correctly rounded one, unless the scaled value is too close
+    to a halfway point to tell (or too large to be exact). Those values only
+    are rounded again with round().'''
+    scaled = values * 10.0**decimals
+    result = np.round(values, decimals)
+    magnitude = np.abs(scaled)
+    frac = magnitude - np.floor(magnitude)
+    unsure = (np.abs(frac - 0.5) <= 1e-9 * np.maximum(magnitude, 1.0)) | (magnitude >= 2.0**52) | ~np.isfinite(scaled)
+    if np.any(unsure) :
+        result[unsure] = [round(float(v), decimals) for v in values[unsure]]
+    return result
+
+
+class TestTemplateCache(unittest.TestCase):
+    def test_hit(self):
+        cache = TemplateCache()
+        tpl = cache.get("${x} + ${y}")
+        self.assertIs(cache.get("${x} + ${y}"), tpl)
+        self.assertEqual(tpl.render(x=1, y=2), "1 + 2")
+        stats = cache.stats()
+        self.assertEqual((stats.hits, stats.misses, stats.diskLoads, stats.size), (1, 1, 0, 1))
+
+    def test_eviction(self):
+        cache = TemplateCache(maxsize=2)
+        a = cache.get("a${x}")
+        cache.get("b${x}")
+        cache.get("a${x}")  # now "b" is the least recently used
+        cache.get("c${x}")
+        self.assertEqual(cache.stats().size, 2)
+        self.assertIs(cache.get("a${x}"), a)
+        misses = cache.stats().misses
+        cache.get("b${x}")
+        self.assertEqual(cache.stats().misses, misses + 1)
+
+    def test_disk(self):
+        with tempfile.TemporaryDirectory() as directory :
+            text = "% for i in range(n):\n${i}\n% endfor\n"
+            TemplateCache(moduleDirectory=directory).get(text)
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+            cache = TemplateCache(moduleDirectory=directory)
+            tpl = cache.get(text)
+            self.assertEqual(cache.stats().diskLoads, 1)
+            self.assertEqual(cache.compileSeconds, 0.0)
+            self.assertEqual(tpl.render(n=3), "0\n1\n2\n")
+
+    def test_disk_key(self):
+        import mako
+        with tempfile.TemporaryDirectory() as directory :
+            cache = TemplateCache(moduleDirectory=directory)
+            path = cache._modulePath("${x}")
+            version = mako.__version__
+            try :
+                mako.__version__ = version + ".other"
+                self.assertNotEqual(cache._modulePath("${x}"), path)
+            finally :
+                mako.__version__ = version
+
+
+class TestFloatsFormatter(unittest.TestCase):
+    def setUp(self):
+        self.formatter = FloatsFormatter(round_digits=6)
+        self.rnd = np.random.RandomState(0)
+
+    def check(self, values, angle=False):
+        text = self.formatter.array2str(values, angle)
+        self.assertEqual(text.shape, np.shape(values))
+        for value, t in zip(np.ravel(values), np.ravel(text)) :
+            self.assertEqual(str(t), self.formatter.float2str(float(value), angle))
+            self.assertEqual(str(t), self.formatter.float2str(value, angle))
+
+    def test_halfway(self):
+        # values with 7 decimals ending in 5, where np.round() and the
+        # correctly rounded round() disagree on many values
+        digits = self.rnd.randint(-10**8, 10**8, size=20000)
+        self.check( (digits * 10 + 5) / 1e7 )
+        self.check( np.array([6.8040495, -2.6589265]) )
+
+    def test_magnitudes(self):
+        for exponent in range(-10, 17, 2) :
+            values = self.rnd.uniform(-1, 1, size=2000) * 10.0**exponent
+            self.check( values )
+            self.check( np.round(values, 6) + 5e-7 )
+            self.check( values, angle=True )
+
+    def test_large(self):
+        self.check( np.array([-123456789.123456, 123456789012.5, 1e15, 1e16, -1e17, 1e-7, -5e-7]) )
+        self.assertEqual(str(self.formatter.array2str([-123456789.123456])[0]), '-123456789.123456')
+
+    def test_special(self):
+        self.check( np.array([[0.0, -0.0, 0.5], [-1e-9, math.pi, -math.pi/2]]) )
+        self.check( np.array([math.pi, -math.pi, math.pi/2, -math.pi/2, 1.0]), angle=True )
+        self.check( np.zeros((0,3)) )
+
+
+if __name__ == "__main__" :
+    unittest.main()
@@ -0,0 +1,136 @@
+'''
+An estimate of the run-time cost of the FK solvers, in terms of the number of
+operations of each type and of the scalar multiplications/additions they
+require.
+
+The cost of each operation type is configurable; the default values assume
+3x4 homogeneous transforms for the poses and 6D twists for the velocities,
+with no exploitation of sparsity:
+
+- pose-compose: product of two transforms, R1*R2 and R1*p2 + p1
+- vel-compose: twist coordinate transform (rotation of both parts, plus the
+  cross product with the translation, added to the linear part), plus the
+  sum of the two twists
+- joint-vel-twist: the twist of a joint, scaled by the joint velocity
+- GJac-col: the linear part of a column, cross product of the joint axis with
+  the distance vector
+- GJac-family-col: a column of a Jacobian family, that is the joint axis and
+  position, taken from the joint pose with no arithmetic
+- jacobian-view-col: a column of a Jacobian of a family, which costs like a
+  GJac-col since it depends on the target point of the Jacobian
+- acc-bias-compose: the coordinate transform of the bias acceleration and of
+  the velocity of the second argument, the 6D cross product with the velocity
+  of the first argument, and the two sums
+'''
+
+import os, unittest
+from collections import namedtuple
+
+import yaml
+
+OpCost = namedtuple('OpCost', ['mul', 'add'])
+
+defaultOpCosts = {
+    'pose-compose'   : OpCost(mul=36, add=27),
+    'vel-compose'    : OpCost(mul=24, add=24),
+    'joint-vel-twist': OpCost(mul=1 , add=0 ),
+    'GJac-col'       : OpCost(mul=6 , add=6 ),
+    'GJac-family-col': OpCost(mul=0 , add=0 ),
+    'jacobian-view-col': OpCost(mul=6 , add=6 ),
+    'acc-bias-compose': OpCost(mul=66, add=60),
+}
+
+
+def opCostsFromYAML(istream, base=defaultOpCosts):
+    '''The costs of the operations in the given YAML document, which maps
+    operation names to `{mul: <int>, add: <int>}`; the operations that are not
+    listed keep the cost given in `base`.'''
+    costs = dict(base)
+    data = yaml.safe_load(istream) or {}
+    for op, cost in data.items() :
+        if op not in defaultOpCosts :
+            raise ValueError("Unknown operation '{0}' in the cost table (known ones: {1})".format(
+                op, ", ".join(defaultOpCosts.keys())))
+        costs[op] = OpCost(mul=int(cost.get('mul', 0)), add=int(cost.get('add', 0)))
+    return costs
+
+
+def opCounts(solverModel):
+    '''The number of operations of each type of the given
+    solvermodel.FKSolverModel'''
+    composes = solverModel.composeOpsCount()
+    return {
+        'pose-compose'   : composes.poses,
+        'vel-compose'    : composes.velocities,
+        'joint-vel-twist': len(solverModel.jointVelocitiesExplicit),
+        'GJac-col'       : sum( [len(J.joints) for J in solverModel.geometricJacobians] ),
+        'GJac-family-col': sum( [len(F.joints) for F in solverModel.jacobianFamilies] ),
+        'jacobian-view-col': sum( [len(J.joints) for F in solverModel.jacobianFamilies for J in F.members] ),
+        'acc-bias-compose': len(solverModel.accBiasComposes),
+    }
+
+
+def _total(entries):
+    mul = sum( [e['mul'] for e in entries] )
+    add = sum( [e['add'] for e in entries] )
+    return {'mul': mul, 'add': add, 'flops': mul + add}
+
+
+def solverCost(solverModel, opCosts=defaultOpCosts):
+    '''A dictionary with the count and the cost of each operation type of the
+    given solver model, and the total cost'''
+    ops = {}
+    for op, count in opCounts(solverModel).items() :
+        cost = opCosts[op]
+        ops[op] = {'count': count, 'mul': count * cost.mul, 'add': count * cost.add}
+    return {'name': solverModel.name, 'ops': ops, 'total': _total(ops.values())}
+
+
+def costReport(solverModels, opCosts=defaultOpCosts):
+    '''The cost of each of the given solver models and of all of them; the
+    returned dictionary can be serialized as JSON'''
+    solvers = [solverCost(model, opCosts) for model in solverModels]
+    return {
+        'op-costs': { op : cost._asdict() for op, cost in opCosts.items() },
+        'solvers' : solvers,
+        'total'   : _total( [s['total'] for s in solvers] )
+    }
+
+
+class TestCost(unittest.TestCase):
+    '''Pins the operations of the FK solver of the UR5 sample (see
+    sample/models/ur5.urdf and sample/queries/ur5-simple.yaml)'''
+
+    def solverModel(self, outputs):
+        # imported here, since these modules import this one
+        from ilkgenerator import main, query, solvermodel
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        models = main.loadRobotModels( os.path.join(sample, 'models', 'ur5.urdf') )
+        userq = query.queryFromDictionary( {'robot': 'ur5', 'solvers': [{'name': 'myFK', 'kind': 'sweeping', 'outputs': outputs}]} )
+        specs, _ = main.validateQuery(models, userq)
+        return solvermodel.FKSolverModel(specs[0])
+
+    def test_ur5(self):
+        model = self.solverModel( {
+            'poses'     : [{'target': 'wrist_3', 'reference': 'base'}],
+            'jacs'      : [{'target': 'wrist_3', 'reference': 'base'}],
+            'velocities': [{'target': 'wrist_1', 'reference': 'shoulder', 'kind': '6D', 'cframe': '_unused_'}] } )
+        self.assertEqual(opCounts(model), {'pose-compose': 13, 'vel-compose': 2, 'joint-vel-twist': 1,
+            'GJac-col': 6, 'GJac-family-col': 0, 'jacobian-view-col': 0, 'acc-bias-compose': 0})
+        cost = solverCost(model)
+        self.assertEqual(cost['ops']['vel-compose'], {'count': 2, 'mul': 48, 'add': 48})
+        self.assertEqual(cost['total'], {'mul': 13*36 + 2*24 + 1 + 6*6, 'add': 13*27 + 2*24 + 6*6, 'flops': 553 + 435})
+
+    def test_accelerations(self):
+        model = self.solverModel( {
+            'poses'     : [{'target': 'wrist_3', 'reference': 'base'}],
+            'jdot_qdot' : [{'target': 'wrist_3', 'reference': 'base'}] } )
+        counts = opCounts(model)
+        cost = solverCost(model)
+        self.assertEqual(cost['ops']['acc-bias-compose'],
+            {'count': counts['acc-bias-compose'], 'mul': 66*counts['acc-bias-compose'], 'add': 60*counts['acc-bias-compose']})
+        self.assertEqual(counts['acc-bias-compose'], 5)
+
+
+if __name__ == "__main__" :
+    unittest.main()
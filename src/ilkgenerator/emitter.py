@@ -0,0 +1,305 @@
+'''
+Template-free emitters of the ILK documents.
+
+The classes and functions of this module produce exactly the same text as
+their counterparts based on Mako templates (module `generator` and
+`robotconstants.asLuaTable`), but they write the Lua tables directly into a
+string buffer. They are much faster, and they do not require Mako at all.
+'''
+
+import io, os, unittest
+
+from ilkgenerator import generator
+from ilkgenerator import robotconstants
+from ilkgenerator.generator import poseIdentifier, velocityIdentifier, gJacobianIdentifier, gJacobianFamilyIdentifier
+from ilkgenerator.generator import accelerationIdentifier
+
+from kgprim import core as gr
+
+
+def _joinedLines(indent, lines):
+    '''The text of the given lines, each one with the given indentation and a
+    comma at the end but the last'''
+    lines = list(lines)
+    if not lines :
+        return ""
+    return indent + (",\n" + indent).join(lines) + "\n"
+
+def _writeLines(ostream, indent, lines):
+    '''Writes the text of _joinedLines(), at once'''
+    ostream.write( _joinedLines(indent, lines) )
+
+
+class _FrameNames(dict):
+    '''The names of the frames, computed once per frame.
+
+    The frames of the solver models are attached to the robot links, and their
+    name is looked up through the attached entity, which is comparatively slow;
+    the frames are hashed by identity, thus the lookups in this dictionary are
+    cheap.'''
+    def __missing__(self, frame):
+        name = frame.name
+        self[frame] = name
+        return name
+
+
+class SweepingSolverEmitter(generator.SweepingSolverGenerator):
+    '''Same as generator.SweepingSolverGenerator, without templates.
+
+    The identifiers are built by concatenation from the cached names of the
+    frames, as they make most of the text.'''
+
+    def __init__(self, solvermodel, batched=False, parametric=None):
+        super().__init__(solvermodel, batched, parametric)
+        self.frameNames = _FrameNames()
+
+    def poseID(self, pose):
+        '''Same as generator.poseIdentifier()'''
+        if pose.target == pose.reference :
+            return "_identity_"
+        names = self.frameNames
+        return names[pose.target] + "__" + names[pose.reference]
+
+    def velocityID(self, velocity):
+        '''Same as generator.velocityIdentifier()'''
+        names = self.frameNames
+        return "v__" + names[velocity.target] + "__" + names[velocity.reference]
+
+    def accelerationID(self, velocity):
+        '''Same as generator.accelerationIdentifier()'''
+        names = self.frameNames
+        return "a__" + names[velocity.target] + "__" + names[velocity.reference]
+
+    def lines_modelJoints(self):
+        return [joint.name + " = { kind='" + generator.jointTypeStr(joint) + "', coordinate=" + str(self.jointNum(joint)) + " }"
+                for joint in self.usableJoints]
+
+    def lines_constantPoses(self):
+        return [self.poseID(pose) + "={" + self.constantPoseAttributes(pose) + "}" for pose in self.constantPoses]
+
+    def lines_jointPoses(self):
+        return [self.poseID(pose) + " = { joint='" + pose.joint.name + "', dir='" + generator.directionTag(pose) + "' }"
+                for pose in self.jointPoses]
+
+    def lines_jointVelocityTwists(self):
+        lines = []
+        for jvel in self.solverModel.jointVelocities.values() :
+            velid = self.velocityID(jvel.vel)
+            if jvel.polarity == -1 :
+                refF = self.solverModel.robotFrames.framesByName[jvel.vel.target.name]
+                tgtF = self.solverModel.robotFrames.framesByName[jvel.joint.name]
+                pose = gr.Pose(target=tgtF, reference=refF)
+                lines.append(velid + " = { joint='" + jvel.joint.name + "', polarity=-1, ctransform='" + self.poseID(pose) + "' }")
+            else :
+                lines.append(velid + " = { joint='" + jvel.joint.name + "', polarity=1 }")
+        return lines
+
+    def lines_poseComposes(self):
+        poseID = self.poseID
+        return ["{ op='pose-compose', arg1='" + poseID(c.arg1) + "', arg2='" + poseID(c.arg2) + "', res='" + poseID(c.result) + "' }"
+                for c in self.poseComposes]
+
+    def lines_explicitJointVelTwists(self):
+        return ["{ op='joint-vel-twist', arg='" + self.velocityID(jv) + "' }"
+                for jv in self.explicitJointVelocities]
+
+    def lines_velocityCompose(self):
+        velID = self.velocityID
+        return ["{ op='vel-compose', arg1='" + velID(c.arg1) + "', arg2='" + velID(c.arg2) +
+                "', pose='" + self.poseID(c.pose) + "', res='" + velID(c.result) + "' }"
+                for c in self.velComposes]
+
+    def text_jacobian(self, J):
+        Jid = gJacobianIdentifier(J)
+        firstJointNum = self.jointNum(J.joints[0])
+        head = ("\n    { op='geom-jacobian', name='" + Jid + "', pose='" + self.poseID(J.targetPose) +
+                "', columns=" + str(len(J.joints)) + " },\n")
+        columns = ["{ op='GJac-col', joint='" + J.joints[j].name + "', jac='" + Jid +
+                   "', col=" + str(self.jointNum(J.joints[j])-firstJointNum) +
+                   ", joint_pose='" + self.poseID(J.jointPoses[j]) + "', polarity=" + str(J.polarities[j]) + " }"
+                   for j in range(0, len(J.joints))]
+        return head + _joinedLines("    ", columns)
+
+    def text_jacobianFamily(self, F):
+        Fid = gJacobianFamilyIdentifier(F)
+        head = "\n    { op='geom-jacobian-family', name='" + Fid + "', columns=" + str(len(F.joints)) + " },\n"
+        lines = ["{ op='GJac-family-col', joint='" + F.joints[i].name + "', family='" + Fid + "', col=" + str(i) +
+                 ", joint_pose='" + self.poseID(F.jointPoses[i]) + "', polarity=" + str(F.polarities[i]) + " }"
+                 for i in range(0, len(F.joints))]
+        lines.extend( ["{ op='geom-jacobian-view', name='" + gJacobianIdentifier(J) + "', family='" + Fid +
+                       "', pose='" + self.poseID(J.targetPose) + "', cols={" + ",".join([str(c) for c in cols]) + "} }"
+                       for J, cols in zip(F.members, F.memberColumns)] )
+        return head + _joinedLines("    ", lines)
+
+    def lines_accelerations(self):
+        jointVels = self.solverModel.jointVelocities.keys()
+        velID = self.velocityID
+        accID = self.accelerationID
+        def argID(arg):
+            return "_zero_" if arg.v in jointVels else accID(arg)
+        lines = ["{ op='acc-bias-zero', res='" + accID(v) + "' }" for v in self.solverModel.accBiasZero]
+        lines.extend( ["{ op='acc-bias-compose', arg1='" + argID(c.arg1) + "', arg2='" + argID(c.arg2) +
+                       "', vel1='" + velID(c.arg1) + "', vel2='" + velID(c.arg2) + "', pose='" + self.poseID(c.pose) +
+                       "', res='" + accID(c.result) + "' }"
+                       for c in self.solverModel.accBiasComposes] )
+        return lines
+
+    def lines_outputs(self):
+        '''The lines of the four output blocks (poses, velocities, Jacobians,
+        bias accelerations)'''
+        oindex = 0
+        blocks = []
+        for key, otype, toID in [('pose', 'pose', self.poseID),
+                                 ('velocity', 'velocity', self.velocityID),
+                                 ('jacobian', 'jacobian', gJacobianIdentifier),
+                                 ('jdot_qdot', 'jdot_qdot', self.accelerationID)] :
+            lines = []
+            for item in self.solverModel.output[key] :
+                oindex += 1
+                lines.append(toID(item) + " = {otype='" + otype + "', usersort=" + str(oindex) + self.batchTag + " }")
+            blocks.append(lines)
+        return blocks
+
+
+    def lua(self):
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, out):
+        ops_blocks, out_blocks = self.opsAndOutputBlocks()
+        ops_separator = generator.blocksSeparator( ops_blocks )
+        out_separator = generator.blocksSeparator( out_blocks )
+
+        solver = self.solverModel
+        w = out.write
+        w("\nreturn {\n")
+        w("    solverid = '{0}',\n".format(solver.name))
+        w("    solver_type = 'forward',\n")
+        w("    robot_name = '{0}',\n".format(solver.robot.name))
+        w("    joint_space_size = {0},\n".format(len(self.usableJoints)))
+        if self.batched :
+            w("    batch_size = '{0}',\n".format(generator.batchDimension))
+        w("    joints = {\n")
+        _writeLines(out, "        ", self.lines_modelJoints())
+        w("    },\n    poses = {\n        constant = {\n")
+        _writeLines(out, "            ", self.lines_constantPoses())
+        w("        },\n        joint = {\n")
+        _writeLines(out, "            ", self.lines_jointPoses())
+        w("        }\n    },\n    joint_vel_twists = {\n")
+        _writeLines(out, "        ", self.lines_jointVelocityTwists())
+        w("    },\n    ops = {\n")
+        _writeLines(out, "        ", self.lines_poseComposes())
+        w("    " + next(ops_separator) + "\n\n")
+        _writeLines(out, "        ", self.lines_explicitJointVelTwists())
+        w("    " + next(ops_separator) + "\n\n")
+        _writeLines(out, "        ", self.lines_velocityCompose())
+        w("    " + next(ops_separator) + "\n\n")
+        _writeLines(out, "", (self.text_jacobian(J) for J in solver.geometricJacobians))
+        if solver.jacobianFamilies :
+            w("    " + next(ops_separator) + "\n\n")
+            _writeLines(out, "", (self.text_jacobianFamily(F) for F in solver.jacobianFamilies))
+        if solver.output['jdot_qdot'] :
+            w("    " + next(ops_separator) + "\n\n")
+            _writeLines(out, "        ", self.lines_accelerations())
+        w("    },\n\n    outputs = {\n")
+        poses, vels, jacs, accs = self.lines_outputs()
+        _writeLines(out, "        ", poses)
+        w("    " + next(out_separator) + "\n\n")
+        _writeLines(out, "        ", vels)
+        w("    " + next(out_separator) + "\n\n")
+        _writeLines(out, "        ", jacs)
+        if accs :
+            w("    " + next(out_separator) + "\n\n")
+            _writeLines(out, "        ", accs)
+        w("    }\n}\n")
+
+
+class IKEmitter(generator.IKGenerator):
+    '''Same as generator.IKGenerator, without templates'''
+
+    def lua(self):
+        dm = self.declarativeModel
+        return ("\nreturn {\n"
+            "        solverid = '" + dm.name + "',\n"
+            "        solver_type = 'inverse',\n"
+            "        robot_name = '" + dm.robot.name + "',\n"
+            "        kind='" + generator.ikLevelTags[dm.level] + "',\n"
+            "        vectors='" + generator.ikSpaceTags[dm.cfgSpace] + "',\n"
+            "        target='" + dm.targetFrame.name + "',\n"
+            "        reference='" + dm.referenceFrame.name + "',\n"
+            "        fk='" + dm.requiredFK.name + "'\n"
+            "}\n")
+
+    def write(self, ostream):
+        ostream.write(self.lua())
+
+
+def _transformTable(texts, referenced, parameters):
+    name, p, R, name_inv, p_inv, R_inv = texts
+    fmt = ("\n{0} = {{\n"
+           "    p = {{{1}, {2}, {3}}},\n"
+           "    r = {{{4},{5},{6},\n"
+           "         {7},{8},{9},\n"
+           "         {10},{11},{12}}}{13}\n"
+           "}}")
+    entries = [fmt.format(*([n] + list(pp) + list(RR.flat) + [robotconstants.parametricFields(n, parameters)]))
+               for n, pp, RR in ((name, p, R), (name_inv, p_inv, R_inv))
+               if referenced is None or n in referenced]
+    return ",\n".join( entries[0:1] + [e[1:] for e in entries[1:]] )
+
+
+def constantsAsLuaTable(robotGeometryModel, referenced=None, parameters=None):
+    '''Same as robotconstants.asLuaTable(), without templates'''
+    out = io.StringIO()
+    writeConstantsLuaTable(robotGeometryModel, out, referenced, parameters)
+    return out.getvalue()
+
+
+def writeConstantsLuaTable(robotGeometryModel, out, referenced=None, parameters=None):
+    '''Same as robotconstants.writeLuaTable(), without templates'''
+    texts, aliases = robotconstants.prunedTransformTexts(robotGeometryModel, referenced)
+    out.write("\nreturn {\n  poses = {\n")
+    _writeLines(out, "        ", (_transformTable(t, referenced, parameters) for t in texts))
+    if texts :
+        out.write("  ,\n")
+    for j in aliases :
+        out.write(j + " = '_identity_',\n")
+    out.write("  }\n}\n")
+
+
+class TestEmitter(unittest.TestCase):
+    '''Checks that the emitters give the same text as the templates, on the
+    UR5 sample (see sample/models/ur5.urdf and sample/queries/ur5-simple.yaml)'''
+
+    def setUp(self):
+        # imported here, since main imports this module
+        from ilkgenerator import main
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        self.models = main.loadRobotModels( os.path.join(sample, 'models', 'ur5.urdf') )
+        userq = main.loadQuery( os.path.join(sample, 'queries', 'ur5-simple.yaml'), self.models )
+        self.fkSpecs, self.ikSpecs = main.validateQuery(self.models, userq)
+
+    def test_fk(self):
+        from ilkgenerator import solvermodel
+        for batched in [False, True] :
+            model = solvermodel.FKSolverModel(self.fkSpecs[0])
+            expected = generator.SweepingSolverGenerator(model, batched).lua()
+            self.assertEqual(SweepingSolverEmitter(model, batched).lua(), expected)
+
+    def test_ik(self):
+        from ilkgenerator import solvermodel
+        model = solvermodel.IKSolverModel(self.ikSpecs[0])
+        self.assertEqual(IKEmitter(model).lua(), generator.IKGenerator(model).lua())
+        fk = solvermodel.FKSolverModel(model.requiredFK)
+        self.assertEqual(SweepingSolverEmitter(fk).lua(), generator.SweepingSolverGenerator(fk).lua())
+
+    def test_constants(self):
+        geometry = self.models.geometry
+        self.assertEqual(constantsAsLuaTable(geometry), robotconstants.asLuaTable(geometry))
+        referenced = set(['shoulder_pan__base', 'shoulder__shoulder_lift', 'tool__tooljoint'])
+        self.assertEqual(constantsAsLuaTable(geometry, referenced), robotconstants.asLuaTable(geometry, referenced))
+
+
+if __name__ == "__main__" :
+    unittest.main()
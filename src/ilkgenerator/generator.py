@@ -4,7 +4,6 @@ Created on Nov 22, 2018
 @author: marco
 '''
 
-from mako.template import Template
 from collections import namedtuple
 
 from ilkgenerator import query
@@ -27,6 +26,13 @@ def velocityIdentifier(velocity):
 def gJacobianIdentifier(gjac):
     return "J_" + gjac.velocity.target.name + "_" + gjac.velocity.reference.name
 
+def accelerationIdentifier(velocity):
+    '''The identifier of the bias acceleration (J-dot q-dot) of a velocity'''
+    return "a__"+velocity.target.name+"__"+velocity.reference.name
+
+def gJacobianFamilyIdentifier(family):
+    return "JF_" + family.name
+
 
 def jointTypeStr(joint) :
     return joint.kind.name
@@ -46,10 +52,47 @@ def directionTag(jointPose) :
 
 
 
+def blocksSeparator(blocks):
+    '''Yields the text to put between each pair of consecutive blocks, that is
+    a comma if and only if there is something both before and after it'''
+    b = 0
+    somethingBefore = len( blocks[b] ) > 0
+    for b in range(1, len(blocks) ) :
+        sep = ""
+        currentNonEmpty = len( blocks[b] ) > 0
+        if somethingBefore :
+            if currentNonEmpty :
+                sep = ","
+        else :
+            somethingBefore = currentNonEmpty
+        yield sep
+
+
+ikLevelTags = {
+    query.IKLevel.position : "pos",
+    query.IKLevel.velocity : "vel"
+}
+ikSpaceTags = {
+    query.CartesianConfigurationSpace.linear  : "linear",
+    query.CartesianConfigurationSpace.angular : "angular",
+    query.CartesianConfigurationSpace.pose    : "pose",
+}
+
+
 BlockSpec = namedtuple('BlockSpec', ['lineTemplate', 'singleItemName', 'context'])
 
+# The symbolic size of the batch dimension of batched solvers
+batchDimension = 'N'
+
 class SweepingSolverGenerator():
-    def __init__(self, solvermodel):
+    '''The generator of the ILK text of a FK solver.
+
+    If `batched` is True, the solver is tagged as evaluating a batch of joint
+    configurations per call: the text declares the batch dimension, and marks
+    the constant poses as shared by the whole batch and the outputs as having
+    one value per configuration.
+    '''
+    def __init__(self, solvermodel, batched=False, parametric=None):
         poseComposes = []
         for composition in solvermodel.poseComposes :
             poseComposes.extend( composition.asSequenceOfBinaryCompositions() )
@@ -63,6 +106,12 @@ class SweepingSolverGenerator():
         self.constantPoses = sorted(solvermodel.constPoses, key=lambda pose: pose.target.name)
         self.jointPoses    = sorted(solvermodel.jointPoses, key=lambda pose: self.solverModel.robot.jointNum(pose.joint))
         self.usableJoints = [j for j in solvermodel.robot.joints.values() if jointIsValid(j)]
+        self.batched = batched
+        # the identifiers of the constant poses which depend on parameters of
+        # the robot model (see robotconstants.ModelParameters)
+        self.parametric = parametric or set()
+        # the attribute added to the outputs (see also constantPoseAttributes())
+        self.batchTag  = ", batch='" + batchDimension + "'" if batched else ""
 
         def outputIndex(self):
             total = sum( [len(block) for block in self.solverModel.output.values() ] )
@@ -92,11 +141,20 @@ class SweepingSolverGenerator():
         return self.commaSepLines(self.usableJoints, bspec)
 
 
+    def constantPoseAttributes(self, pose):
+        '''The text of the attributes of a constant pose, in the ILK text'''
+        attrs = []
+        if self.batched :
+            attrs.append("batch='shared'")
+        if poseIdentifier(pose) in self.parametric :
+            attrs.append("parametric=true")
+        return " " + ", ".join(attrs) + " " if attrs else ""
+
     def block_constantPoses(self):
         bspec = BlockSpec(
-            lineTemplate = '''${toID(pose)}={}''',
+            lineTemplate = '''${toID(pose)}={${attrs(pose)}}''',
             singleItemName = 'pose',
-            context = {'toID' : poseIdentifier}
+            context = {'toID' : poseIdentifier, 'attrs' : self.constantPoseAttributes}
         )
         return self.commaSepLines(self.constantPoses, bspec)
 
@@ -126,7 +184,7 @@ class SweepingSolverGenerator():
             context = {'velid' : velocityIdentifier(jvel.vel),
                        'joint' : jvel.joint,
                        'pose'  : poseid }
-            return Template(tpl).render(**context)
+            return codegenutils.compiledTemplate(tpl).render(**context)
 
         bspec = BlockSpec(
             lineTemplate = "${line(jvel)}",
@@ -162,7 +220,7 @@ class SweepingSolverGenerator():
                 "columnOps" : self.commaSepLines(range(0,len(J.joints)), column_op ),
                 "columns"   : len(J.joints)
             }
-            return Template(templateText).render(**context)
+            return codegenutils.compiledTemplate(templateText).render(**context)
 
         bspec = BlockSpec(
             lineTemplate = "${block(J)}",
@@ -172,6 +230,88 @@ class SweepingSolverGenerator():
         return self.commaSepLines(self.solverModel.geometricJacobians, bspec)
 
 
+    def block_jacobianFamilies(self):
+        def oneFamily(F):
+            Fid = gJacobianFamilyIdentifier(F)
+            colTemplate  = "{ op='GJac-family-col', joint='${joint.name}', family='${fid}', col=${col}, joint_pose='${pose}', polarity=${polarity} }"
+            viewTemplate = "{ op='geom-jacobian-view', name='${jid}', family='${fid}', pose='${pose}', cols={${cols}} }"
+            def line(item):
+                kind, i = item
+                if kind == 'col' :
+                    context = {'joint': F.joints[i], 'fid': Fid, 'col': i,
+                               'pose': poseIdentifier(F.jointPoses[i]), 'polarity': F.polarities[i]}
+                    return codegenutils.compiledTemplate(colTemplate).render(**context)
+                J = F.members[i]
+                context = {'jid': gJacobianIdentifier(J), 'fid': Fid, 'pose': poseIdentifier(J.targetPose),
+                           'cols': ",".join([str(c) for c in F.memberColumns[i]])}
+                return codegenutils.compiledTemplate(viewTemplate).render(**context)
+
+            ops = BlockSpec(
+                lineTemplate = "${line(item)}",
+                singleItemName = "item",
+                context = {'line' : line}
+            )
+            items = [('col', i) for i in range(0, len(F.joints))] + [('view', i) for i in range(0, len(F.members))]
+            templateText = '''
+    { op='geom-jacobian-family', name='${fid}', columns=${columns} },
+% for op in familyOps :
+    ${op}
+% endfor'''
+            context = {
+                "fid"       : Fid,
+                "familyOps" : self.commaSepLines(items, ops),
+                "columns"   : len(F.joints)
+            }
+            return codegenutils.compiledTemplate(templateText).render(**context)
+
+        bspec = BlockSpec(
+            lineTemplate = "${block(F)}",
+            singleItemName = "F",
+            context = {'block' : oneFamily}
+        )
+        return self.commaSepLines(self.solverModel.jacobianFamilies, bspec)
+
+
+    def block_accelerations(self):
+        '''The ops of the bias accelerations (J-dot q-dot).
+
+        An acc-bias-compose computes res = arg1 + X*arg2 - vel1 x (X*vel2), X
+        being the coordinate transform of the given pose, as for vel-compose.
+        The bias of a joint velocity is zero.
+        '''
+        jointVels = self.solverModel.jointVelocities.keys()
+        def accID(arg):
+            return "_zero_" if arg.v in jointVels else accelerationIdentifier(arg)
+
+        zeroTemplate    = "{ op='acc-bias-zero', res='${res}' }"
+        composeTemplate = "{ op='acc-bias-compose', arg1='${arg1}', arg2='${arg2}', vel1='${vel1}', vel2='${vel2}', pose='${pose}', res='${res}' }"
+        def line(item):
+            kind, x = item
+            if kind == 'zero' :
+                return codegenutils.compiledTemplate(zeroTemplate).render(res=accelerationIdentifier(x))
+            context = {'arg1': accID(x.arg1), 'arg2': accID(x.arg2),
+                       'vel1': velocityIdentifier(x.arg1), 'vel2': velocityIdentifier(x.arg2),
+                       'pose': poseIdentifier(x.pose), 'res': accelerationIdentifier(x.result)}
+            return codegenutils.compiledTemplate(composeTemplate).render(**context)
+
+        bspec = BlockSpec(
+            lineTemplate = "${line(item)}",
+            singleItemName = "item",
+            context = {'line' : line}
+        )
+        items = [('zero', v) for v in self.solverModel.accBiasZero] + [('compose', c) for c in self.solverModel.accBiasComposes]
+        return self.commaSepLines(items, bspec)
+
+
+    def block_outputAccelerations(self):
+        bspec = BlockSpec(
+            lineTemplate = "${toID(v)} = {otype='jdot_qdot', usersort=${next(oindex)}${batch} }",
+            singleItemName = 'v',
+            context = {'toID' : accelerationIdentifier, 'oindex': self.outputVarIndexGenerator, 'batch': self.batchTag}
+        )
+        return self.commaSepLines(self.solverModel.output['jdot_qdot'], bspec)
+
+
     def block_poseComposes(self):
         bspec = BlockSpec(
             lineTemplate = '''{ op='pose-compose', arg1='${toID(c.arg1)}', arg2='${toID(c.arg2)}', res='${toID(c.result)}' }''',
@@ -201,49 +341,60 @@ class SweepingSolverGenerator():
 
     def block_outputPoses(self):
         bspec = BlockSpec(
-            lineTemplate = '''${toID(pose)} = {otype='pose', usersort=${next(oindex)} }''',
+            lineTemplate = '''${toID(pose)} = {otype='pose', usersort=${next(oindex)}${batch} }''',
             singleItemName = 'pose',
-            context = {'toID': poseIdentifier, 'oindex': self.outputVarIndexGenerator}
+            context = {'toID': poseIdentifier, 'oindex': self.outputVarIndexGenerator, 'batch': self.batchTag}
             )
         return self.commaSepLines(self.solverModel.output['pose'], bspec)
 
 
     def block_outputVelocities(self):
         bspec = BlockSpec(
-            lineTemplate = '''${toID(vel)} = {otype='velocity', usersort=${next(oindex)} }''',
+            lineTemplate = '''${toID(vel)} = {otype='velocity', usersort=${next(oindex)}${batch} }''',
             singleItemName = 'vel',
-            context = {'toID' : velocityIdentifier, 'oindex': self.outputVarIndexGenerator}
+            context = {'toID' : velocityIdentifier, 'oindex': self.outputVarIndexGenerator, 'batch': self.batchTag}
         )
         return self.commaSepLines(self.solverModel.output['velocity'], bspec)
 
 
     def block_outputJacobians(self):
         bspec = BlockSpec(
-            lineTemplate = "${toID(gjac)} = {otype='jacobian', usersort=${next(oindex)} }",
+            lineTemplate = "${toID(gjac)} = {otype='jacobian', usersort=${next(oindex)}${batch} }",
             singleItemName = 'gjac',
-            context = {'toID' : gJacobianIdentifier, 'oindex': self.outputVarIndexGenerator}
+            context = {'toID' : gJacobianIdentifier, 'oindex': self.outputVarIndexGenerator, 'batch': self.batchTag}
         )
         return self.commaSepLines(self.solverModel.output['jacobian'], bspec)
 
 
+    def opsAndOutputBlocks(self):
+        '''The lists of the blocks of ops and of outputs, to compute the
+        separators between them. The optional blocks (Jacobian families, bias
+        accelerations) are included only if not empty, as they are rendered
+        only in that case.'''
+        solver = self.solverModel
+        ops_blocks = [ self.poseComposes, self.explicitJointVelocities, self.velComposes, solver.geometricJacobians]
+        out_blocks = [ solver.output['pose'], solver.output['velocity'], solver.output['jacobian'] ]
+        if solver.jacobianFamilies :
+            ops_blocks.append( solver.jacobianFamilies )
+        if solver.output['jdot_qdot'] :
+            ops_blocks.append( solver.accBiasZero + solver.accBiasComposes )
+            out_blocks.append( solver.output['jdot_qdot'] )
+        return ops_blocks, out_blocks
+
     def lua(self):
-        ops_blocks = [ self.poseComposes, self.explicitJointVelocities, self.velComposes, self.solverModel.geometricJacobians]
-        out_blocks = [ self.solverModel.output['pose'],
-                       self.solverModel.output['velocity'],
-                       self.solverModel.output['jacobian'] ]
-
-        def separator(blocks):
-            b = 0
-            somethingBefore = len( blocks[b] ) > 0
-            for b in range(1, len(blocks) ) :
-                sep = ""
-                currentNonEmpty = len( blocks[b] ) > 0
-                if somethingBefore :
-                    if currentNonEmpty :
-                        sep = ","
-                else :
-                    somethingBefore = currentNonEmpty
-                yield sep
+        '''The ILK text of the solver'''
+        t, context = self.template()
+        return t.render(**context)
+
+    def write(self, ostream):
+        '''Writes the ILK text of the solver into the given file-like object,
+        rendering the template directly into it'''
+        t, context = self.template()
+        codegenutils.renderInto(t, ostream, context)
+
+    def template(self):
+        '''The compiled template of the solver and its context'''
+        ops_blocks, out_blocks = self.opsAndOutputBlocks()
 
         realJointsCount = len(self.usableJoints)
         template = '''
@@ -252,6 +403,9 @@ return {
     solver_type = 'forward',
     robot_name = '${solver.robot.name}',
     joint_space_size = ${realJointsCount},
+    % if this.batched :
+    batch_size = '${batchDimension}',
+    % endif
     joints = {
     % for jointspec in this.block_modelJoints() :
         ${jointspec}
@@ -293,6 +447,20 @@ return {
     % for gjac in this.block_jacobians() :
 ${gjac}
     % endfor
+    % if solver.jacobianFamilies :
+    ${ next(ops_separator) }
+
+    % for family in this.block_jacobianFamilies() :
+${family}
+    % endfor
+    % endif
+    % if hasAccelerations :
+    ${ next(ops_separator) }
+
+    % for acc in this.block_accelerations() :
+        ${acc}
+    % endfor
+    % endif
     },
 
     outputs = {
@@ -309,18 +477,27 @@ ${gjac}
     % for J in this.block_outputJacobians() :
         ${J}
     % endfor
+    % if hasAccelerations :
+    ${ next(out_separator) }
+
+    % for a in this.block_outputAccelerations() :
+        ${a}
+    % endfor
+    % endif
     }
 }
 '''
-        t = Template(template)
+        t = codegenutils.compiledTemplate(template)
         context = {
             'this' : self,
             'solver': self.solverModel,
             'realJointsCount' : realJointsCount,
-            'ops_separator' : separator( ops_blocks ),
-            'out_separator' : separator( out_blocks )
+            'batchDimension' : batchDimension,
+            'hasAccelerations': len(self.solverModel.output['jdot_qdot']) > 0,
+            'ops_separator' : blocksSeparator( ops_blocks ),
+            'out_separator' : blocksSeparator( out_blocks )
         }
-        return( t.render(**context) )
+        return t, context
 
 
 class IKGenerator():
@@ -329,15 +506,14 @@ class IKGenerator():
 
 
     def lua(self):
-        levels = {
-            query.IKLevel.position : "pos",
-            query.IKLevel.velocity : "vel"
-        }
-        spaces = {
-            query.CartesianConfigurationSpace.linear  : "linear",
-            query.CartesianConfigurationSpace.angular : "angular",
-            query.CartesianConfigurationSpace.pose    : "pose",
-        }
+        t, context = self.template()
+        return t.render(**context)
+
+    def write(self, ostream):
+        t, context = self.template()
+        codegenutils.renderInto(t, ostream, context)
+
+    def template(self):
         templateText = '''
 return {
         solverid = '${dm.name}',
@@ -350,13 +526,13 @@ return {
         fk='${dm.requiredFK.name}'
 }
 '''
-        t = Template(templateText)
+        t = codegenutils.compiledTemplate(templateText)
         context = {
             'dm' : self.declarativeModel,
-            'level': levels[self.declarativeModel.level],
-            'space': spaces[self.declarativeModel.cfgSpace]
+            'level': ikLevelTags[self.declarativeModel.level],
+            'space': ikSpaceTags[self.declarativeModel.cfgSpace]
         }
-        return t.render(**context)
+        return t, context
 
 
 
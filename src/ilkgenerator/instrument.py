@@ -0,0 +1,103 @@
+'''
+Named timing spans around the stages of the generation pipeline.
+
+The code of the pipeline marks its stages with the `span()` context manager,
+like this:
+
+    with instrument.span('validate') :
+        ...
+
+Spans can be nested. When a span ends, each registered listener is called
+with a `Span` tuple. Without listeners, spans cost almost nothing.
+
+To collect the timings programmatically:
+
+    timings = instrument.Timings()
+    instrument.addListener(timings)
+    ...  # e.g. main.generate()
+    instrument.removeListener(timings)
+    print(timings.asText())
+'''
+
+import time, json
+from collections import namedtuple
+
+# The `path` is the tuple of the names of the enclosing spans, the outermost
+# first; `start` is the value of time.perf_counter() at the beginning
+Span = namedtuple('Span', ['name', 'path', 'start', 'seconds'])
+
+_listeners = []
+_stack = []
+
+
+def addListener(callback):
+    '''Registers a callable, which will be called with each Span that ends'''
+    _listeners.append(callback)
+
+def removeListener(callback):
+    _listeners.remove(callback)
+
+
+class span:
+    '''A context manager timing the enclosed code, as a span with the given
+    name'''
+    __slots__ = ['name', 'start']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        _stack.pop()
+        if _listeners :
+            s = Span(name=self.name, path=tuple(_stack), start=self.start, seconds=seconds)
+            for callback in list(_listeners) :
+                callback(s)
+        return False
+
+
+class Timings:
+    '''A listener collecting all the spans, which reports them as a table or
+    as JSON-compatible data'''
+
+    def __init__(self):
+        self.spans = []
+
+    def __call__(self, span):
+        self.spans.append(span)
+
+    def ordered(self):
+        '''The spans in the order they started, which puts each span before
+        the spans it encloses'''
+        return sorted(self.spans, key=lambda s: (s.start, len(s.path)))
+
+    def total(self):
+        return sum( [s.seconds for s in self.spans if len(s.path) == 0] )
+
+    def asText(self):
+        total = self.total()
+        lines = ["{0:<48} {1:>10} {2:>6}".format("stage", "seconds", "%")]
+        for s in self.ordered() :
+            lines.append("{0:<48} {1:>10.4f} {2:>6.1f}".format(
+                "  " * len(s.path) + s.name, s.seconds, 100.0 * s.seconds / total if total > 0 else 0.0))
+        lines.append("{0:<48} {1:>10.4f}".format("total", total))
+        return "\n".join(lines)
+
+    def asDict(self):
+        if len(self.spans) == 0 :
+            return {'total': 0.0, 'spans': []}
+        origin = min( [s.start for s in self.spans] )
+        return {
+            'total': self.total(),
+            'spans': [{'name': s.name, 'path': list(s.path), 'start': s.start - origin, 'seconds': s.seconds}
+                      for s in self.ordered()]
+        }
+
+    def writeJSON(self, fileName):
+        with open(fileName, mode='w') as ostream :
+            json.dump(self.asDict(), ostream, indent=2)
@@ -0,0 +1,490 @@
+'''
+A vectorized NumPy interpreter of the generated FK solvers.
+
+The interpreter takes the Lua table of a solver, either the text of an `.ilk`
+file or the one produced in memory by a generator, together with the values of
+the constant poses (from `model-constants.lua` or from
+robotconstants.numericTransforms()). It evaluates the solver on batches of
+joint states.
+
+Before any evaluation, the ops are lowered into arrays of indices into the
+arrays of all the poses, velocities and accelerations of the solver. The ops
+are grouped by their depth in the data dependencies, so that all the ops of a
+group are evaluated with a few array operations: there is no Python dispatch
+for each single op inside the batch loop.
+
+The conventions for the values are the same as in module batcheval. Running
+this module as a script reports the throughput of a solver:
+
+    python3 -m ilkgenerator.interpreter <solver.ilk> <model-constants.lua>
+'''
+
+import argparse, os, re, tempfile, time, unittest
+
+import numpy as np
+
+from ilkgenerator import emitter
+from ilkgenerator import robotconstants
+from ilkgenerator.batcheval import transformTwists, crossTwists
+
+
+_tokens = re.compile(r"\s*(?:(--[^\n]*)|([A-Za-z_][A-Za-z0-9_]*)|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|'([^']*)'|\"([^\"]*)\"|([{}=,/-]))")
+
+def _tokenize(text):
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text) :
+        m = _tokens.match(text, pos)
+        if m is None :
+            raise ValueError("Unexpected text at offset {0}: '{1}'".format(pos, text[pos:pos+20]))
+        pos = m.end()
+        comment, name, number, str1, str2, punct = m.groups()
+        if comment is not None :
+            continue
+        if name is not None :
+            yield ('name', name)
+        elif number is not None :
+            yield ('number', float(number))
+        elif str1 is not None or str2 is not None :
+            yield ('string', str1 if str1 is not None else str2)
+        else :
+            yield ('punct', punct)
+
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = list(_tokenize(text))
+        self.i = 0
+
+    def peek(self, offset=0):
+        i = self.i + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.i += 1
+        return token
+
+    def expect(self, kind, value=None):
+        token = self.next()
+        if token[0] != kind or (value is not None and token[1] != value) :
+            raise ValueError("Expected {0} '{1}', found {2}".format(kind, value, token))
+        return token[1]
+
+    def value(self):
+        kind, value = self.peek()
+        if (kind, value) == ('punct', '{') :
+            return self.table()
+        if (kind, value) == ('punct', '-') :
+            self.next()
+            return -self.value()
+        self.next()
+        if kind == 'name' and value == 'pi' :
+            number = np.pi
+        elif kind == 'number' :
+            number = value
+        elif kind == 'string' :
+            return value
+        elif kind == 'name' and value in ('true', 'false') :
+            return value == 'true'
+        else :
+            raise ValueError("Unexpected token {0}".format((kind, value)))
+        if self.peek() == ('punct', '/') :
+            self.next()
+            number = number / self.expect('number')
+        return number
+
+    def table(self):
+        '''A table with keys becomes a dictionary, one without keys a list'''
+        self.expect('punct', '{')
+        keyed = {}
+        items = []
+        while self.peek() != ('punct', '}') :
+            if self.peek() == ('punct', ',') :
+                # the generated text may have empty blocks between separators
+                self.next()
+                continue
+            if self.peek()[0] == 'name' and self.peek(1) == ('punct', '=') :
+                key = self.next()[1]
+                self.next()
+                keyed[key] = self.value()
+            else :
+                items.append( self.value() )
+        self.next()
+        if keyed and items :
+            raise ValueError("Tables with both keyed and positional items are not supported")
+        return items if items else keyed
+
+
+def luaTable(text):
+    '''The Python value of the table in the given Lua text, in the form
+    `return { ... }`. Tables with keys become dictionaries, the others lists.'''
+    parser = _Parser(text)
+    parser.expect('name', 'return')
+    table = parser.table()
+    if parser.peek() != (None, None) :
+        raise ValueError("Unexpected text after the table: {0}".format(parser.peek()))
+    return table
+
+
+def constantsFromLua(table):
+    '''The 4x4 transforms of the table of `model-constants.lua` (as returned by
+    luaTable()), indexed by their identifier'''
+    transforms = {}
+    for name, value in table['poses'].items() :
+        if value == '_identity_' :
+            transforms[name] = np.identity(4)
+        else :
+            X = np.identity(4)
+            X[0:3,0:3] = np.reshape(value['r'], (3,3))
+            X[0:3,3] = value['p']
+            transforms[name] = X
+    return transforms
+
+
+_fixed, _revolute, _prismatic = 0, 1, 2
+_kindCodes = {'revolute': _revolute, 'prismatic': _prismatic}
+
+def _levels(ops, slotLevel):
+    '''Groups the given ops (tuples of slot indices, result last) by their
+    depth in the dependencies, and returns a list with one tuple of index
+    arrays for each group'''
+    groups = []
+    for op in ops :
+        level = max( [slotLevel[arg] for arg in op[:-1]] ) + 1
+        slotLevel[op[-1]] = level
+        while len(groups) < level :
+            groups.append([])
+        groups[level-1].append(op)
+    return [tuple(np.array(column, dtype=np.intp) for column in zip(*group)) for group in groups]
+
+
+class LoweredSolver:
+    '''A FK solver lowered into index arrays, ready for the evaluation.
+
+    The arguments are the table of the solver, as returned by luaTable(), and
+    the dictionary of the constant transforms.
+    '''
+
+    def __init__(self, solverTable, constants):
+        if solverTable.get('solver_type') != 'forward' :
+            raise ValueError("Only the FK solvers can be evaluated (got solver type '{0}')".format(solverTable.get('solver_type')))
+        self.name = solverTable['solverid']
+        self.dofs = int(solverTable['joint_space_size'])
+        joints = solverTable['joints']
+        def kindOf(joint):
+            # fixed joints are not listed in the table
+            return _kindCodes[joints[joint]['kind']] if joint in joints else _fixed
+        def coordinate(joint):
+            return int(joints[joint]['coordinate'])
+
+        poses = {'_identity_': 0}
+        def poseSlot(name):
+            if name not in poses :
+                raise ValueError("Pose '{0}' used before being computed".format(name))
+            return poses[name]
+
+        constNames = list(solverTable['poses']['constant'].keys())
+        missing = [name for name in constNames if name not in constants]
+        if missing :
+            raise ValueError("Missing constant poses: " + ", ".join(missing))
+        for name in constNames :
+            poses[name] = len(poses)
+        self.constSlots  = np.array([poses[name] for name in constNames], dtype=np.intp)
+        self.constValues = np.array([constants[name] for name in constNames]).reshape(-1, 4, 4)
+
+        jointPoses = {_revolute: [], _prismatic: []}
+        for name, spec in solverTable['poses']['joint'].items() :
+            poses[name] = len(poses)
+            sign = 1.0 if spec['dir'] == 'a_x_b' else -1.0
+            jointPoses[kindOf(spec['joint'])].append( (poses[name], coordinate(spec['joint']), sign) )
+        self.jointPoses = {kind: tuple(np.array(column) for column in zip(*items))
+                           for kind, items in jointPoses.items() if items}
+
+        vels = {}
+        accs = {'_zero_': 0}
+        twists = {1: [], -1: []}
+        for name, spec in solverTable['joint_vel_twists'].items() :
+            vels[name] = len(vels)
+            kind = kindOf(spec['joint'])
+            if kind != _fixed :
+                axis = 2 if kind == _revolute else 5
+                # the name of the transform, resolved after the ops
+                twists[int(spec['polarity'])].append( (vels[name], coordinate(spec['joint']), axis, spec.get('ctransform')) )
+
+        poseOps, velOps, accOps = [], [], []
+        columns = []     # (joint pose, target pose, polarity, kind)
+        jacobians = {}   # name -> list of indices in `columns`
+        families = {}    # name -> list of (joint pose, polarity, kind)
+        familyCols = []  # deferred until the target pose of each view is known
+        jacTargets = {}
+        for op in solverTable['ops'] :
+            kind = op['op']
+            if kind == 'pose-compose' :
+                poses[op['res']] = len(poses)
+                poseOps.append( (poseSlot(op['arg1']), poseSlot(op['arg2']), poses[op['res']]) )
+            elif kind == 'joint-vel-twist' :
+                if op['arg'] not in vels :
+                    raise ValueError("Unknown joint velocity '{0}'".format(op['arg']))
+            elif kind == 'vel-compose' :
+                vels[op['res']] = len(vels)
+                velOps.append( (vels[op['arg1']], poseSlot(op['pose']), vels[op['arg2']], vels[op['res']]) )
+            elif kind == 'geom-jacobian' :
+                jacobians[op['name']] = []
+                jacTargets[op['name']] = poseSlot(op['pose'])
+            elif kind == 'GJac-col' :
+                # The columns are in the order of the ops, which is the order
+                # of the joints along the path. The `col` attribute is the
+                # offset of the joint number, which differs from the position
+                # when the path goes from successors to predecessors.
+                jacobians[op['jac']].append( len(columns) )
+                columns.append( (poseSlot(op['joint_pose']), jacTargets[op['jac']], int(op['polarity']), kindOf(op['joint'])) )
+            elif kind == 'geom-jacobian-family' :
+                families[op['name']] = [None] * int(op['columns'])
+            elif kind == 'GJac-family-col' :
+                families[op['family']][int(op['col'])] = (poseSlot(op['joint_pose']), int(op['polarity']), kindOf(op['joint']))
+            elif kind == 'geom-jacobian-view' :
+                # a view is lowered to its own columns, at its target point
+                indices = []
+                for c in op['cols'] :
+                    jp, polarity, jkind = families[op['family']][int(c)]
+                    indices.append( len(columns) )
+                    columns.append( (jp, poseSlot(op['pose']), polarity, jkind) )
+                jacobians[op['name']] = indices
+            elif kind == 'acc-bias-zero' :
+                accs[op['res']] = len(accs)
+            elif kind == 'acc-bias-compose' :
+                accs[op['res']] = len(accs)
+                accOps.append( (accs[op['arg1']], accs[op['arg2']], vels[op['vel1']], vels[op['vel2']],
+                                poseSlot(op['pose']), accs[op['res']]) )
+            else :
+                raise ValueError("Unsupported op '{0}'".format(kind))
+
+        twists[-1] = [(slot, coord, axis, poseSlot(ct)) for slot, coord, axis, ct in twists[-1]]
+        self.twists = {polarity: tuple(np.array(column) for column in zip(*items))
+                       for polarity, items in twists.items() if items}
+
+        self.posesCount = len(poses)
+        self.velsCount  = len(vels)
+        self.accsCount  = len(accs)
+        self.poseLevels = _levels(poseOps, {slot: 0 for slot in poses.values()})
+        self.velLevels  = _levels([(a1, a2, res) for a1, pose, a2, res in velOps], {slot: 0 for slot in vels.values()})
+        self.velPoses   = self._splitPoses(velOps, self.velLevels, 1)
+        accLevel = {slot: 0 for slot in accs.values()}
+        self.accLevels  = _levels([(a1, a2, res) for a1, a2, v1, v2, pose, res in accOps], accLevel)
+        self.accOperands = self._splitPoses(accOps, self.accLevels, 2, 3, 4)
+        self.columns = tuple(np.array(column) for column in zip(*columns)) if columns else None
+
+        self.outputs = []
+        for name, spec in sorted(solverTable['outputs'].items(), key=lambda item: item[1]['usersort']) :
+            otype = spec['otype']
+            if otype == 'pose' :
+                self.outputs.append( (name, otype, poseSlot(name)) )
+            elif otype == 'velocity' :
+                self.outputs.append( (name, otype, vels[name]) )
+            elif otype == 'jacobian' :
+                self.outputs.append( (name, otype, np.array(jacobians[name], dtype=np.intp)) )
+            elif otype == 'jdot_qdot' :
+                self.outputs.append( (name, otype, accs[name]) )
+            else :
+                raise ValueError("Unsupported output type '{0}'".format(otype))
+        self.needsVelocities = any( [otype in ('velocity', 'jdot_qdot') for _, otype, _ in self.outputs] )
+
+    @staticmethod
+    def _splitPoses(ops, levels, *positions):
+        '''The extra operands of the given ops, at the given positions of the op
+        tuples, arranged in index arrays in the same order as the levels'''
+        byResult = {op[-1]: op for op in ops}
+        return [tuple(np.array([byResult[res][p] for res in level[-1]], dtype=np.intp) for p in positions)
+                for level in levels]
+
+    def evaluate(self, q, qd=None, chunkSize=4096):
+        '''The outputs of the solver for the joint positions `q` and velocities
+        `qd` (N x dofs arrays), as a dictionary with the output identifiers as
+        keys, with the same shapes as batcheval.BatchEvaluator.evaluate(). The
+        batch is processed in chunks of at most `chunkSize` configurations.'''
+        q = np.asarray(q, dtype=float)
+        if q.ndim != 2 or q.shape[1] != self.dofs :
+            raise ValueError("Expected an array of shape N x {0} for 'q', got {1}".format(self.dofs, q.shape))
+        if qd is not None :
+            qd = np.asarray(qd, dtype=float)
+            if qd.shape != q.shape :
+                raise ValueError("Expected an array of shape {0} for 'qd', got {1}".format(q.shape, qd.shape))
+        elif self.needsVelocities :
+            raise ValueError("The solver '{0}' requires the joint velocities".format(self.name))
+
+        chunks = [self._evaluate(q[i:i+chunkSize], None if qd is None else qd[i:i+chunkSize])
+                  for i in range(0, max(q.shape[0], 1), chunkSize)]
+        if len(chunks) == 1 :
+            return chunks[0]
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+    def _evaluate(self, q, qd):
+        N = q.shape[0]
+        P = np.empty( (self.posesCount, N, 4, 4) )
+        P[0] = np.identity(4)
+        P[self.constSlots] = self.constValues[:, np.newaxis]
+        for kind, (slots, coords, signs) in self.jointPoses.items() :
+            values = (q[:, coords] * signs).T
+            X = np.zeros( (len(slots), N, 4, 4) )
+            X[...,3,3] = 1.0
+            if kind == _revolute :
+                c, s = np.cos(values), np.sin(values)
+                X[...,0,0] = c
+                X[...,0,1] = -s
+                X[...,1,0] = s
+                X[...,1,1] = c
+                X[...,2,2] = 1.0
+            else :
+                X[...,0,0] = X[...,1,1] = X[...,2,2] = 1.0
+                X[...,2,3] = values
+            P[slots] = X
+        for arg1, arg2, res in self.poseLevels :
+            P[res] = np.matmul(P[arg2], P[arg1])
+
+        out = {}
+        if qd is not None :
+            V = np.zeros( (self.velsCount, N, 6) )
+            if 1 in self.twists :
+                slots, coords, axes, _ = self.twists[1]
+                V[slots, :, axes] = qd[:, coords].T
+            if -1 in self.twists :
+                slots, coords, axes, cts = self.twists[-1]
+                tw = np.zeros( (len(slots), N, 6) )
+                tw[np.arange(len(slots)), :, axes] = qd[:, coords].T
+                V[slots] = -transformTwists(P[cts], tw)
+            for (arg1, arg2, res), (pose,) in zip(self.velLevels, self.velPoses) :
+                V[res] = V[arg1] + transformTwists(P[pose], V[arg2])
+            A = np.zeros( (self.accsCount, N, 6) )
+            for (arg1, arg2, res), (vel1, vel2, pose) in zip(self.accLevels, self.accOperands) :
+                X = P[pose]
+                A[res] = A[arg1] + transformTwists(X, A[arg2]) - crossTwists(V[vel1], transformTwists(X, V[vel2]))
+
+        if self.columns is not None :
+            jp, tp, polarity, kind = self.columns
+            z  = P[jp, :, 0:3, 2]
+            d  = P[tp, :, 0:3, 3] - P[jp, :, 0:3, 3]
+            sign = polarity[:, np.newaxis, np.newaxis]
+            cols = np.zeros( (len(jp), N, 6) )
+            rev  = kind == _revolute
+            pri  = kind == _prismatic
+            cols[rev, :, 0:3] = sign[rev] * z[rev]
+            cols[rev, :, 3:6] = sign[rev] * np.cross(z[rev], d[rev])
+            cols[pri, :, 3:6] = sign[pri] * z[pri]
+
+        for name, otype, index in self.outputs :
+            if otype == 'pose' :
+                out[name] = P[index].copy()
+            elif otype == 'velocity' :
+                out[name] = V[index].copy()
+            elif otype == 'jacobian' :
+                out[name] = np.transpose(cols[index], (1, 2, 0)).copy()
+            else :
+                out[name] = A[index].copy()
+        return out
+
+
+def fromSolverModel(solverModel, robotGeometryModel):
+    '''The LoweredSolver of the given solvermodel.FKSolverModel, with the
+    exact values of the constant poses of the robot'''
+    table = luaTable( emitter.SweepingSolverEmitter(solverModel).lua() )
+    return LoweredSolver(table, robotconstants.numericTransforms(robotGeometryModel))
+
+
+def main():
+    argparser = argparse.ArgumentParser(prog="ilkgen-interpreter",
+                    description='Evaluate a generated FK solver on random joint states, and report the throughput')
+    argparser.add_argument('solver', metavar='SOLVER', help='the .ilk file of the FK solver')
+    argparser.add_argument('constants', metavar='CONSTANTS', help='the model-constants.lua file')
+    argparser.add_argument('-n', '--batch-size', dest='batchSize', type=int, default=100000,
+            help='the number of joint states to evaluate (defaults to 100000)')
+    argparser.add_argument('--chunk', dest='chunk', type=int, default=4096,
+            help='the maximum number of joint states evaluated together (defaults to 4096)')
+    args = argparser.parse_args()
+
+    with open(args.solver) as istream :
+        solverTable = luaTable(istream.read())
+    with open(args.constants) as istream :
+        constants = constantsFromLua(luaTable(istream.read()))
+
+    start = time.perf_counter()
+    solver = LoweredSolver(solverTable, constants)
+    lowering = time.perf_counter() - start
+
+    rng = np.random.RandomState(0)
+    q  = rng.uniform(-np.pi, np.pi, (args.batchSize, solver.dofs))
+    qd = rng.uniform(-1.0, 1.0, (args.batchSize, solver.dofs))
+    start = time.perf_counter()
+    solver.evaluate(q, qd, args.chunk)
+    seconds = time.perf_counter() - start
+    print("{0}: lowered in {1:.4f}s, {2} joint states in {3:.4f}s ({4:.0f} per second)".format(
+        solver.name, lowering, args.batchSize, seconds, args.batchSize / seconds))
+    return 0
+
+
+class TestInterpreter(unittest.TestCase):
+    def test_lua(self):
+        table = luaTable('''
+            -- a comment
+            return {
+                name = 'fk', kind = "sweeping", batched = false,
+                values = { -1.5, 2, pi, -pi/2.0, 1e-3 },
+                ops = { { op='a' }, , { op='b', arg=-0.25 } },
+            }''')
+        self.assertEqual(table['name'], 'fk')
+        self.assertEqual(table['kind'], 'sweeping')
+        self.assertIs(table['batched'], False)
+        self.assertEqual(table['values'], [-1.5, 2.0, np.pi, -np.pi/2.0, 1e-3])
+        self.assertEqual(table['ops'], [{'op': 'a'}, {'op': 'b', 'arg': -0.25}])
+        with self.assertRaises(ValueError) :
+            luaTable("return { a = 1, 2 }")
+        with self.assertRaises(ValueError) :
+            luaTable("return { a = 1 } { }")
+        with self.assertRaises(ValueError) :
+            luaTable("return { a = ; }")
+
+    def test_files(self):
+        '''Generates the files of a solver of the UR5 sample (see
+        sample/models/ur5.urdf), and evaluates them'''
+        # imported here, since main imports this module
+        from ilkgenerator import main, query, solvermodel, batcheval
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        models = main.loadRobotModels( os.path.join(sample, 'models', 'ur5.urdf') )
+        frames = [{'target': t, 'reference': r} for t, r in
+                  [('tool', 'base'), ('base', 'tool'), ('wrist_1', 'shoulder'), ('shoulder', 'wrist_3')]]
+        outputs = {'poses': frames, 'jacs': frames, 'jdot_qdot': frames,
+                   'velocities': [dict(f, kind='6D', cframe='x') for f in frames]}
+        userq = query.queryFromDictionary( {'robot': 'ur5', 'solvers': [{'name': 'fk', 'kind': 'sweeping', 'outputs': outputs}]} )
+        specs = main.validateQuery(models, userq)
+        model = solvermodel.FKSolverModel(specs[0][0])
+        reference = batcheval.BatchEvaluator(model, models.geometry)
+        rnd = np.random.RandomState(0)
+        q  = rnd.uniform(-3, 3, (50, reference.dofs))
+        qd = rnd.uniform(-1, 1, (50, reference.dofs))
+        expected = reference.evaluate(q, qd)
+
+        # the exact constants, with the same result as the reference
+        out = fromSolverModel(model, models.geometry).evaluate(q, qd, chunkSize=16)
+        self.assertEqual(sorted(out.keys()), sorted(expected.keys()))
+        for key in expected :
+            np.testing.assert_allclose(out[key], expected[key], rtol=0, atol=1e-12)
+
+        # the files, whose constants are rounded to 6 decimals
+        with tempfile.TemporaryDirectory() as odir :
+            main.generate(models, specs, odir, main.defaultGenerationOptions())
+            with open(os.path.join(odir, 'fk.ilk')) as istream :
+                solverTable = luaTable(istream.read())
+            with open(os.path.join(odir, 'model-constants.lua')) as istream :
+                constants = constantsFromLua(luaTable(istream.read()))
+        exact = robotconstants.numericTransforms(models.geometry)
+        self.assertEqual(sorted(constants.keys()), sorted(exact.keys()))
+        for key in exact :
+            np.testing.assert_allclose(constants[key], exact[key], rtol=0, atol=1e-6)
+        out = LoweredSolver(solverTable, constants).evaluate(q, qd)
+        self.assertEqual(sorted(out.keys()), sorted(expected.keys()))
+        for key in expected :
+            np.testing.assert_allclose(out[key], expected[key], rtol=0, atol=1e-5)
+
+
+if __name__ == "__main__" :
+    exit(main())
@@ -1,5 +1,7 @@
 from kgprim.core import Pose
 
+from ilkgenerator import pathindex
+
 class GeometricJacobian():
     '''
     classdocs
@@ -18,7 +20,7 @@ class GeometricJacobian():
         # chain) goes across the joint in the successor-predecessor direction,
         # then the joint velocity S qdot basically has the opposite sign of what
         # is needed. We must mark this case.
-        framesPath = robotFrames.path(ref, tgt)
+        framesPath = pathindex.of(robotFrames).path(ref, tgt)
         self.joints = []
         self.jointPoses = []
         self.polarities = []
@@ -41,3 +43,29 @@ class GeometricJacobian():
             previousFrame = fr
         self.targetPose = Pose(target=tgt, reference=ref)
 
+
+
+class GeometricJacobianFamily():
+    '''
+    A set of geometric Jacobians with the same reference frame, sharing the
+    columns of their common joints.
+
+    Each column of the family is computed once, from the pose of a joint
+    frame relative to the reference; each member Jacobian is a subset of the
+    columns of the family, at its own target point.
+    '''
+
+    def __init__(self, robotFrames, name, velocities):
+        self.name = name
+        self.members = [GeometricJacobian(robotFrames, v) for v in velocities]
+        self.robot = robotFrames.robot
+
+        columns = {}
+        for J in self.members :
+            for joint, pose, polarity in zip(J.joints, J.jointPoses, J.polarities) :
+                columns[joint] = (pose, polarity)
+        self.joints = sorted(columns.keys(), key=self.robot.jointNum)
+        self.jointPoses = [columns[joint][0] for joint in self.joints]
+        self.polarities = [columns[joint][1] for joint in self.joints]
+        # the indices of the family columns of each member Jacobian
+        self.memberColumns = [ [self.joints.index(joint) for joint in J.joints] for J in self.members ]
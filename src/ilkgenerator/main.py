@@ -1,4 +1,7 @@
-import logging, os, argparse, yaml
+import logging, os, io, argparse, yaml, json, cProfile
+import filecmp, stat, tempfile
+import multiprocessing, concurrent.futures
+from collections import namedtuple
 
 import robmodel
 import rmt.rmt as rmtool
@@ -6,50 +9,248 @@ import rmt.rmt as rmtool
 from kgprim import motions
 
 from ilkgenerator import query, solvermodel, generator, robotconstants
+from ilkgenerator import codegenutils, emitter, optcompose, outputcache, plancache, costmodel
+from ilkgenerator import instrument
 
 log = logging.getLogger(__name__)
 
 default_outdir = "/tmp/ilk"
 
-def main():
-    formatter = logging.Formatter('%(levelname)s : %(message)s')
-    handler = logging.StreamHandler()
-    handler.setFormatter(formatter)
-    log.setLevel(logging.WARN)
-    log.addHandler(handler)
 
-    argparser = argparse.ArgumentParser(prog="ilkgen", description='Generate ILK solver models')
+# The robot models used by the generator, after the parameters resolution, and
+# the parameters of the model (a robotconstants.ModelParameters, optional)
+RobotModels = namedtuple('RobotModels', ['robot', 'frames', 'geometry', 'parameters'])
+RobotModels.__new__.__defaults__ = (None,)
 
-    rmtool.setRobotArgs(argparser)
+def loadRobotModels(robotFile, paramsFile=None, withParameters=False):
+    '''The RobotModels in the given file. The parameters of the model are
+    recorded only if `withParameters` is True, as they are needed only for the
+    parametric constants (see robotconstants.modelParameters()).'''
+    with instrument.span('load-robot') :
+        connectivity, tree, robotframes, geometrymodel, inertia, params = rmtool.getmodels(robotFile, paramsFile)[0:6]
+    parameters = None
+    if withParameters :
+        with instrument.span('model-parameters') :
+            parameters = robotconstants.modelParameters(geometrymodel, params)
+    with instrument.span('resolve-parameters') :
+        rmtool._resolve_parameters(geometrymodel.posesModel.poses, params)
+    # 'tree' is the model composed of connectivity plus numbering scheme
+    return RobotModels(robot=tree, frames=robotframes, geometry=geometrymodel, parameters=parameters)
 
-    argparser.add_argument('-q', '--query', metavar='QUERY', dest='query',
-            help='the YAML file containing a query (defaults to a random FK solver)')
-    argparser.add_argument('-o', '--output-dir', metavar='ODIR', dest='odir',
-            default = default_outdir,
-            help='the directory where to put the generated files (defaults to ' + default_outdir + ')')
 
-    args = argparser.parse_args()
+def loadQuery(queryFile, robotModels):
+    '''The query in the given YAML file, or the default query for the robot if
+    the file is None'''
+    with instrument.span('load-query') :
+        if queryFile :
+            istream = open(queryFile)
+            userq   = query.queryFromYAML( istream )
+            istream.close()
+        else :
+            userq = query.defaultQuery(robotModels.robot)
+    return userq
+
+
+def addGenerationArgs(argparser):
+    '''Adds to the given parser the options that affect the generation of the
+    solvers, as opposed to the options about the inputs'''
+    argparser.add_argument('--backend', dest='backend', choices=['mako', 'direct'],
+            default='mako',
+            help='how to produce the output text: with Mako templates (default) or with the direct, template-free emitter')
+    argparser.add_argument('--compose-engine', dest='composeEngine',
+            choices=list(optcompose.engines.keys()), default=optcompose.defaultEngine.name,
+            help='the algorithm to find the sub-paths shared by the poses/velocities to compute (defaults to ' + optcompose.defaultEngine.name + ')')
+    argparser.add_argument('--planner', dest='planner',
+            choices=list(optcompose.planners.keys()), default='greedy',
+            help='the algorithm choosing the compositions: the greedy heuristic (default), or the search of the minimum number of compositions')
+    argparser.add_argument('--base-sweep', dest='baseSweep', action='store_true',
+            help='compute the poses relative to the robot base with a single root-to-leaves sweep, using the planner only for the other poses')
+    argparser.add_argument('--batched', dest='batched', action='store_true',
+            help='tag the FK solvers as batched, i.e. evaluating many joint configurations per call (see module batcheval for a reference evaluator)')
+    argparser.add_argument('--prune-constants', dest='pruneConstants', action='store_true',
+            help='write in the constants file only the transforms used by the generated FK solvers')
+    argparser.add_argument('--binary-constants', metavar='TYPE', dest='binaryConstants',
+            choices=['float64', 'float32'],
+            help='write also the constants in binary form, with values of the given type (float64 or float32), in model-constants.bin (see module binconstants)')
+    argparser.add_argument('--parametric-constants', dest='parametricConstants', action='store_true',
+            help='mark the constant poses which depend on the parameters of the robot model, in the solvers and in the constants file, and write the values of the parameters in model-parameters.lua')
+    argparser.add_argument('--template-cache', metavar='TDIR', dest='tplcache',
+            help='a directory where to store the compiled templates, to reuse them across runs')
+    argparser.add_argument('--jobs', metavar='N', dest='jobs', type=int, default=1,
+            help='the number of processes generating the solvers in parallel (defaults to 1)')
+    argparser.add_argument('--cache-dir', metavar='CDIR', dest='cacheDir',
+            help='a directory where to cache the generated text, to skip the solvers that did not change since a previous run')
+    argparser.add_argument('--plan-cache', metavar='PDIR', dest='planCache',
+            help='a directory where to store the plans of the compositions, to skip their search when the same poses/velocities are requested again')
+    argparser.add_argument('--fuse', metavar='NAME', dest='fuse',
+            help='generate a single FK solver with the given name, computing the outputs of all the FK solvers of the query (IK solvers included) and sharing their compositions')
+    argparser.add_argument('--report-cost', metavar='FILE', dest='reportCost',
+            help='write into FILE (JSON) the number of operations of the FK solvers and their estimated cost')
+    argparser.add_argument('--op-costs', metavar='FILE', dest='opCosts',
+            help='a YAML file with the cost of the operations, overriding the defaults (see module costmodel)')
+
+
+def defaultGenerationOptions():
+    '''The options for generate(), with their default values'''
+    argparser = argparse.ArgumentParser()
+    addGenerationArgs(argparser)
+    return argparser.parse_args([])
+
+
+def setupGeneration(options):
+    '''Applies the options which affect the whole process'''
+    if options.tplcache :
+        codegenutils.templateCache.configure(moduleDirectory=options.tplcache)
 
-    connectivity, tree, robotframes, geometrymodel, inertia, params = rmtool.getmodels(args.robot, args.params)[0:6]
-    robotmodel = tree # this is the model composed of connectivity plus numbering scheme
-    rmtool._resolve_parameters(geometrymodel.posesModel.poses, params)
 
-    if args.query :
-        istream = open(args.query)
-        userq   = query.queryFromYAML( istream )
-        istream.close()
+def validateQuery(robotModels, userq):
+    '''The specs of the sweeping and IK solvers of the given query, see
+    query.QueryParser.validate()'''
+    with instrument.span('validate') :
+        qparser = query.QueryParser(robotModels.robot, robotModels.frames, None)
+        return qparser.validate(userq)
+
+
+# The outcome of generate(): the list of the output files, the list of
+# (name, hit) tuples about the lookups in the output cache (if any), the
+# FusionReport (if the solvers were fused), and the cost report (if requested,
+# see costmodel.costReport())
+Generated = namedtuple('Generated', ['files', 'cacheReport', 'fusion', 'cost'])
+
+# The number of compose ops of the separate FK solvers, and of the fused one
+FusionReport = namedtuple('FusionReport', ['solvers', 'separateOps', 'fusedOps'])
+
+
+def _backend(options):
+    '''The generators of FK solvers, IK solvers and the writer of the
+    constants, for the backend selected in the options'''
+    if options.backend == 'direct' :
+        return emitter.SweepingSolverEmitter, emitter.IKEmitter, emitter.writeConstantsLuaTable
     else :
-        userq = query.defaultQuery(robotmodel)
+        return generator.SweepingSolverGenerator, generator.IKGenerator, robotconstants.writeLuaTable
+
 
+def _solverModel(sspecs, options):
+    planCache = plancache.PlanCache(options.planCache) if options.planCache else None
+    with instrument.span('solver-model') :
+        return solvermodel.FKSolverModel(sspecs, optcompose.engines[options.composeEngine], planCache,
+                                         optcompose.planners[options.planner], options.baseSweep)
+
+
+def _copiedSolverModel(sspecs, options):
+    # the solver model modifies the requests of the specs, thus we use a copy
+    return _solverModel(solvermodel.fusedSolverSpecs([sspecs], sspecs.name), options)
+
+
+def _fusionReport(sweepingsolvers, fusedModel, options):
+    '''The FusionReport of the given FK solvers; the model of the fused solver
+    is the one used for the generation'''
+    def opsCount(model):
+        count = model.composeOpsCount()
+        return count.poses + count.velocities
+    with instrument.span('fusion-report') :
+        separate = sum( [opsCount(_copiedSolverModel(specs, options)) for specs in sweepingsolvers] )
+        report = FusionReport(solvers=len(sweepingsolvers), separateOps=separate, fusedOps=opsCount(fusedModel))
+    log.info("Fusing {0} FK solvers: {1} compose ops instead of {2}".format(
+        report.solvers, report.fusedOps, report.separateOps))
+    return report
+
+
+def _modelParameters(robotModels, options):
+    '''The ModelParameters to mark in the output, if requested'''
+    if options.parametricConstants and robotModels.parameters is not None :
+        return robotModels.parameters
+    return None
+
+
+def _writeFKSolver(sspecs, options, ostream, parameters=None, model=None):
+    '''Writes the FK solver into the stream, and returns its model; the
+    model is built from the specs, unless given'''
+    FKGenerator = _backend(options)[0]
+    parametric = set(parameters.poses.keys()) if parameters is not None else None
+    with instrument.span('fk-solver ' + sspecs.name) :
+        if model is None :
+            model = _solverModel(sspecs, options)
+        with instrument.span('render') :
+            FKGenerator(model, options.batched, parametric).write(ostream)
+    return model
+
+
+def _fkSolverText(sspecs, options, parameters=None, model=None):
+    '''The text of the FK solver and the identifiers of the constants it
+    uses'''
+    ostream = io.StringIO()
+    model = _writeFKSolver(sspecs, options, ostream, parameters, model)
+    return ostream.getvalue(), robotconstants.referencedConstants(model)
+
+
+def _costReport(sweepingsolvers, models, options):
+    '''The cost report of the given FK solvers; `models` has the solver model
+    of each solver, if it was built for the generation, or None'''
+    opCosts = costmodel.defaultOpCosts
+    if options.opCosts :
+        with open(options.opCosts) as istream :
+            opCosts = costmodel.opCostsFromYAML(istream)
+    with instrument.span('cost-report') :
+        models = [model if model is not None else _copiedSolverModel(sspecs, options)
+                  for sspecs, model in zip(sweepingsolvers, models)]
+        return costmodel.costReport(models, opCosts)
+
+
+# The data of the current generate() call, inherited by the forked workers of
+# the process pool, so that the robot models do not have to be pickled
+_poolData = None
+
+def _poolTask(i):
+    robotModels, sweepingsolvers, models, options = _poolData
+    if i < len(sweepingsolvers) :
+        return _fkSolverText(sweepingsolvers[i], options, _modelParameters(robotModels, options), models[i])
+    ostream = io.StringIO()
+    _backend(options)[2](robotModels.geometry, ostream, None, _modelParameters(robotModels, options))
+    return ostream.getvalue()
+
+
+def _parallelTexts(robotModels, sweepingsolvers, models, withConstants, options):
+    '''The results of _fkSolverText() for the given FK solvers and, if
+    requested, the text of the constants (as the last item), generated with a
+    pool of processes. `models` has the solver model of each solver, if
+    already built, or None. Returns None if that
+    is not possible on this platform.'''
+    global _poolData
+    if 'fork' not in multiprocessing.get_all_start_methods() :
+        log.warning("Parallel generation is not supported on this platform, ignoring the jobs option")
+        return None
+    _poolData = (robotModels, sweepingsolvers, models, options)
+    count = len(sweepingsolvers) + (1 if withConstants else 0)
     try:
-        qparser = query.QueryParser(robotmodel, robotframes, None)
-        sweepingsolvers, iksolvers = qparser.validate(userq)
-    except Exception as e:
-        log.error("Parsing exception: %s", e)
-        return -1
+        context = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs, mp_context=context) as pool :
+            # map() yields the results in the order of the tasks, regardless
+            # of the order in which the workers complete them
+            texts = list(pool.map(_poolTask, range(count)))
+    finally:
+        _poolData = None
+    return texts
+
 
-    if not os.path.exists(args.odir) :
-        os.makedirs(args.odir)
+def generate(robotModels, solverSpecs, odir, options):
+    '''Generates the solvers with the given specs (as returned by
+    validateQuery()), writing the files into the given output directory.
+
+    Files whose content would not change are not written again.
+    Returns a `Generated` tuple.
+    '''
+    with instrument.span('generate') :
+        return _generate(robotModels, solverSpecs, odir, options)
+
+
+def _generate(robotModels, solverSpecs, odir, options):
+    sweepingsolvers, iksolvers = solverSpecs
+    IKGenerator, writeConstants = _backend(options)[1:]
+    parameters = _modelParameters(robotModels, options)
+
+    if not os.path.exists(odir) :
+        os.makedirs(odir)
 
     ikSolverModels = []
     for sspecs in iksolvers :
@@ -67,22 +268,262 @@ def main():
 
         ikSolverModels.append( solver )
 
-    for sspecs in sweepingsolvers :
-        solver = solvermodel.FKSolverModel(sspecs)
-        gen = generator.SweepingSolverGenerator(solver)
-        lua = gen.lua()
-        ostream = open(args.odir + "/" + solver.name + ".ilk", mode='w')
-        ostream.write(lua)
-        ostream.close()
-
-    for solver in ikSolverModels :
-        gen = generator.IKGenerator(solver)
-        lua = gen.lua()
-        ostream = open(args.odir + "/" + solver.name + ".ilk", mode='w')
-        ostream.write(lua)
-        ostream.close()
-
-    kk = robotconstants.asLuaTable(geometrymodel)
-    ostream = open(args.odir + "/model-constants.lua", mode='w')
-    ostream.write(kk)
-    ostream.close()
+    # The solver models built so far, to reuse them in the reports
+    fkModels = [None for _ in sweepingsolvers]
+    fusion = None
+    if options.fuse and len(sweepingsolvers) > 0 :
+        fused = solvermodel.fusedSolverSpecs(sweepingsolvers, options.fuse)
+        fkModels = [_solverModel(fused, options)]
+        fusion = _fusionReport(sweepingsolvers, fkModels[0], options)
+        for solver in ikSolverModels :
+            solver.requiredFK = fused
+        sweepingsolvers = [fused]
+
+    # With pruned constants, the constants file depends on the FK solvers,
+    # thus it is generated after them
+    prune = options.pruneConstants
+    fkConstants = [None for _ in sweepingsolvers]
+
+    cache = None
+    baseConstantsKey = "model-constants\n" + outputcache.parametersText(robotModels)
+    if options.cacheDir :
+        with instrument.span('cache-lookup') :
+            cache = outputcache.OutputCache(options.cacheDir, robotModels, options)
+            fkKeys = [cache.key(outputcache.fkSolverSpecsText(sspecs)) for sspecs in sweepingsolvers]
+            ikKeys = [cache.key(outputcache.ikSolverText(solver)) for solver in ikSolverModels]
+            fkTexts = [cache.get(key, sspecs.name) for key, sspecs in zip(fkKeys, sweepingsolvers)]
+            ikTexts = [cache.get(key, solver.name) for key, solver in zip(ikKeys, ikSolverModels)]
+            constants = None if prune else cache.get(cache.key(baseConstantsKey), "model-constants")
+            if prune :
+                for i, key in enumerate(fkKeys) :
+                    if fkTexts[i] is not None :
+                        fkConstants[i] = _cachedConstants(cache, key)
+                        if fkConstants[i] is None :
+                            fkTexts[i] = None
+    else :
+        fkTexts = [None for _ in sweepingsolvers]
+        ikTexts = [None for _ in ikSolverModels]
+        constants = None
+
+    missing = [i for i, text in enumerate(fkTexts) if text is None]
+    withConstants = constants is None and not prune
+    if options.jobs > 1 and len(missing) + withConstants > 1 :
+        # the spans of the worker processes are not reported
+        with instrument.span('parallel-generation') :
+            results = _parallelTexts(robotModels, [sweepingsolvers[i] for i in missing],
+                                     [fkModels[i] for i in missing], withConstants, options)
+        if results is not None :
+            for i, (text, used) in zip(missing, results) :
+                fkTexts[i] = text
+                fkConstants[i] = used
+                if cache is not None :
+                    cache.put(fkKeys[i], text)
+                    _cacheConstants(cache, fkKeys[i], used)
+            if withConstants :
+                constants = results[-1]
+                if cache is not None :
+                    cache.put(cache.key(baseConstantsKey), constants)
+
+    # The texts not available yet are rendered directly into the files, and
+    # copied into the cache from there
+    def output(fileName, text, write, key):
+        if text is not None :
+            return _writeIfChanged(odir, fileName, text)
+        path = _writeAtomically(odir, fileName, write)
+        if cache is not None :
+            cache.putFile(key, path)
+        return path
+
+    written = []
+    for i, sspecs in enumerate(sweepingsolvers) :
+        def writeFK(ostream):
+            fkModels[i] = _writeFKSolver(sspecs, options, ostream, parameters, fkModels[i])
+            fkConstants[i] = robotconstants.referencedConstants(fkModels[i])
+            if cache is not None :
+                _cacheConstants(cache, fkKeys[i], fkConstants[i])
+        written.append( output(sspecs.name + ".ilk", fkTexts[i], writeFK,
+            fkKeys[i] if cache is not None else None) )
+
+    def writeIK(solver, ostream):
+        with instrument.span('ik-solver ' + solver.name) :
+            IKGenerator(solver).write(ostream)
+    for i, solver in enumerate(ikSolverModels) :
+        written.append( output(solver.name + ".ilk", ikTexts[i],
+            lambda ostream : writeIK(solver, ostream),
+            ikKeys[i] if cache is not None else None) )
+
+    referenced = None
+    constantsKey = baseConstantsKey
+    if prune :
+        referenced = set().union(*fkConstants)
+        constantsKey += " " + " ".join(sorted(referenced))
+    if cache is not None :
+        constantsKey = cache.key(constantsKey)
+        if prune :
+            constants = cache.get(constantsKey, "model-constants")
+    def writeConstantsTable(ostream):
+        with instrument.span('constants') :
+            writeConstants(robotModels.geometry, ostream, referenced, parameters)
+    written.append( output("model-constants.lua", constants, writeConstantsTable, constantsKey) )
+    if parameters is not None :
+        # the only file to update, after a new calibration of the robot
+        written.append( _writeIfChanged(odir, "model-parameters.lua", robotconstants.parametersAsLuaTable(parameters)) )
+    if options.binaryConstants :
+        # cheap to generate, thus not cached
+        with instrument.span('binary-constants') :
+            written.append( _writeAtomically(odir, "model-constants.bin",
+                lambda ostream : robotconstants.writeBinaryTable(robotModels.geometry, ostream, referenced, options.binaryConstants),
+                binary=True) )
+
+    cost = _costReport(sweepingsolvers, fkModels, options) if options.reportCost else None
+    return Generated(files=written, cacheReport=cache.report if cache is not None else [],
+                     fusion=fusion, cost=cost)
+
+
+def _cachedConstants(cache, fkKey):
+    '''The identifiers of the constants used by the FK solver with the given
+    key in the output cache, or None if they are not in the cache'''
+    text = cache.get(cache.key(fkKey + " constants"))
+    return set(text.split()) if text is not None else None
+
+def _cacheConstants(cache, fkKey, constants):
+    cache.put(cache.key(fkKey + " constants"), " ".join(sorted(constants)))
+
+
+def _writeIfChanged(odir, fileName, text):
+    '''Writes the text in the given file, unless the file already has exactly
+    that content; this way, the modification time of unchanged files is
+    preserved'''
+    path = os.path.join(odir, fileName)
+    with instrument.span('write ' + fileName) :
+        if os.path.isfile(path) :
+            with open(path, mode='r') as istream :
+                if istream.read() == text :
+                    return path
+        return _replaceAtomically(odir, fileName, lambda ostream : ostream.write(text))
+
+
+def _writeAtomically(odir, fileName, write, binary=False):
+    '''Calls `write` with a file-like object (binary, if requested), and moves
+    what it wrote in the given file, which is never left half-written. As with
+    _writeIfChanged(), the file is not touched if its content would not
+    change.
+
+    The span of the writing encloses the spans of `write`, when the text is
+    rendered directly into the file.'''
+    with instrument.span('write ' + fileName) :
+        return _replaceAtomically(odir, fileName, write, binary)
+
+def _replaceAtomically(odir, fileName, write, binary=False):
+    path = os.path.join(odir, fileName)
+    fd, tmp = tempfile.mkstemp(dir=odir, prefix="." + fileName + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode='wb' if binary else 'w') as ostream :
+            write(ostream)
+        if os.path.isfile(path) :
+            if filecmp.cmp(path, tmp, shallow=False) :
+                os.remove(tmp)
+                return path
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        else :
+            # mkstemp() creates files readable only by the owner
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp) :
+            os.remove(tmp)
+        raise
+    return path
+
+
+def setupLogging():
+    formatter = logging.Formatter('%(levelname)s : %(message)s')
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    log.setLevel(logging.WARN)
+    log.addHandler(handler)
+
+
+def templateCacheStatsText():
+    stats = codegenutils.templateCache.stats()
+    return ("Templates cache: {0} hits, {1} misses ({2} loaded from disk), {3:.3f}s compiling"
+             .format(stats.hits, stats.misses, stats.diskLoads, stats.compileSeconds))
+
+
+def main():
+    setupLogging()
+
+    argparser = argparse.ArgumentParser(prog="ilkgen", description='Generate ILK solver models')
+
+    rmtool.setRobotArgs(argparser)
+
+    argparser.add_argument('-q', '--query', metavar='QUERY', dest='query',
+            help='the YAML file containing a query (defaults to a random FK solver)')
+    argparser.add_argument('-o', '--output-dir', metavar='ODIR', dest='odir',
+            default = default_outdir,
+            help='the directory where to put the generated files (defaults to ' + default_outdir + ')')
+    addGenerationArgs(argparser)
+    argparser.add_argument('--timings', dest='timings', action='store_true',
+            help='print the time taken by each stage of the generation')
+    argparser.add_argument('--timings-json', metavar='FILE', dest='timingsJSON',
+            help='write into FILE (JSON) the time taken by each stage of the generation')
+    argparser.add_argument('--template-stats', dest='templateStats', action='store_true',
+            help='print the hits and misses of the cache of the compiled templates, and the time spent compiling them')
+    argparser.add_argument('--profile', metavar='FILE', dest='profile',
+            help='profile the run with cProfile, and write the statistics into FILE (see the pstats module)')
+
+    args = argparser.parse_args()
+
+    timings = None
+    if args.timings or args.timingsJSON :
+        timings = instrument.Timings()
+        instrument.addListener(timings)
+    profiler = None
+    if args.profile :
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        ret = _run(args)
+    finally:
+        if profiler is not None :
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if timings is not None :
+            instrument.removeListener(timings)
+    if timings is not None :
+        if args.timings :
+            print(timings.asText())
+        if args.timingsJSON :
+            timings.writeJSON(args.timingsJSON)
+    return ret
+
+
+def _run(args):
+    setupGeneration(args)
+
+    robotModels = loadRobotModels(args.robot, args.params, args.parametricConstants)
+    userq = loadQuery(args.query, robotModels)
+
+    try:
+        solverSpecs = validateQuery(robotModels, userq)
+    except Exception as e:
+        log.error("Parsing exception: %s", e)
+        return -1
+
+    generated = generate(robotModels, solverSpecs, args.odir, args)
+    if args.cacheDir :
+        for name, hit in generated.cacheReport :
+            print("{0:<5} {1}".format("hit" if hit else "miss", name))
+    if generated.fusion is not None :
+        f = generated.fusion
+        print("Fused {0} FK solvers: {1} compose ops instead of {2}, {3} saved".format(
+            f.solvers, f.fusedOps, f.separateOps, f.separateOps - f.fusedOps))
+    if generated.cost is not None :
+        with open(args.reportCost, mode='w') as ostream :
+            json.dump(generated.cost, ostream, indent=2)
+
+    if args.templateStats :
+        print(templateCacheStatsText())
@@ -1,9 +1,208 @@
-import logging, unittest, collections
+import logging, unittest, collections, random, json, bisect
+from array import array
 from difflib import SequenceMatcher
 
 log = logging.getLogger(__name__)
 
 
+Match = collections.namedtuple('Match', ['a', 'b', 'size'])
+'''The result of a search of the longest common sub-sequence of two sequences,
+as in difflib: `size` items starting at `a` in the first sequence and at `b` in
+the second one.'''
+
+
+class DifflibEngine:
+    '''The legacy engine to find the longest common sub-sequence of two Paths,
+    based on difflib.SequenceMatcher.'''
+    name = 'difflib'
+
+    def match(self, path, other):
+        s = SequenceMatcher(None, path.items, other.items)
+        return s.find_longest_match(0, path.len(), 0, other.len() )
+
+
+class _SuffixAutomaton:
+    '''The suffix automaton of a sequence of hashable items.
+
+    It recognizes all the sub-sequences of the original sequence, and it is
+    built in linear time. For each state, we also record the end position of
+    the first occurrence of the corresponding sub-sequences.'''
+
+    def __init__(self, sequence):
+        self.next = [ {} ]
+        self.link = [ -1 ]
+        self.length = [ 0 ]
+        self.firstEnd = [ -1 ]
+        last = 0
+        for pos, item in enumerate(sequence) :
+            cur = self._newState(self.length[last]+1, {}, pos)
+            p = last
+            while p != -1 and item not in self.next[p] :
+                self.next[p][item] = cur
+                p = self.link[p]
+            if p == -1 :
+                self.link[cur] = 0
+            else :
+                q = self.next[p][item]
+                if self.length[p] + 1 == self.length[q] :
+                    self.link[cur] = q
+                else :
+                    clone = self._newState(self.length[p]+1, dict(self.next[q]), self.firstEnd[q])
+                    self.link[clone] = self.link[q]
+                    while p != -1 and self.next[p].get(item) == q :
+                        self.next[p][item] = clone
+                        p = self.link[p]
+                    self.link[q] = clone
+                    self.link[cur] = clone
+            last = cur
+
+    def _newState(self, length, transitions, firstEnd):
+        self.next.append(transitions)
+        self.link.append(-1)
+        self.length.append(length)
+        self.firstEnd.append(firstEnd)
+        return len(self.length) - 1
+
+    def longestMatch(self, sequence):
+        '''The longest sub-sequence of the given sequence which is also a
+        sub-sequence of the sequence of this automaton.
+
+        Ties are broken like difflib does: the match starting earliest in the
+        given sequence, and then the one starting earliest in the other.'''
+        nxt  = self.next
+        link = self.link
+        state, size = 0, 0
+        bestSize, bestEnd, bestState = 0, 0, 0
+        for i, item in enumerate(sequence) :
+            target = nxt[state].get(item)
+            while target is None and state != 0 :
+                state  = link[state]
+                size   = self.length[state]
+                target = nxt[state].get(item)
+            if target is not None :
+                state = target
+                size  = size + 1
+            if size > bestSize :
+                bestSize, bestEnd, bestState = size, i, state
+        if bestSize == 0 :
+            return Match(0, 0, 0)
+        return Match(bestEnd - bestSize + 1, self.firstEnd[bestState] - bestSize + 1, bestSize)
+
+
+class _ChainAutomaton:
+    '''The suffix automaton of a sequence of distinct items.
+
+    In this case the automaton degenerates into a chain: there is one state per
+    item, the initial state has a transition to every state, and each other
+    state has only one transition, to the state of the following item. This is
+    always the case for the Paths of a solver model, since a path in the
+    frames/links graph does not visit any node twice.
+
+    Unlike the general automaton, the chain can be updated in place when a
+    slice of the sequence is composed into a single item, without rebuilding
+    it from scratch.'''
+
+    @staticmethod
+    def build(sequence):
+        '''The automaton for the given sequence, or None if the sequence has
+        repeated items'''
+        chain = _ChainAutomaton()
+        for item in sequence :
+            if item in chain.state :
+                return None
+            chain._append(item)
+        return chain
+
+    def __init__(self):
+        self.state = {}     # item -> state
+        self.next  = []     # state -> state of the following item, or -1
+        self.first = -1
+        self.last  = -1
+
+    def _append(self, item):
+        s = len(self.next)
+        self.state[item] = s
+        self.next.append(-1)
+        if self.last == -1 :
+            self.first = s
+        else :
+            self.next[self.last] = s
+        self.last = s
+
+    def composeSlice(self, items, beg, end, composite):
+        '''Updates the automaton to reflect the replacement of items[beg:end]
+        with the single item `composite`. Returns False if the resulting
+        sequence would have repeated items.'''
+        if composite in self.state :
+            return False
+        after = self.next[ self.state[items[end-1]] ]
+        for item in items[beg:end] :
+            del self.state[item]
+        s = len(self.next)
+        self.state[composite] = s
+        self.next.append(after)
+        if beg == 0 :
+            self.first = s
+        else :
+            self.next[ self.state[items[beg-1]] ] = s
+        if after == -1 :
+            self.last = s
+        return True
+
+    def _position(self, state):
+        pos = 0
+        s = self.first
+        while s != state :
+            s = self.next[s]
+            pos = pos + 1
+        return pos
+
+    def longestMatch(self, sequence):
+        '''Same as _SuffixAutomaton.longestMatch()'''
+        stateOf = self.state
+        nxt  = self.next
+        prev, size = -1, 0
+        bestSize, bestEnd, bestStart = 0, 0, -1
+        for i, item in enumerate(sequence) :
+            s = stateOf.get(item, -1)
+            if s == -1 :
+                size = 0
+            elif prev != -1 and nxt[prev] == s :
+                size = size + 1
+            else :
+                size  = 1
+                start = s
+            prev = s
+            if size > bestSize :
+                bestSize, bestEnd, bestStart = size, i, start
+        if bestSize == 0 :
+            return Match(0, 0, 0)
+        return Match(bestEnd - bestSize + 1, self._position(bestStart), bestSize)
+
+
+class SuffixAutomatonEngine:
+    '''An engine to find the longest common sub-sequence of two Paths, based on
+    the suffix automaton of the second Path.
+
+    The automaton is built in linear time and it is cached in the Path; each
+    match then takes time linear in the length of the first Path, rather than
+    quadratic as with difflib. When the Path is modified, the automaton is
+    updated in place if the items are distinct (see _ChainAutomaton),
+    otherwise it is rebuilt at the next match.'''
+    name = 'automaton'
+
+    def match(self, path, other):
+        if other.matchIndex is None :
+            other.matchIndex = _ChainAutomaton.build(other.items)
+            if other.matchIndex is None :
+                other.matchIndex = _SuffixAutomaton(other.items)
+        return other.matchIndex.longestMatch(path.items)
+
+
+engines = { e.name : e for e in [SuffixAutomatonEngine(), DifflibEngine()] }
+defaultEngine = engines['automaton']
+
+
 class HomogenoeusComposable:
     '''
     A generic type for objects whose composition yields another object
@@ -44,6 +243,68 @@ class BinaryComposition:
         self.arg2 = c2
         self.result = c1.compose([c2])
 
+
+class Interner:
+    '''A table of small integer identifiers for composable objects.
+
+    Distinct primitive composables (e.g. distance-1 poses) get distinct IDs.
+    A composite also gets an ID, which depends only on the sequence of
+    primitives it is made of; the actual composite object is computed only
+    when requested, by composing the objects of its components.
+
+    Paths work on the IDs, which are much cheaper to hash and to compare than
+    the composable objects themselves.
+    '''
+
+    def __init__(self):
+        self.primitiveIDs = {}  # composable object -> ID
+        self.compositeIDs = {}  # tuple of primitive IDs -> ID
+        self.objects = []       # ID -> composable object (None if not computed yet)
+        self.leaves = []        # ID -> tuple of the primitive IDs
+        self.components = []    # ID -> (tuple of the IDs composed, pairWiseSwap)
+
+    def _new(self, obj, leaves, components):
+        self.objects.append(obj)
+        self.leaves.append(leaves)
+        self.components.append(components)
+        return len(self.objects) - 1
+
+    def intern(self, composable):
+        '''The ID of the given primitive composable object'''
+        i = self.primitiveIDs.get(composable)
+        if i is None :
+            i = self._new(composable, (len(self.objects),), None)
+            self.primitiveIDs[composable] = i
+        return i
+
+    def compose(self, ids, pairWiseSwap=False):
+        '''The ID of the composition of the items with the given IDs'''
+        leaves = []
+        for i in ids :
+            leaves.extend( self.leaves[i] )
+        leaves = tuple(leaves)
+        i = self.compositeIDs.get(leaves)
+        if i is None :
+            i = self._new(None, leaves, (tuple(ids), pairWiseSwap))
+            self.compositeIDs[leaves] = i
+        return i
+
+    def composable(self, i):
+        '''The composable object with the given ID'''
+        obj = self.objects[i]
+        if obj is None :
+            ids, pairWiseSwap = self.components[i]
+            obj = HomogenoeusComposable.composeAll( [self.composable(c) for c in ids], pairWiseSwap )
+            self.objects[i] = obj
+        return obj
+
+    def __len__(self):
+        return len(self.objects)
+
+
+# The interner of the Paths constructed without an explicit one
+sharedInterner = Interner()
+
 class Path:
     '''
     A modifiable sequence of composable objects.
@@ -54,21 +315,33 @@ class Path:
     For example, the Path 'a b c d e f' can become 'a bcd e f' after
     composing the subsequence 'b c d'. In that case, the length of the Path
     would change from 6 to 4.
+
+    The items are stored as the IDs given by the `interner`, and the
+    constructor accepts either an array('i') of such IDs, or a sequence of
+    composable objects, which are then interned. Paths which are compared with
+    each other must share the same interner.
     '''
 
     SeqInfo = collections.namedtuple('SeqInfo', ['start', 'size'])
 
-    def __init__(self, composablesList, pairWiseSwap=False):
+    def __init__(self, composablesList, pairWiseSwap=False, interner=None):
+        if interner is None :
+            interner = sharedInterner
+        if not isinstance(composablesList, array) :
+            composablesList = array('i', [interner.intern(c) for c in composablesList])
+        self.interner = interner
         self.items = composablesList
         self.flags = [ False for _ in self.items]
         self.mySubPoses = []
         self.pairWiseSwap = pairWiseSwap
+        self.matchIndex = None # engine specific, reset whenever items change
 
     def len(self): return len(self.items)
 
-    def match(self, other):
-        s = SequenceMatcher(None, self.items, other.items)
-        return s.find_longest_match(0, self.len(), 0, other.len() )
+    def match(self, other, engine=None):
+        if engine is None :
+            engine = defaultEngine
+        return engine.match(self, other)
 
     def composeSubPath(self, sequenceInfo):
         # Identify the slice of the path, and merge the corresponding elements:
@@ -76,15 +349,17 @@ class Path:
         beg = sequenceInfo.start
         siz = sequenceInfo.size
         end = beg + siz
-        composite = HomogenoeusComposable.composeAll(self.items[beg:end], self.pairWiseSwap)
+        composite = self.interner.compose(self.items[beg:end], self.pairWiseSwap)
+
+        if self.matchIndex is not None :
+            if not (isinstance(self.matchIndex, _ChainAutomaton) and
+                    self.matchIndex.composeSlice(self.items, beg, end, composite)) :
+                self.matchIndex = None
 
         # Now delete the elements which have been merged, and replace them with
         # the new, single, composite item
-        for _ in range(siz):
-            del self.items[beg] # do not increase the index! The 'del' reduces the length!
-            del self.flags[beg]
-        self.items.insert(beg, composite)
-        self.flags.insert(beg, True)
+        self.items[beg:end] = array('i', [composite])
+        self.flags[beg:end] = [True]
 
         # Propagate the shrinking event to the subpaths, which hold an index of
         # this path's items
@@ -106,8 +381,12 @@ class Path:
                 ret.append( sp )
         return ret
 
+    def composables(self):
+        '''The list of the actual composable objects of this path'''
+        return [self.interner.composable(i) for i in self.items]
+
     def __str__(self):
-        return " ".join( [item.__str__() for item in self.items] )
+        return " ".join( [item.__str__() for item in self.composables()] )
     def __repr__(self):
         return self.__str__()
 
@@ -122,7 +401,7 @@ class SubPath(Path):
     # sequence of compositions
 
     def __init__(self, container, beg, end, pairWiseSwap=False):
-        Path.__init__( self, container.items[beg:end], pairWiseSwap )
+        Path.__init__( self, container.items[beg:end], pairWiseSwap, container.interner )
         self.container = container
         self.cBeg = beg
 
@@ -137,26 +416,34 @@ instances.
 '''
 class Composition:
     class Involved:
-        def __init__(self, path, seq):
-            self.path    = path
-            self.interval= seq
+        def __init__(self, composition, path, start):
+            self.composition = composition
+            self.path   = path
+            self.origin = start - composition.offset
+        @property
+        def interval(self):
+            # the start in the path moves with the start of the composition,
+            # when the latter shrinks
+            c = self.composition
+            return Path.SeqInfo(self.origin + c.offset, len(c.composables))
         def applyCompose(self):
             self.path.composeSubPath( self.interval )
 
     def __init__(self, path, seqInfo):
-        self.involved    = [ Composition.Involved(path, seqInfo) ]
+        self.offset      = 0 # the shift of the start, after the shrinks
         self.composables = self._subSequence(path.items, seqInfo)
-        self.path = Path(self.composables, path.pairWiseSwap)
+        self.involved    = [ Composition.Involved(self, path, seqInfo.start) ]
+        self.path = Path(self.composables, path.pairWiseSwap, path.interner)
 
     def shrink(self, seqInfo):
-        for inv in self.involved :
-            a = inv.interval.start + seqInfo.start
-            inv.interval = Path.SeqInfo(a, seqInfo.size)
+        if seqInfo.start == 0 and seqInfo.size == len(self.composables) :
+            return
+        self.offset = self.offset + seqInfo.start
         self.composables = self._subSequence(self.composables, seqInfo)
-        self.path = Path(self.composables, self.path.pairWiseSwap)
+        self.path = Path(self.composables, self.path.pairWiseSwap, self.path.interner)
 
     def addInvolved(self, path, seqInfo):
-        self.involved.append( Composition.Involved(path, seqInfo) )
+        self.involved.append( Composition.Involved(self, path, seqInfo.start) )
         # ASSERT( len(self.composables) == seqInfo.size )
 
     def asPath(self): return self.path
@@ -177,13 +464,61 @@ class Composition:
         else :
             bcf = lambda arg1, arg2: BinaryComposition(arg1,arg2)
         ret = []
-        c0 = self.composables[0]
-        for c in self.composables[1:]:
+        composables = self.path.composables()
+        c0 = composables[0]
+        for c in composables[1:]:
             bc = bcf(c0,c)
             c0 = bc.result
             ret.append( bc )
         return ret
 
+class _PairsIndex:
+    '''The paths containing each pair of consecutive items, among the given
+    list of Paths, kept up to date as the paths are composed.'''
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.position = { p : i for i, p in enumerate(paths) }
+        # pair -> position of the path -> occurrences of the pair in the path
+        self.pathsOf = collections.defaultdict(dict)
+        for p in paths :
+            self._add(p, 0, p.len())
+
+    def _add(self, path, beg, end):
+        i = self.position[path]
+        items = path.items
+        for k in range(max(beg, 1), min(end, len(items))) :
+            counts = self.pathsOf[(items[k-1], items[k])]
+            counts[i] = counts.get(i, 0) + 1
+
+    def _remove(self, path, beg, end):
+        i = self.position[path]
+        items = path.items
+        for k in range(max(beg, 1), min(end, len(items))) :
+            counts = self.pathsOf[(items[k-1], items[k])]
+            counts[i] = counts[i] - 1
+            if counts[i] == 0 :
+                del counts[i]
+
+    def applyCompose(self, involved):
+        '''Composes the sub-path of an involved path, updating only the pairs
+        which overlap with the composed slice'''
+        interval = involved.interval
+        beg = interval.start
+        self._remove(involved.path, beg, beg + interval.size + 1)
+        involved.applyCompose()
+        self._add(involved.path, beg, beg + 2)
+
+    def candidates(self, path):
+        '''The paths which may have a sub-path (>1 item) in common with the
+        given one, in the order of the list'''
+        found = set()
+        items = path.items
+        for k in range(1, len(items)) :
+            found.update( self.pathsOf.get((items[k-1], items[k]), ()) )
+        return [self.paths[i] for i in sorted(found)]
+
+
 '''
 Find the longest sub-path (>1 item) common to the largest number of Paths.
 The return value is a list of Composition obejcts, since a Composition is
@@ -193,19 +528,36 @@ Being shared by a higher number of paths is more important than being longer;
 for example, assuming to use character sequences to represent paths, the result
 of this function for the arguments 'bc', 'abc', 'bcdef', 'cdef' is ['bc','def'],
 even though 'cdef' is a longer, common subsequence.
+
+The `engine` is the object used to find the longest common sub-sequence of two
+paths (see `engines`); all the engines give the same result.
+
+A common sub-path of two paths includes at least a pair of consecutive items,
+thus each path is matched only with the paths sharing one of such pairs (see
+_PairsIndex). The result does not change, but the number of matches is
+proportional to the number of paths which actually overlap, rather than to the
+square of the number of paths. Each match takes time linear in the length of
+the paths, with the automaton engine, and so does each composition in place
+(shrinking a Composition does not touch its involved paths, and the index is
+updated only around the composed slice). Thus the cost of a round is
+proportional to the total size of the `involved` lists of the compositions,
+i.e. to the work of the greedy strategy itself; it is still quadratic in the
+worst case, when all the paths overlap with each other. See
+benchplanners.py --scaling for a measure.
 '''
-def findComposes(paths):
+def findComposes(paths, engine=None):
     compositions = []
     start = 1
+    index = _PairsIndex(paths)
     # Compare each Path with all the following ones. Therefore, skip the last
     # item, and in the inner loop start from the subsequent item, not the
     # beginning
     for p in paths[:-1] :
         if p.len() > 1 :
             composition = Composition( p, Path.SeqInfo(0, p.len()) )
-            for p2 in paths :
+            for p2 in index.candidates(p) :
                 if p2 != p :
-                    overlap = composition.asPath().match( p2 )
+                    overlap = composition.asPath().match( p2, engine )
                     if overlap.size > 1 :
                         # Refine (shrink) the shared path with the new intersection
                         composition.shrink( Path.SeqInfo(overlap.a, overlap.size) )
@@ -223,7 +575,7 @@ def findComposes(paths):
             # actual paths of the use case.
             if len(composition.involved) > 1:
                 for inv in composition.involved :
-                    inv.applyCompose()
+                    index.applyCompose(inv)
                 compositions.append( composition )
         start = start+1
 
@@ -237,13 +589,13 @@ The optimality refers to composing the items (and in turn the composites)
 which are shared by the largest number of Paths, to avoid repeating the same
 compositions multiple times.
 '''
-def allComposes(paths):
+def allComposes(paths, engine=None):
     opool = sorted( paths, key=Path.len ) # sort the input list based on the length
     pool = opool
     totComposes = []
 #    iter = 0
 
-    composes = findComposes( pool )
+    composes = findComposes( pool, engine )
     while len(composes) > 0 :
 #        iter = iter + 1
         totComposes.extend( composes )
@@ -254,7 +606,7 @@ def allComposes(paths):
 #         for p in pool :
 #             print(p)
 
-        composes = findComposes( pool )
+        composes = findComposes( pool, engine )
 
     # No more overlaps, force the composition of whatever is left
     for p in opool :
@@ -267,6 +619,280 @@ def allComposes(paths):
 
 
 
+def composeOpsCount(composes):
+    '''The number of binary compositions of the given Composition objects'''
+    return sum( [len(c.composables) - 1 for c in composes] )
+
+
+'''
+An alternative to allComposes(), which looks for the minimum number of binary
+compositions required to compute all the given Paths.
+
+Each sub-sequence of primitive items (like 'bcd') must be computed only once,
+as the composition of two shorter sub-sequences (like 'b' and 'cd', or 'bc' and
+'d'); the problem is choosing where to split each required sub-sequence, so
+that the total number of distinct sub-sequences to compute is minimal.
+
+The search processes the required sub-sequences from the longest to the
+shortest, branching over the split points. States that require the same
+sub-sequences are merged, so the search is exhaustive - and the result optimal
+- as long as the number of states at each step does not exceed `beamWidth`;
+otherwise only the `beamWidth` states requiring the fewest sub-sequences are
+kept, turning the search into a beam search. The states requiring at least
+as many compositions as allComposes() are discarded, and the result of the
+latter is returned if no better solution is found.
+
+The return value is a list of Composition objects of two items each; unlike
+allComposes(), the given Paths are not modified.
+'''
+def optimalComposes(paths, engine=None, beamWidth=64):
+    if len(paths) == 0 :
+        return []
+    interner = paths[0].interner
+    pairWiseSwap = paths[0].pairWiseSwap
+
+    greedy = allComposes([Path(array('i', p.items), pairWiseSwap, interner) for p in paths], engine)
+    # only the solutions with fewer compositions than the greedy one matter
+    bound = composeOpsCount(greedy)
+
+    targets = sorted( set([tuple(p.items) for p in paths if p.len() > 1]) )
+    order = lambda seq: (-len(seq), seq) # longest first
+    # A state is the tuple (required sub-sequences, the ones still to be split,
+    # the splits done so far as a linked list)
+    initial = (frozenset(targets), tuple(sorted([order(t) for t in targets])), None)
+    beam = [initial] if len(targets) > 0 else []
+    best = None
+    exact = True
+    while len(beam) > 0 :
+        # Score all the possible splits first, by the number of required
+        # sub-sequences they lead to, and build only the best states
+        children = []
+        for s, (need, pending, splits) in enumerate(beam) :
+            seq = pending[0][1]
+            for k in range(1, len(seq)) :
+                added = [part for part in (seq[:k], seq[k:]) if len(part) > 1 and part not in need]
+                size = len(need) + len(added)
+                if size < bound :
+                    children.append( (size, sum(map(len, added)), len(pending) - 1 + len(added), s, k, added) )
+        # ties are broken by the total length of the new sub-sequences, since
+        # longer ones tend to require more compositions
+        children.sort( key=lambda child: child[0:2] )
+        candidates = {}
+        for size, _, npending, s, k, added in children :
+            if len(candidates) == beamWidth :
+                exact = False
+                break
+            if size >= bound :
+                break
+            need, pending, splits = beam[s]
+            newPending = list(pending[1:])
+            for part in added :
+                bisect.insort(newPending, order(part))
+            state = (need.union(added), tuple(newPending), (pending[0][1], k, splits))
+            if npending == 0 :
+                best = state
+                bound = size
+            elif state[0:2] not in candidates :
+                candidates[state[0:2]] = state
+        beam = [state for state in candidates.values() if len(state[0]) < bound]
+
+    if best is None :
+        log.debug("Optimal composition search ({0}): no better solution than the greedy one ({1} compositions)".format(
+            "exhaustive" if exact else "beam", bound))
+        return greedy
+
+    splits = []
+    node = best[2]
+    while node is not None :
+        splits.append( node[0:2] )
+        node = node[2]
+    splits.sort( key=lambda split: (len(split[0]), split[0]) ) # the parts first
+
+    composes = []
+    for seq, k in splits :
+        items = [part[0] if len(part)==1 else interner.compose(part, pairWiseSwap) for part in (seq[:k], seq[k:])]
+        # this makes sure that the composite item has the two parts as components
+        interner.compose(items, pairWiseSwap)
+        composes.append( Composition(Path(array('i', items), pairWiseSwap, interner), Path.SeqInfo(0, 2)) )
+
+    log.debug("Optimal composition search ({0}): {1} compositions, instead of {2}".format(
+        "exhaustive" if exact else "beam", len(composes), composeOpsCount(greedy)))
+    return composes
+
+'''
+The compositions computing all the given Paths by sharing their suffixes: each
+distinct suffix is computed once, as the composition of its first item with
+the next suffix.
+
+When the paths end with the same item, e.g. poses relative to the robot base,
+this is a sweep from the root to the leaves of the kinematic tree, with one
+composition per distinct sub-path, and no search at all. The return value is
+a list of Composition objects of two items each; the Paths are not modified.
+'''
+def sweepComposes(paths, engine=None):
+    if len(paths) == 0 :
+        return []
+    interner = paths[0].interner
+    pairWiseSwap = paths[0].pairWiseSwap
+
+    suffixes = set()
+    for p in paths :
+        items = tuple(p.items)
+        for i in range(0, len(items)-1) :
+            suffix = items[i:]
+            if suffix in suffixes :
+                break # then all the shorter ones are there too
+            suffixes.add( suffix )
+
+    composes = []
+    for suffix in sorted(suffixes, key=lambda s: (len(s), s)) :
+        rest = suffix[1] if len(suffix)==2 else interner.compose(suffix[1:], pairWiseSwap)
+        items = [suffix[0], rest]
+        interner.compose(items, pairWiseSwap)
+        composes.append( Composition(Path(array('i', items), pairWiseSwap, interner), Path.SeqInfo(0, 2)) )
+    return composes
+
+'''
+Copies of the given Paths where each sub-path already computed by the given
+compositions (e.g. the result of sweepComposes()) is a single item, so that a
+planner reuses those results instead of computing them again.
+
+The sub-paths are replaced left to right, the longest first. The copies share
+a new interner, in which the results of the compositions are primitive items
+like the others; the Paths themselves are not modified.
+'''
+def seededPaths(paths, composes):
+    if len(paths) == 0 :
+        return []
+    interner = paths[0].interner
+    pairWiseSwap = paths[0].pairWiseSwap
+
+    computed = {} # sequence of primitive IDs -> ID of the result
+    lengths  = {} # first primitive ID -> the lengths of the computed sequences
+    for c in composes :
+        i = interner.compose(c.path.items, c.path.pairWiseSwap)
+        leaves = interner.leaves[i]
+        computed[leaves] = i
+        lengths.setdefault(leaves[0], set()).add( len(leaves) )
+    lengths = { first : sorted(sizes, reverse=True) for first, sizes in lengths.items() }
+
+    seeded = Interner()
+    ret = []
+    for p in paths :
+        items = p.items
+        copy = array('i')
+        i = 0
+        while i < len(items) :
+            item = items[i]
+            size = 1
+            for n in lengths.get(item, []) :
+                if tuple(items[i:i+n]) in computed :
+                    item, size = computed[tuple(items[i:i+n])], n
+                    break
+            copy.append( seeded.intern(interner.composable(item)) )
+            i = i + size
+        ret.append( Path(copy, pairWiseSwap, seeded) )
+    return ret
+
+# The functions computing the compositions for a set of Paths
+planners = { 'greedy' : allComposes, 'optimal' : optimalComposes }
+
+
+class CompositionPlan:
+    '''
+    The result of allComposes() in a form independent of the Paths and of the
+    interner, which can be stored and loaded again.
+
+    The primitive items are referred to by their index in the sorted list of
+    their string representations (`self.primitives`); each composition is a
+    list of items, and each item is the tuple of the indices of the primitives
+    it is made of.
+    '''
+
+    version = 1
+
+    def __init__(self, primitives, compositions, pairWiseSwap):
+        self.primitives   = primitives
+        self.compositions = compositions
+        self.pairWiseSwap = pairWiseSwap
+
+    @staticmethod
+    def canonicalPrimitives(paths):
+        '''The sorted list of the string representations of the items of the
+        given (not yet composed) paths, and the map from each item ID to the
+        index in that list. Returns None if two distinct items have the same
+        string representation.'''
+        names = {}
+        for p in paths :
+            for i in p.items :
+                if i not in names :
+                    names[i] = p.interner.composable(i).__str__()
+        primitives = sorted(set(names.values()))
+        if len(primitives) != len(names) :
+            return None
+        index = { name : k for k, name in enumerate(primitives) }
+        return primitives, { i : index[name] for i, name in names.items() }
+
+    @staticmethod
+    def keyOf(paths):
+        '''A text identifying the given set of (not yet composed) paths, or
+        None if the paths cannot be described by a plan'''
+        canonical = CompositionPlan.canonicalPrimitives(paths)
+        if canonical is None or len(paths) == 0 :
+            return None
+        primitives, toIndex = canonical
+        seqs = sorted([ [toIndex[i] for i in p.items] for p in paths ])
+        return json.dumps( {'version': CompositionPlan.version,
+                            'swap': paths[0].pairWiseSwap,
+                            'primitives': primitives, 'paths': seqs} )
+
+    @staticmethod
+    def fromComposes(composes, canonical, pairWiseSwap):
+        '''The plan of the given result of allComposes(); `canonical` is the
+        value returned by canonicalPrimitives() for the same paths, before
+        they were composed'''
+        primitives, toIndex = canonical
+        compositions = []
+        for c in composes :
+            leaves = c.path.interner.leaves
+            compositions.append( [ [toIndex[leaf] for leaf in leaves[i]] for i in c.composables ] )
+        return CompositionPlan(primitives, compositions, pairWiseSwap)
+
+    def composes(self, paths):
+        '''The list of Composition objects described by this plan, for the
+        given paths, which must be the same as the ones the plan was computed
+        for. Unlike allComposes(), the paths are not modified.'''
+        if len(paths) == 0 :
+            return []
+        primitives, toIndex = CompositionPlan.canonicalPrimitives(paths)
+        if primitives != self.primitives :
+            raise ValueError("The composition plan does not match the given paths")
+        interner = paths[0].interner
+        toID = [None for _ in primitives]
+        for i, k in toIndex.items() :
+            toID[k] = i
+        ret = []
+        for composition in self.compositions :
+            items = []
+            for leaves in composition :
+                ids = [toID[k] for k in leaves]
+                items.append( ids[0] if len(ids)==1 else interner.compose(ids, self.pairWiseSwap) )
+            path = Path(array('i', items), self.pairWiseSwap, interner)
+            ret.append( Composition(path, Path.SeqInfo(0, len(items))) )
+        return ret
+
+    def asDict(self):
+        return {'version': CompositionPlan.version, 'swap': self.pairWiseSwap,
+                'primitives': self.primitives, 'compositions': self.compositions}
+
+    @staticmethod
+    def fromDict(data):
+        if data.get('version') != CompositionPlan.version :
+            raise ValueError("Unsupported version of the composition plan")
+        return CompositionPlan(data['primitives'], data['compositions'], data['swap'])
+
+
+
 
 
 
@@ -376,6 +1002,136 @@ class Test5(TestBase):
 
     def test_stuff(self):  self.myCmpTest()
 
+class TestEngines(unittest.TestCase):
+    '''Checks that all the engines yield the same compositions'''
+
+    def composesWith(self, engine, sequences):
+        paths = [Path(TestBase.stringToComposablesList(s)) for s in sequences]
+        return [c.__str__() for c in allComposes(paths, engine)]
+
+    def checkAllEngines(self, sequences):
+        expected = self.composesWith(engines['difflib'], sequences)
+        for engine in engines.values() :
+            self.assertEqual(self.composesWith(engine, sequences), expected)
+
+    def test_samples(self):
+        for sequences in [ ['abcde', 'cdefg'], ['abcdefghil', 'defgh', 'bc'],
+                ['h', 'kifg', 'abfijl', 'kifbc', 'fij', 'cbfi'],
+                ['abcdefghi', 'bc', 'fg', 'bcdefghil'],
+                ['fghi', 'hijkl', 'fghijk', 'fghijkl'],
+                ['fghi', 'hijk', 'efg', 'defg', 'cdefg'] ] :
+            self.checkAllEngines(sequences)
+
+    def test_random(self):
+        rnd = random.Random(17)
+        for _ in range(200) :
+            # sub-strings of a random permutation, like the paths of a chain
+            chain = rnd.sample('abcdefghijklmnopqrstuvwxyz', 20)
+            sequences = []
+            for _ in range(rnd.randint(2,8)) :
+                beg = rnd.randint(0, 18)
+                sequences.append( "".join(chain[beg:rnd.randint(beg+1, 20)]) )
+            self.checkAllEngines(sequences)
+
+    def test_match_repeated_items(self):
+        rnd = random.Random(3)
+        for _ in range(500) :
+            a = Path( TestBase.stringToComposablesList([rnd.choice('abc') for _ in range(rnd.randint(0,15))]) )
+            b = Path( TestBase.stringToComposablesList([rnd.choice('abc') for _ in range(rnd.randint(0,15))]) )
+            expected = tuple(engines['difflib'].match(a, b))
+            self.assertEqual(tuple(engines['automaton'].match(a, b)), expected)
+
+
+class TestOptimal(unittest.TestCase):
+    '''Checks that the optimal planner computes all the paths, with no more
+    compositions than the greedy one'''
+
+    def check(self, sequences):
+        interner = Interner()
+        paths = [Path(TestBase.stringToComposablesList(s), False, interner) for s in sequences]
+        greedy = allComposes([Path(array('i', p.items), False, interner) for p in paths])
+        optimal = optimalComposes(paths)
+        self.assertLessEqual(composeOpsCount(optimal), composeOpsCount(greedy))
+        available = set([(i,) for p in paths for i in p.items])
+        for c in optimal :
+            for i in c.composables :
+                self.assertIn(interner.leaves[i], available)
+            available.add( interner.leaves[interner.compose(c.composables)] )
+        for p in paths :
+            self.assertIn(tuple(p.items), available)
+
+    def test_samples(self):
+        self.check(['abcde', 'cdefg'])
+        self.check(['h', 'kifg', 'abfijl', 'kifbc', 'fij', 'cbfi'])
+        self.check(['fghi', 'hijkl', 'fghijk', 'fghijkl'])
+
+    def test_fewer(self):
+        # 'defg' can be computed as 'de' 'fg', with no additional compositions
+        sequences = ['defg', 'ef', 'fg', 'de']
+        self.check(sequences)
+        interner = Interner()
+        paths = [Path(TestBase.stringToComposablesList(s), False, interner) for s in sequences]
+        self.assertEqual(composeOpsCount(optimalComposes(paths)), 4)
+
+
+class TestSweep(unittest.TestCase):
+    def test_rooted(self):
+        # paths ending with the same item, like poses relative to the base
+        sequences = ['fedcba', 'dcba', 'gdcba', 'hgdcba', 'ba']
+        interner = Interner()
+        paths = [Path(TestBase.stringToComposablesList(s), False, interner) for s in sequences]
+        composes = sweepComposes(paths)
+        self.assertEqual([c.__str__() for c in composes], [
+            '«b» «a»', '«c» «b a»', '«d» «c b a»', '«e» «d c b a»', '«g» «d c b a»',
+            '«f» «e d c b a»', '«h» «g d c b a»'])
+        greedy = allComposes([Path(array('i', p.items), False, interner) for p in paths])
+        self.assertLessEqual(composeOpsCount(composes), composeOpsCount(greedy))
+
+    def test_crossing(self):
+        # paths crossing the root, like poses between two branches of a tree;
+        # the part before the root is computed by the sweep
+        rooted = ['dcba', 'hgfe', 'lkji']
+        others = ['dcbaEFGH', 'dcbaIJKL']
+        interner = Interner()
+        paths = [Path(TestBase.stringToComposablesList(s), False, interner) for s in rooted + others]
+        greedy = allComposes([Path(array('i', p.items), False, interner) for p in paths])
+
+        composes = sweepComposes(paths[0:3])
+        seeded = seededPaths(paths[3:], composes)
+        self.assertEqual([p.__str__() for p in seeded], ['«d c b a» «E» «F» «G» «H»', '«d c b a» «I» «J» «K» «L»'])
+        self.assertEqual([p.__str__() for p in paths[3:]], ['«d» «c» «b» «a» «E» «F» «G» «H»', '«d» «c» «b» «a» «I» «J» «K» «L»'])
+        composes = composes + allComposes(seeded)
+
+        results = [bc.result for c in composes for bc in c.asSequenceOfBinaryCompositions()]
+        self.assertEqual(len(results), len(set(results)))
+        self.assertEqual(composeOpsCount(composes), 17)
+        self.assertLessEqual(composeOpsCount(composes), composeOpsCount(greedy))
+
+
+class TestPlan(unittest.TestCase):
+    '''Checks that a stored plan gives the same compositions as the search'''
+
+    def test_roundtrip(self):
+        for sequences, swap in [ (['abcdefghil', 'defgh', 'bc'], False),
+                                 (['h', 'kifg', 'abfijl', 'kifbc', 'fij', 'cbfi'], True) ] :
+            interner = Interner()
+            paths = [Path(TestBase.stringToComposablesList(s), swap, interner) for s in sequences]
+            key = CompositionPlan.keyOf(paths)
+            canonical = CompositionPlan.canonicalPrimitives(paths)
+            composes = allComposes(paths)
+            plan = CompositionPlan.fromComposes(composes, canonical, swap)
+            plan = CompositionPlan.fromDict( json.loads(json.dumps(plan.asDict())) )
+
+            interner = Interner()
+            fresh = [Path(TestBase.stringToComposablesList(s), swap, interner) for s in reversed(sequences)]
+            self.assertEqual(CompositionPlan.keyOf(fresh), key)
+            loaded = plan.composes(fresh)
+            self.assertEqual([c.__str__() for c in loaded], [c.__str__() for c in composes])
+            for a, b in zip(loaded, composes) :
+                self.assertEqual([bc.result.__str__() for bc in a.asSequenceOfBinaryCompositions()],
+                                 [bc.result.__str__() for bc in b.asSequenceOfBinaryCompositions()])
+
+
 class TestManual(TestBase):
     def __init__(self, *args, **kwargs):
         self.inputSequences = ['fghi', 'hijk', 'efg', 'defg', 'cdefg']
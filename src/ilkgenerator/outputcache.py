@@ -0,0 +1,221 @@
+'''
+A content-addressed cache of the generated text.
+
+The key of each cached item is a digest of everything the item depends on:
+the robot model, the specs of the solver (if any), the options affecting the
+output, the source code of the generator itself and the versions of the
+libraries it uses. Therefore, a cache hit
+guarantees that generating the item again would give the same text.
+'''
+
+import os, shutil, hashlib, logging, tempfile, unittest
+
+from kgprim import values
+
+from ilkgenerator import generator
+
+log = logging.getLogger(__name__)
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def robotModelText(robotModels):
+    '''A canonical textual description of the given robot models, covering
+    everything the generated solvers and constants depend upon'''
+    robot = robotModels.robot
+    lines = ["robot " + robot.name]
+    for joint in robot.joints.values() :
+        lines.append("joint {0} {1} #{2} {3} {4}".format(joint.name, joint.kind.name,
+            robot.jointNum(joint), robot.predecessor(joint).name, robot.successor(joint).name))
+    for name in sorted(robotModels.frames.framesByName.keys()) :
+        lines.append("frame " + name)
+    for poseSpec in robotModels.geometry.posesModel.poses :
+        motion = " ".join( [seq.mode.name + "[" + " ".join([str(step) for step in seq.steps]) + "]"
+                            for seq in poseSpec.motion.sequences] )
+        lines.append("pose {0} {1} {2}".format(poseSpec.pose.target.name, poseSpec.pose.reference.name, motion))
+    return "\n".join(lines)
+
+
+def parametersText(robotModels):
+    '''A canonical textual description of the values of the named constants of
+    the robot model, including the parameters replaced by their values: the
+    resolved poses in robotModelText() show the names, not the values, which
+    affect only the model constants'''
+    constants = {}
+    for poseSpec in robotModels.geometry.posesModel.poses :
+        for seq in poseSpec.motion.sequences :
+            for step in seq.steps :
+                if isinstance(step.amount, values.Expression) and isinstance(step.amount.argument, values.Constant) :
+                    constants[step.amount.argument.name] = step.amount.argument.value
+    return "\n".join( ["constant {0} {1!r}".format(name, constants[name]) for name in sorted(constants.keys())] )
+
+
+def fkSolverSpecsText(specs):
+    '''A canonical textual description of a solvermodel.FKSolverSpecs'''
+    poses = ["{0}/{1}".format(p.target.name, p.reference.name) for p in specs.poses]
+    vels  = ["{0}/{1}/{2}".format(v.target.name, v.reference.name, getattr(v, 'kind', '')) for v in specs.vels]
+    jacs  = ["{0}/{1}".format(J.velocity.target.name, J.velocity.reference.name) for J in specs.jacs]
+    fams  = ["{0}({1})".format(F.name, " ".join(["{0}/{1}".format(J.velocity.target.name, J.velocity.reference.name)
+                                                 for J in F.jacobians])) for F in specs.jacFamilies]
+    accs  = ["{0}/{1}".format(v.target.name, v.reference.name) for v in specs.jdotqdots]
+    return "fk {0} {1}\nposes {2}\nvelocities {3}\njacobians {4}\nfamilies {5}\njdot_qdot {6}".format(
+        specs.name, specs.kind, " ".join(poses), " ".join(vels), " ".join(jacs), " ".join(fams), " ".join(accs))
+
+
+def ikSolverText(ikSolverModel):
+    '''A canonical textual description of a solvermodel.IKSolverModel'''
+    return "ik {0} {1} {2} {3} {4} fk={5}".format(ikSolverModel.name,
+        generator.ikLevelTags[ikSolverModel.level], generator.ikSpaceTags[ikSolverModel.cfgSpace],
+        ikSolverModel.targetFrame.name, ikSolverModel.referenceFrame.name,
+        ikSolverModel.requiredFK.name)
+
+
+# The distributions whose version may affect the generated text: the
+# templates, the robot models and the kinematics primitives, and the
+# formatting of the numbers
+outputDependencies = ['mako', 'kgprim', 'robot-model-tools', 'numpy']
+
+def dependenciesText():
+    '''The versions of the `outputDependencies`, one per line'''
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        # Python < 3.8
+        from pkg_resources import get_distribution, DistributionNotFound as PackageNotFoundError
+        version = lambda name : get_distribution(name).version
+    lines = []
+    for name in outputDependencies :
+        try:
+            lines.append("{0} {1}".format(name, version(name)))
+        except PackageNotFoundError:
+            lines.append("{0} none".format(name))
+    return "\n".join(lines)
+
+
+def generatorFingerprint(options):
+    '''A digest of the source code of this package, of the versions of the
+    libraries it depends on, and of the options that affect the generated
+    text'''
+    h = hashlib.sha256()
+    h.update(dependenciesText().encode('utf-8'))
+    pkgdir = os.path.dirname(os.path.abspath(__file__))
+    for fname in sorted(os.listdir(pkgdir)) :
+        if fname.endswith(".py") :
+            with open(os.path.join(pkgdir, fname), mode='rb') as istream :
+                h.update(fname.encode('utf-8'))
+                h.update(istream.read())
+    h.update("backend={0} engine={1} planner={2} base-sweep={3} batched={4} parametric={5}".format(
+        options.backend, options.composeEngine, options.planner, options.baseSweep, options.batched,
+        options.parametricConstants).encode('utf-8'))
+    return h.hexdigest()
+
+
+class OutputCache:
+    '''A directory of generated texts, each in a file named after its key.
+
+    The instance also records whether each lookup was a hit or a miss, in
+    `self.report`, a list of (name, hit) tuples.
+    '''
+
+    def __init__(self, directory, robotModels, options):
+        if not os.path.exists(directory) :
+            os.makedirs(directory)
+        self.directory = directory
+        self.baseKey = _digest(generatorFingerprint(options) + "\n" + robotModelText(robotModels))
+        self.report = []
+
+    def key(self, descriptionText):
+        '''The key of the item with the given description (e.g. the text of
+        the specs of a solver)'''
+        return _digest(self.baseKey + "\n" + descriptionText)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".txt")
+
+    def get(self, key, name=None):
+        '''The cached text with the given key, or None. The `name` is used only
+        for the report; lookups without a name are not reported'''
+        path = self._path(key)
+        text = None
+        if os.path.isfile(path) :
+            with open(path, mode='r') as istream :
+                text = istream.read()
+        if name is not None :
+            self.report.append( (name, text is not None) )
+            log.info("Output cache {0} for '{1}'".format("hit" if text is not None else "miss", name))
+        return text
+
+    def put(self, key, text):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, mode='w') as ostream :
+            ostream.write(text)
+        os.replace(tmp, self._path(key))
+
+    def putFile(self, key, path):
+        '''Stores a copy of the given file, which has the generated text'''
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, self._path(key))
+
+    def hits(self):
+        return len([r for r in self.report if r[1]])
+
+    def misses(self):
+        return len([r for r in self.report if not r[1]])
+
+
+class TestOutputCache(unittest.TestCase):
+    '''Generates the UR5 sample twice with the same cache, see
+    sample/models/ur5.urdf and sample/queries/ur5-simple.yaml'''
+
+    def setUp(self):
+        # imported here, since main imports this module
+        from ilkgenerator import main
+        self.main = main
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        self.models = main.loadRobotModels( os.path.join(sample, 'models', 'ur5.urdf') )
+        userq = main.loadQuery( os.path.join(sample, 'queries', 'ur5-simple.yaml'), self.models )
+        self.specs = main.validateQuery(self.models, userq)
+        self.directory = tempfile.TemporaryDirectory()
+        self.options = main.defaultGenerationOptions()
+        self.options.cacheDir = os.path.join(self.directory.name, 'cache')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def generate(self, name):
+        odir = os.path.join(self.directory.name, name)
+        os.makedirs(odir)
+        generated = self.main.generate(self.models, self.specs, odir, self.options)
+        texts = {}
+        for path in generated.files :
+            with open(path, mode='r') as istream :
+                texts[os.path.basename(path)] = istream.read()
+        return generated.cacheReport, texts
+
+    def test_cold_warm(self):
+        report, texts = self.generate('cold')
+        self.assertEqual(len(report), 4)  # myFK, fk__myIK, myIK, the constants
+        self.assertFalse(any([hit for name, hit in report]))
+        report, warmTexts = self.generate('warm')
+        self.assertEqual(len(report), 4)
+        self.assertTrue(all([hit for name, hit in report]))
+        self.assertEqual(warmTexts, texts)
+
+    def test_dependencies(self):
+        key = generatorFingerprint(self.options)
+        self.assertEqual(generatorFingerprint(self.options), key)
+        global dependenciesText
+        original = dependenciesText
+        try:
+            dependenciesText = lambda : original() + "\nmako 0.0.0"
+            self.assertNotEqual(generatorFingerprint(self.options), key)
+        finally:
+            dependenciesText = original
+
+
+if __name__ == "__main__" :
+    unittest.main()
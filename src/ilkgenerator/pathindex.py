@@ -0,0 +1,162 @@
+'''
+Indices of the paths between the nodes of the graphs of a robot model (the
+links graph and the frames graph).
+
+Both graphs are trees, unless the robot has kinematic loops, thus the path
+between two nodes is unique and goes through their lowest common ancestor
+(LCA). The index is built once per graph, with an Euler tour of the tree and
+a sparse table for the LCA queries, which then take constant time; a path
+query takes time linear in the length of the path.
+'''
+
+import os, weakref, unittest
+import networkx as nx
+
+
+class TreePathIndex:
+    '''The path index of a graph which is a tree'''
+
+    def __init__(self, graph, root=None):
+        if not nx.is_tree(graph) :
+            raise ValueError("The path index requires a tree")
+        if root is None :
+            root = next(iter(graph.nodes))
+        self.parent = {root: None}
+        self.depth  = {root: 0}
+        self.first  = {}    # node -> index of its first occurrence in the tour
+        tour = []           # the Euler tour, as a list of nodes
+
+        # iterative depth-first visit, to support deep chains
+        stack = [(root, iter(graph.neighbors(root)))]
+        self.first[root] = 0
+        tour.append(root)
+        while len(stack) > 0 :
+            node, children = stack[-1]
+            child = next(children, None)
+            while child is not None and child == self.parent[node] :
+                child = next(children, None)
+            if child is None :
+                stack.pop()
+                if len(stack) > 0 :
+                    tour.append( stack[-1][0] )
+            else :
+                self.parent[child] = node
+                self.depth[child]  = self.depth[node] + 1
+                self.first[child]  = len(tour)
+                tour.append( child )
+                stack.append( (child, iter(graph.neighbors(child))) )
+
+        # sparse[k][i] is the shallowest node in tour[i : i + 2^k]
+        self.tour = tour
+        self.sparse = [tour]
+        span = 1
+        while 2*span <= len(tour) :
+            prev = self.sparse[-1]
+            self.sparse.append( [self._shallower(prev[i], prev[i+span]) for i in range(0, len(tour) - 2*span + 1)] )
+            span = 2*span
+
+    def _shallower(self, n1, n2):
+        return n1 if self.depth[n1] <= self.depth[n2] else n2
+
+    def lca(self, n1, n2):
+        '''The lowest common ancestor of the two nodes'''
+        i, j = sorted( (self.first[n1], self.first[n2]) )
+        k = (j - i + 1).bit_length() - 1
+        return self._shallower(self.sparse[k][i], self.sparse[k][j - (1 << k) + 1])
+
+    def distance(self, n1, n2):
+        '''The number of edges between the two nodes'''
+        return self.depth[n1] + self.depth[n2] - 2*self.depth[self.lca(n1, n2)]
+
+    def path(self, n1, n2):
+        '''The list of the nodes from n1 to n2, both included'''
+        common = self.lca(n1, n2)
+        up = []
+        while n1 != common :
+            up.append( n1 )
+            n1 = self.parent[n1]
+        down = []
+        while n2 != common :
+            down.append( n2 )
+            n2 = self.parent[n2]
+        up.append( common )
+        down.reverse()
+        return up + down
+
+
+class GraphPathIndex:
+    '''The fallback for graphs which are not trees, which searches the
+    shortest path on each query'''
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def path(self, n1, n2):
+        return nx.shortest_path(self.graph, n1, n2)
+
+
+def pathIndex(graph):
+    '''A new index of the given graph'''
+    if nx.is_tree(graph) :
+        return TreePathIndex(graph)
+    return GraphPathIndex(graph)
+
+
+_indices = weakref.WeakKeyDictionary()
+
+def of(model):
+    '''The path index of the graph of the given model - a robot connectivity
+    model, or a frames model. The index is built on the first call, and then
+    reused as long as the model exists.'''
+    index = _indices.get(model)
+    if index is None :
+        index = pathIndex(model.graph)
+        _indices[model] = index
+    return index
+
+
+class TestPathIndex(unittest.TestCase):
+    def check(self, graph, index):
+        for n1 in graph.nodes :
+            for n2 in graph.nodes :
+                self.assertEqual(index.path(n1, n2), nx.shortest_path(graph, n1, n2))
+
+    def test_trees(self):
+        for graph in [nx.path_graph(40), nx.star_graph(10), nx.balanced_tree(2, 5), nx.balanced_tree(3, 3)] :
+            index = pathIndex(graph)
+            self.assertIsInstance(index, TreePathIndex)
+            self.check(graph, index)
+            for n1 in graph.nodes :
+                for n2 in graph.nodes :
+                    self.assertEqual(index.distance(n1, n2), nx.shortest_path_length(graph, n1, n2))
+
+    def test_deep_chain(self):
+        # deeper than the recursion limit
+        graph = nx.path_graph(5000)
+        index = pathIndex(graph)
+        self.assertEqual(index.path(4999, 0), list(range(4999, -1, -1)))
+        self.assertEqual(index.path(10, 20), list(range(10, 21)))
+
+    def test_robot(self):
+        # imported here, since main imports this module
+        from ilkgenerator import main
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        models = main.loadRobotModels( os.path.join(sample, 'models', 'ur5.urdf') )
+        for model in [models.robot, models.frames] :
+            self.assertIsInstance(of(model), TreePathIndex)
+            self.assertIs(of(model), of(model))
+            self.check(model.graph, of(model))
+
+    def test_loops(self):
+        graph = nx.cycle_graph(7)
+        graph.add_edge(3, 7)
+        graph.add_edge(7, 8)
+        with self.assertRaises(ValueError) :
+            TreePathIndex(graph)
+        index = pathIndex(graph)
+        self.assertIsInstance(index, GraphPathIndex)
+        self.check(graph, index)
+
+
+if __name__ == "__main__" :
+    unittest.main()
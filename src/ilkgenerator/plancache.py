@@ -0,0 +1,74 @@
+'''
+A directory of composition plans (see optcompose.CompositionPlan), to skip the
+search of the optimal compositions when the same set of paths shows up again,
+e.g. in a later run with a slightly different query.
+
+The key of each plan is a digest of the paths, of the planner and of the
+source code of the search algorithms; the plans do not depend on the compose
+engine, since all the engines yield the same result.
+'''
+
+import os, json, hashlib, logging, tempfile
+
+from ilkgenerator import optcompose
+
+log = logging.getLogger(__name__)
+
+
+def _algorithmFingerprint():
+    with open(optcompose.__file__, mode='rb') as istream :
+        return hashlib.sha256(istream.read()).hexdigest()
+
+
+class PlanCache:
+    '''Loads and stores composition plans in the given directory.
+
+    The counters `hits` and `misses` record the outcome of the lookups.
+    '''
+
+    def __init__(self, directory):
+        if not os.path.exists(directory) :
+            os.makedirs(directory)
+        self.directory = directory
+        self.fingerprint = _algorithmFingerprint()
+        self.hits   = 0
+        self.misses = 0
+
+    def _path(self, pathsKey):
+        digest = hashlib.sha256((self.fingerprint + "\n" + pathsKey).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + ".json")
+
+    def load(self, fileName):
+        '''The plan stored in the given file, or None if it is not available'''
+        if not os.path.isfile(fileName) :
+            return None
+        try:
+            with open(fileName, mode='r') as istream :
+                return optcompose.CompositionPlan.fromDict( json.load(istream) )
+        except (ValueError, KeyError) as e:
+            log.warning("Ignoring the invalid composition plan {0} ({1})".format(fileName, e))
+            return None
+
+    def store(self, fileName, plan):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, mode='w') as ostream :
+            json.dump(plan.asDict(), ostream)
+        os.replace(tmp, fileName)
+
+    def allComposes(self, paths, engine=None, planner=optcompose.allComposes):
+        '''Same as the given planner (one of optcompose.planners), but the
+        result comes from the cached plan for the same paths, when available'''
+        key = optcompose.CompositionPlan.keyOf(paths)
+        if key is None :
+            return planner(paths, engine)
+        fileName = self._path(planner.__name__ + "\n" + key)
+        plan = self.load(fileName)
+        if plan is not None :
+            self.hits += 1
+            return plan.composes(paths)
+        self.misses += 1
+        canonical = optcompose.CompositionPlan.canonicalPrimitives(paths)
+        swap = paths[0].pairWiseSwap
+        composes = planner(paths, engine)
+        self.store(fileName, optcompose.CompositionPlan.fromComposes(composes, canonical, swap))
+        return composes
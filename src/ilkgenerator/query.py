@@ -5,8 +5,10 @@ Created on Nov 16, 2018
 '''
 from enum import Enum
 from collections import namedtuple
+import os, unittest
 import yaml
 import logging
+import numpy as np
 
 from ilkgenerator import solvermodel
 from kgprim import core as gr
@@ -41,6 +43,7 @@ def queryFromYAML(istream):
 # dictionary with input data
 VelSpecs = namedtuple('_Velocity', ['target', 'reference', 'kind', 'cframe'])
 JacSpecs = namedtuple('_Jacobian', ['target', 'reference'])
+JacFamilySpecs = namedtuple('_JacobianFamily', ['name', 'reference', 'targets'])
 
 class IKLevel(Enum):
     position = 0
@@ -98,6 +101,25 @@ class _FKSolver:
         else :
             outputs['jacobians'] = []
 
+        # The bias accelerations (J-dot q-dot), like:
+        #   jdot_qdot:
+        #     - {target: tool, reference: base}
+        if 'jdot_qdot' in queryout :
+            outputs['jdotqdot'] = [JacSpecs(**acc) for acc in queryout['jdot_qdot']]
+        else :
+            outputs['jdotqdot'] = []
+
+        # A family of Jacobians with the same reference, like:
+        #   jacFamilies:
+        #     - {name: contacts, reference: base, targets: [foot_l, foot_r]}
+        # The name is optional, and defaults to the name of the reference
+        if 'jacFamilies' in queryout :
+            outputs['jacfamilies'] = [JacFamilySpecs(name=fam.get('name', fam['reference']),
+                                        reference=fam['reference'], targets=fam['targets'])
+                                      for fam in queryout['jacFamilies']]
+        else :
+            outputs['jacfamilies'] = []
+
         return  _FKSolver(data['name'], data['kind'], outputs)
 
 
@@ -218,11 +240,14 @@ class QueryParser():
             poses = self.validatePoses(s.outputs['poses'])
             vels  = self.validateVelocities(s.outputs['velocities'])
             jacs  = self.validateJacobians (s.outputs['jacobians'])
+            fams  = self.validateJacobianFamilies(s.outputs['jacfamilies'], jacs)
+            accs  = self.validateJdotQdots(s.outputs['jdotqdot'])
             sweepingsolvers.append(
                 solvermodel.FKSolverSpecs(
                     name= s.name, kind= s.kind,
                     rmodels = self.robotModelsDict,
-                    requests= {'pose':poses,'velocity':vels, 'jacobian':jacs} ))
+                    requests= {'pose':poses,'velocity':vels, 'jacobian':jacs, 'jacobian-family':fams,
+                               'jdot_qdot':accs} ))
         iksolvers = []
         for s in query.ikSolvers :
             iksolvers.append( self.validateIKDeclarativeModel(s) )
@@ -257,6 +282,29 @@ class QueryParser():
             ret.append( solvermodel.JacobianSpecs(velocity=vel) )
         return ret
 
+    def validateJdotQdots(self, accs):
+        '''The relative velocities whose bias acceleration (J-dot q-dot) is
+        requested'''
+        return [self._checkVelocity(VelSpecs(target=a.target, reference=a.reference, kind="6D", cframe="NA"))
+                for a in accs]
+
+    def validateJacobianFamilies(self, families, jacs):
+        '''The specs of the given families; `jacs` are the specs of the other
+        Jacobians of the same solver, which must not be members of a family'''
+        ret = []
+        members = set()
+        for F in families :
+            family = self.validateJacobians( [JacSpecs(target=tgt, reference=F.reference) for tgt in F.targets] )
+            for J in family :
+                if J in jacs or J in members :
+                    raise ValueError("Jacobian of '{0}' relative to '{1}' requested more than once".format(
+                        J.velocity.target.name, J.velocity.reference.name))
+                members.add( J )
+            if F.name in [f.name for f in ret] :
+                raise ValueError("Duplicate name of Jacobian family '{0}'".format(F.name))
+            ret.append( solvermodel.JacobianFamilySpecs(name=F.name, jacobians=family) )
+        return ret
+
     def validateIKDeclarativeModel(self, ik):
         target = self.frames.getAttachedFrame(ik.targetFrame)
         if target == None :
@@ -292,3 +340,68 @@ def defaultQuery(robot) :
 
 
 
+
+
+class TestJacobianFamilies(unittest.TestCase):
+    '''Families of Jacobians of the UR5 sample, see sample/models/ur5.urdf'''
+
+    targets = ['forearm', 'wrist_1', 'wrist_3', 'tool']
+
+    def setUp(self):
+        # imported here, since main imports this module
+        from ilkgenerator import main
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        self.models = main.loadRobotModels( os.path.join(sample, 'models', 'ur5.urdf') )
+        self.parser = QueryParser(self.models.robot, self.models.frames, None)
+
+    def specs(self, outputs):
+        userq = queryFromDictionary( {'robot': 'ur5', 'solvers': [{'name': 'fk', 'kind': 'sweeping', 'outputs': outputs}]} )
+        return self.parser.validate(userq)[0][0]
+
+    def test_members(self):
+        family = {'name': 'arm', 'reference': 'base', 'targets': self.targets}
+        fused = solvermodel.FKSolverModel( self.specs({'jacFamilies': [family]}) )
+        separate = solvermodel.FKSolverModel( self.specs({'jacs': [{'target': t, 'reference': 'base'} for t in self.targets]}) )
+        self.assertEqual(len(fused.jacobianFamilies), 1)
+        F = fused.jacobianFamilies[0]
+        self.assertEqual(F.name, 'arm')
+        self.assertEqual([J.velocity.target.name for J in F.members], self.targets)
+        for J, Jsep, columns in zip(F.members, separate.geometricJacobians, F.memberColumns) :
+            self.assertEqual(J.joints, Jsep.joints)
+            self.assertEqual(J.jointPoses, Jsep.jointPoses)
+            self.assertEqual(J.polarities, Jsep.polarities)
+            self.assertEqual(J.targetPose, Jsep.targetPose)
+            # the family columns of the member are the columns of the member
+            self.assertEqual([F.joints[c] for c in columns], J.joints)
+            self.assertEqual([F.jointPoses[c] for c in columns], J.jointPoses)
+            self.assertEqual([F.polarities[c] for c in columns], J.polarities)
+        self.assertEqual(F.joints, F.members[-1].joints)
+
+        # the numeric values, see module batcheval
+        from ilkgenerator import batcheval
+        q = np.random.RandomState(0).uniform(-3, 3, (5, 6))
+        expected = batcheval.BatchEvaluator(separate, self.models.geometry).evaluate(q)
+        out = batcheval.BatchEvaluator(fused, self.models.geometry).evaluate(q)
+        for t in self.targets :
+            key = 'J_' + t + '_base'
+            np.testing.assert_array_equal(out[key], expected[key])
+
+    def test_duplicates(self):
+        arm  = {'name': 'arm', 'reference': 'base', 'targets': self.targets}
+        tool = {'name': 'tool', 'reference': 'base', 'targets': ['tool']}
+        with self.assertRaises(ValueError) :
+            self.specs({'jacFamilies': [arm], 'jacs': [{'target': 'wrist_1', 'reference': 'base'}]})
+        with self.assertRaises(ValueError) :
+            self.specs({'jacFamilies': [arm, tool]})
+        with self.assertRaises(ValueError) :
+            self.specs({'jacFamilies': [arm, dict(arm, targets=['upperarm'])]})
+        with self.assertRaises(ValueError) :
+            self.specs({'jacFamilies': [dict(arm, targets=['tool', 'wrist_1', 'tool'])]})
+        # the same target relative to another reference is not a duplicate
+        specs = self.specs({'jacFamilies': [arm, {'name': 'other', 'reference': 'shoulder', 'targets': ['tool']}],
+                            'jacs': [{'target': 'upperarm', 'reference': 'base'}]})
+        self.assertEqual([F.name for F in specs.jacFamilies], ['arm', 'other'])
+
+
+if __name__ == "__main__" :
+    unittest.main()
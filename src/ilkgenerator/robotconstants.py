@@ -1,8 +1,13 @@
+import os, tempfile, unittest
 import numpy as np
-from mako.template import Template
+import yaml
+from collections import namedtuple
 
 from ilkgenerator import codegenutils as tplutils
+from ilkgenerator import generator
+from ilkgenerator import binconstants
 
+from kgprim import motions, values
 import kgprim.ct.frommotions as mot2ct
 import kgprim.ct.repr.mxrepr as mxrepr
 from kgprim.ct.models import PrimitiveCTransform
@@ -15,38 +20,90 @@ formatter = tplutils.FloatsFormatter(round_digits=6)
 def _tformIdentifier(targetFrame, relativeToFrame):
     return targetFrame.name + "__" + relativeToFrame.name
 
-def oneTransformTable(poseSpec):
-    ct1 = mot2ct.toCoordinateTransform(poseSpec, polarity=TransformPolarity.movedFrameOnTheRight)
-    ct2 = mot2ct.toCoordinateTransform(poseSpec, polarity=TransformPolarity.movedFrameOnTheLeft)
-
-    hm = mxrepr.hCoordinatesNumeric(ct1)
-    name = _tformIdentifier(targetFrame=ct1.rightFrame, relativeToFrame=ct1.leftFrame)
-    p = tplutils.numericArrayToText( hm[0:3,3], formatter )
-    R = tplutils.numericArrayToText( hm[0:3,0:3], formatter )
-
-    hm_inv = mxrepr.hCoordinatesNumeric(ct2)
-    name_inv = _tformIdentifier(targetFrame=ct2.rightFrame, relativeToFrame=ct2.leftFrame)
-    p_inv    = tplutils.numericArrayToText( hm_inv[0:3,3], formatter )
-    R_inv    = tplutils.numericArrayToText( hm_inv[0:3,0:3], formatter )
+# The transforms of a list of constant poses, computed in a single pass: the
+# identifiers of the forward and inverse transforms (lists of strings), and
+# their homogeneous coordinates as N x 4 x 4 arrays, in the same order
+TransformsStack = namedtuple('TransformsStack', ['names', 'names_inv', 'forward', 'inverse'])
+
+
+def inverseTransforms(hm):
+    '''The inverses of the given homogeneous transforms (an array of shape
+    ... x 4 x 4), that is [R^T, -R^T p], with a single vectorized operation'''
+    inv = np.zeros( np.shape(hm) )
+    Rt = np.swapaxes(hm[...,0:3,0:3], -1, -2)
+    inv[...,0:3,0:3] = Rt
+    inv[...,0:3,3] = -np.einsum('...ij,...j->...i', Rt, hm[...,0:3,3])
+    inv[...,3,3] = 1.0
+    return inv
+
+
+def transformsStack(poses):
+    '''The TransformsStack of the given pose specifications. Only the forward
+    transforms are converted from the symbolic models, the inverses are
+    computed numerically.'''
+    forward = np.empty( (len(poses), 4, 4) )
+    names = []
+    names_inv = []
+    for i, poseSpec in enumerate(poses) :
+        ct = mot2ct.toCoordinateTransform(poseSpec, polarity=TransformPolarity.movedFrameOnTheRight)
+        forward[i] = mxrepr.hCoordinatesNumeric(ct)
+        names.append( _tformIdentifier(targetFrame=ct.rightFrame, relativeToFrame=ct.leftFrame) )
+        names_inv.append( _tformIdentifier(targetFrame=ct.leftFrame, relativeToFrame=ct.rightFrame) )
+    return TransformsStack(names=names, names_inv=names_inv, forward=forward, inverse=inverseTransforms(forward))
+
+
+def allTransformTexts(poses):
+    '''The same tuples as transformTexts(), for all the given poses, with the
+    numeric values of all the transforms formatted at once'''
+    stack = transformsStack(poses)
+    text = tplutils.numericArrayToText(
+        np.stack( (stack.forward[:,0:3,:], stack.inverse[:,0:3,:]), axis=1 ), formatter )
+    return [(stack.names[i], text[i,0,:,3], text[i,0,:,0:3], stack.names_inv[i], text[i,1,:,3], text[i,1,:,0:3])
+            for i in range(0, len(poses))]
+
+
+def transformTexts(poseSpec):
+    '''The identifiers and the text of the numeric values of the coordinate
+    transforms corresponding to the given pose, in both directions.
+
+    Returns a tuple `(name, p, R, name_inv, p_inv, R_inv)`, where the
+    translation and rotation values are arrays of strings.'''
+    return allTransformTexts([poseSpec])[0]
+
+
+def transformText(name, p, R, parameters=None):
+    '''The Lua text of a single transform, given its identifier and the text
+    of its values. With the ModelParameters of the robot, the parametric
+    transforms also have the fields of parametricFields().'''
     templateText ='''
 ${name} = {
     p = {${p[0]}, ${p[1]}, ${p[2]}},
     r = {${R[0,0]},${R[0,1]},${R[0,2]},
          ${R[1,0]},${R[1,1]},${R[1,2]},
-         ${R[2,0]},${R[2,1]},${R[2,2]}}
-},
-${name_inv} = {
-    p = {${p_inv[0]}, ${p_inv[1]}, ${p_inv[2]}},
-    r = {${R_inv[0,0]},${R_inv[0,1]},${R_inv[0,2]},
-         ${R_inv[1,0]},${R_inv[1,1]},${R_inv[1,2]},
-         ${R_inv[2,0]},${R_inv[2,1]},${R_inv[2,2]}}
+         ${R[2,0]},${R[2,1]},${R[2,2]}}${extra}
 }'''
-    return Template(templateText).render( p=p, R=R, name=name, name_inv=name_inv, p_inv=p_inv, R_inv=R_inv )
+    return tplutils.compiledTemplate(templateText).render( p=p, R=R, name=name,
+                        extra=parametricFields(name, parameters) )
 
 
-def asLuaTable(robotGeometryModel):
-    posesModel      = robotGeometryModel.posesModel
+def transformTableText(texts, referenced=None, parameters=None):
+    '''The Lua text of a pair of transforms, given the tuple returned by
+    transformTexts(). If the set `referenced` is given, only the transforms
+    whose identifier is in the set are included.'''
+    name, p, R, name_inv, p_inv, R_inv = texts
+    entries = [transformText(n, pp, RR, parameters) for n, pp, RR in ((name, p, R), (name_inv, p_inv, R_inv))
+               if referenced is None or n in referenced]
+    # the entries after the first one do not start with a blank line
+    return ",\n".join( entries[0:1] + [e[1:] for e in entries[1:]] )
+
+
+def oneTransformTable(poseSpec):
+    return transformTableText( transformTexts(poseSpec) )
+
 
+def fixedJointsAliases(robotGeometryModel):
+    '''The identifiers of the transforms across fixed joints, which are all
+    aliases of the identity'''
     fixed_joints = []
     connectModel = robotGeometryModel.connectivityModel
     framesModel  = robotGeometryModel.framesModel
@@ -58,6 +115,199 @@ def asLuaTable(robotGeometryModel):
             id2 = _tformIdentifier(targetFrame=lFrame, relativeToFrame=jFrame)
             fixed_joints.append(id1)
             fixed_joints.append(id2)
+    return fixed_joints
+
+
+def numericTransforms(robotGeometryModel):
+    '''The homogeneous coordinate transforms (4x4 arrays) of the constant poses
+    of the given model, in both directions, as a dictionary indexed by the same
+    identifiers used in the Lua table. The aliases of the identity are included.'''
+    transforms = {}
+    stack = transformsStack(robotGeometryModel.posesModel.poses)
+    for i, (name, name_inv) in enumerate(zip(stack.names, stack.names_inv)) :
+        transforms[name]     = stack.forward[i]
+        transforms[name_inv] = stack.inverse[i]
+    for name in fixedJointsAliases(robotGeometryModel) :
+        transforms[name] = np.identity(4)
+    return transforms
+
+
+# A constant pose whose value depends on parameters of the robot model. The
+# `name` and `name_inv` are the identifiers of the two transforms, `params`
+# the sorted names of the parameters, `sequences` a list of (mode, steps)
+# tuples, with the name of the MotionSequence.Mode and a list of ParametricStep
+ParametricPose = namedtuple('ParametricPose', ['name', 'name_inv', 'params', 'sequences'])
+
+# A step of the motion of a ParametricPose: the `kind` is one of 'tx', 'ty',
+# 'tz', 'rotx', 'roty', 'rotz'; the amount is `scale` times the parameter
+# `param`, or just `scale` if `param` is None
+ParametricStep = namedtuple('ParametricStep', ['kind', 'param', 'scale'])
+
+# The parameters of a robot model: `values` is a dictionary with the value of
+# each parameter, `poses` maps the identifiers of the parametric transforms,
+# in both directions, to their ParametricPose
+ModelParameters = namedtuple('ModelParameters', ['values', 'poses'])
+
+_stepKinds = {
+    (motions.MotionStep.Kind.Translation, motions.Axis.X) : 'tx',
+    (motions.MotionStep.Kind.Translation, motions.Axis.Y) : 'ty',
+    (motions.MotionStep.Kind.Translation, motions.Axis.Z) : 'tz',
+    (motions.MotionStep.Kind.Rotation, motions.Axis.X) : 'rotx',
+    (motions.MotionStep.Kind.Rotation, motions.Axis.Y) : 'roty',
+    (motions.MotionStep.Kind.Rotation, motions.Axis.Z) : 'rotz',
+}
+
+def _parametricStep(step):
+    amount = step.amount
+    kind = _stepKinds[(step.kind, step.axis)]
+    if isinstance(amount, values.Expression) and isinstance(amount.argument, values.Parameter) :
+        symbol = amount.argument.symbol
+        scale = amount.expr.diff(symbol)
+        if not scale.is_number or (amount.expr - scale*symbol).simplify() != 0 :
+            raise RuntimeError("Unsupported expression of parameter '{0}': {1}".format(
+                amount.argument.name, amount.expr))
+        return ParametricStep(kind=kind, param=amount.argument.name, scale=float(scale))
+    if isinstance(amount, values.Expression) :
+        return ParametricStep(kind=kind, param=None, scale=amount.evalf())
+    # a plain float, i.e. a literal of the model, like the fixed rotation of a
+    # pose whose translation depends on a parameter
+    return ParametricStep(kind=kind, param=None, scale=float(amount))
+
+
+def modelParameters(robotGeometryModel, parametersValues):
+    '''The ModelParameters of the given model, with the given dictionary of
+    parameter values; the parameters without a value take their default.
+
+    This function must be called before the parameters of the model are
+    replaced by their values (see main.loadRobotModels()).'''
+    allValues = {}
+    poses = {}
+    for poseSpec in robotGeometryModel.posesModel.poses :
+        params = set()
+        for step in [step for seq in poseSpec.motion.sequences for step in seq.steps] :
+            if isinstance(step.amount, values.Expression) and isinstance(step.amount.argument, values.Parameter) :
+                param = step.amount.argument
+                params.add(param.name)
+                allValues[param.name] = parametersValues.get(param.name, param.defaultValue)
+        if params :
+            sequences = [(seq.mode.name, [_parametricStep(step) for step in seq.steps])
+                         for seq in poseSpec.motion.sequences]
+            pose = poseSpec.pose
+            ppose = ParametricPose(name=_tformIdentifier(pose.target, pose.reference),
+                                   name_inv=_tformIdentifier(pose.reference, pose.target),
+                                   params=sorted(params), sequences=sequences)
+            poses[ppose.name] = ppose
+            poses[ppose.name_inv] = ppose
+    return ModelParameters(values=allValues, poses=poses)
+
+
+def parametricTransform(ppose, parametersValues):
+    '''The homogeneous transform (4x4 array) of the given ParametricPose, for
+    the given dictionary of parameter values, in the direction of the
+    identifier `ppose.name`'''
+    X = np.identity(4)
+    for mode, steps in ppose.sequences :
+        S = np.identity(4)
+        for step in steps :
+            amount = step.scale * (parametersValues[step.param] if step.param is not None else 1.0)
+            M = np.identity(4)
+            i = "xyz".index(step.kind[-1])
+            if step.kind.startswith('t') :
+                M[i,3] = amount
+            else :
+                j, k = (i+1) % 3, (i+2) % 3
+                c, s = np.cos(amount), np.sin(amount)
+                M[j,j], M[j,k], M[k,j], M[k,k] = c, -s, s, c
+            S = np.matmul(S, M) if mode == 'currentFrame' else np.matmul(M, S)
+        X = np.matmul(X, S)
+    return X
+
+
+def parametricFields(name, parameters):
+    '''The additional fields of the Lua table of the transform with the given
+    identifier, if it is parametric according to the given ModelParameters,
+    or the empty string. The fields are the names of the parameters and either
+    the motion steps of the pose or the identifier of the transform this one
+    is the inverse of.'''
+    if parameters is None or name not in parameters.poses :
+        return ""
+    ppose = parameters.poses[name]
+    text = ",\n    params = {" + ", ".join( ["'" + p + "'" for p in ppose.params] ) + "}"
+    if name == ppose.name_inv :
+        return text + ",\n    inverse_of = '" + ppose.name + "'"
+    def stepText(step):
+        if step.param is None :
+            return "{{ '{0}', value={1!r} }}".format(step.kind, step.scale)
+        return "{{ '{0}', param='{1}', scale={2!r} }}".format(step.kind, step.param, step.scale)
+    sequences = ["        {{ mode='{0}', steps={{ {1} }} }}".format(mode, ", ".join( [stepText(s) for s in steps] ))
+                 for mode, steps in ppose.sequences]
+    return text + ",\n    motion = {\n" + ",\n".join(sequences) + "\n    }"
+
+
+def parametersAsLuaTable(parameters):
+    '''The Lua table with the values of the given ModelParameters, which is
+    all that changes when the robot is calibrated again'''
+    lines = ["    {0} = {1!r}".format(name, float(parameters.values[name])) for name in sorted(parameters.values.keys())]
+    return "\nreturn {\n" + ",\n".join(lines) + ("\n" if lines else "") + "}\n"
+
+
+def referencedConstants(solverModel):
+    '''The identifiers of the constant transforms used by the given FK solver
+    model (solvermodel.FKSolverModel), including the aliases of the identity'''
+    return set( [generator.poseIdentifier(pose) for pose in solverModel.constPoses] )
+
+
+def prunedTransformTexts(robotGeometryModel, referenced=None):
+    '''The tuples of allTransformTexts() for the poses of the given model, and
+    the identifiers of the aliases of the identity. If the set `referenced` is
+    given, only the poses with at least one referenced transform and the
+    referenced aliases are included.'''
+    texts = allTransformTexts(robotGeometryModel.posesModel.poses)
+    aliases = fixedJointsAliases(robotGeometryModel)
+    if referenced is not None :
+        texts = [t for t in texts if t[0] in referenced or t[3] in referenced]
+        aliases = [a for a in aliases if a in referenced]
+    return texts, aliases
+
+
+def asLuaTable(robotGeometryModel, referenced=None, parameters=None):
+    '''The Lua table with the values of the constant transforms of the given
+    model. If the set `referenced` is given, the table includes only the
+    transforms with those identifiers (see referencedConstants()). If the
+    ModelParameters are given, the parametric transforms are marked as such
+    (see parametricFields()); their values are those of the parameters.'''
+    t, context = _luaTableTemplate(robotGeometryModel, referenced, parameters)
+    return t.render(**context)
+
+
+def writeLuaTable(robotGeometryModel, ostream, referenced=None, parameters=None):
+    '''Writes the text of asLuaTable() into the given file-like object'''
+    t, context = _luaTableTemplate(robotGeometryModel, referenced, parameters)
+    tplutils.renderInto(t, ostream, context)
+
+
+def writeBinaryTable(robotGeometryModel, ostream, referenced=None, dtype='float64'):
+    '''Writes the same transforms of writeLuaTable() into the given binary
+    stream, with full precision, in the format of module binconstants. The
+    aliases of the identity share a single identity matrix.'''
+    stack = transformsStack(robotGeometryModel.posesModel.poses)
+    names = []
+    matrices = []
+    for i in range(0, len(stack.names)) :
+        for name, X in ((stack.names[i], stack.forward[i]), (stack.names_inv[i], stack.inverse[i])) :
+            if referenced is None or name in referenced :
+                names.append(name)
+                matrices.append(X)
+    aliases = [a for a in fixedJointsAliases(robotGeometryModel) if referenced is None or a in referenced]
+    if aliases :
+        names.append("_identity_")
+        matrices.append( np.identity(4) )
+    binconstants.write(ostream, names, np.array(matrices).reshape(-1, 4, 4), dtype,
+                       {a: "_identity_" for a in aliases})
+
+
+def _luaTableTemplate(robotGeometryModel, referenced, parameters):
+    texts, fixed_joints = prunedTransformTexts(robotGeometryModel, referenced)
 
     templateText = '''
 return {
@@ -65,13 +315,113 @@ return {
     % for mx in matrices :
         ${mx}
     % endfor
+    % if separator :
   ,
+    % endif
     % for j in fixed_joints :
 ${j} = '_identity_',
     % endfor
   }
 }
 '''
-    template = Template(templateText)
-    mxs = tplutils.commaSeparated(posesModel.poses, oneTransformTable)
-    return template.render( matrices=mxs, fixed_joints=fixed_joints )
+    template = tplutils.compiledTemplate(templateText)
+    mxs = tplutils.commaSeparated(texts, lambda t : transformTableText(t, referenced, parameters))
+    # a leading comma would not be valid Lua
+    return template, {'matrices': mxs, 'fixed_joints': fixed_joints, 'separator': len(texts) > 0}
+
+
+class TestConstants(unittest.TestCase):
+    '''The constants of the UR5 sample, see sample/models/ur5.urdf'''
+
+    def setUp(self):
+        # imported here, since main imports this module
+        from ilkgenerator import main
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        self.models = main.loadRobotModels( os.path.join(sample, 'models', 'ur5.urdf') )
+
+    def test_inverse(self):
+        rnd = np.random.RandomState(0)
+        X = np.zeros( (2, 50, 4, 4) )
+        for index in np.ndindex(X.shape[0:2]) :
+            # a random rotation, from the QR decomposition of a random matrix
+            Q, R = np.linalg.qr( rnd.normal(size=(3,3)) )
+            X[index][0:3,0:3] = Q * np.sign(np.diag(R))
+            X[index][0:3,3] = rnd.uniform(-2, 2, 3)
+            X[index][3,3] = 1.0
+        identity = np.broadcast_to(np.identity(4), X.shape)
+        np.testing.assert_allclose(np.matmul(inverseTransforms(X), X), identity, rtol=0, atol=1e-14)
+        np.testing.assert_allclose(np.matmul(X, inverseTransforms(X)), identity, rtol=0, atol=1e-14)
+        np.testing.assert_allclose(inverseTransforms(X[0,0]), np.linalg.inv(X[0,0]), rtol=0, atol=1e-14)
+
+    def test_stack(self):
+        # the numeric inverses against the inverse transforms of kgprim
+        poses = self.models.geometry.posesModel.poses
+        stack = transformsStack(poses)
+        for i, poseSpec in enumerate(poses) :
+            ct = mot2ct.toCoordinateTransform(poseSpec, polarity=TransformPolarity.movedFrameOnTheLeft)
+            self.assertEqual(stack.names_inv[i], _tformIdentifier(targetFrame=ct.rightFrame, relativeToFrame=ct.leftFrame))
+            np.testing.assert_allclose(stack.inverse[i], mxrepr.hCoordinatesNumeric(ct), rtol=0, atol=1e-14)
+            np.testing.assert_allclose(np.matmul(stack.inverse[i], stack.forward[i]), np.identity(4), rtol=0, atol=1e-14)
+
+    def test_pruned(self):
+        from ilkgenerator import main, solvermodel, interpreter
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        userq = main.loadQuery( os.path.join(sample, 'queries', 'ur5-simple.yaml'), self.models )
+        fkSpecs, ikSpecs = main.validateQuery(self.models, userq)
+        geometry = self.models.geometry
+        allNames = set(numericTransforms(geometry).keys())
+        for specs in [fkSpecs[0], solvermodel.IKSolverModel(ikSpecs[0]).requiredFK] :
+            model = solvermodel.FKSolverModel(specs)
+            referenced = referencedConstants(model)
+            # the constants listed in the text of the solver
+            solverTable = interpreter.luaTable( generator.SweepingSolverGenerator(model).lua() )
+            self.assertEqual(referenced, set(solverTable['poses']['constant'].keys()))
+            self.assertLess(len(referenced), len(allNames))
+
+            texts, aliases = prunedTransformTexts(geometry, referenced)
+            for t in texts :
+                self.assertTrue(t[0] in referenced or t[3] in referenced)
+            self.assertLessEqual(set(aliases), referenced)
+            table = interpreter.luaTable( asLuaTable(geometry, referenced) )
+            self.assertEqual(set(table['poses'].keys()), referenced)
+        texts, aliases = prunedTransformTexts(geometry)
+        self.assertEqual(set([t[0] for t in texts] + [t[3] for t in texts] + aliases), allNames)
+
+
+class TestParametric(unittest.TestCase):
+    '''The constants of a robot with parameters, see
+    sample/models/parametric.kindsl'''
+
+    defaults = {'h0': 0.2, 'l1': 0.3, 'l2': 0.25, 'off': 0.01, 'tw': 0.1}
+
+    def check(self, givenValues):
+        # imported here, since main imports this module
+        from ilkgenerator import main
+        sample = os.path.join(os.path.dirname(__file__), '..', '..', 'sample')
+        with tempfile.TemporaryDirectory() as directory :
+            paramsFile = None
+            if givenValues :
+                paramsFile = os.path.join(directory, 'params.yaml')
+                with open(paramsFile, mode='w') as ostream :
+                    yaml.safe_dump(givenValues, ostream)
+            models = main.loadRobotModels(os.path.join(sample, 'models', 'parametric.kindsl'), paramsFile, True)
+        parameters = models.parameters
+        self.assertEqual(parameters.values, dict(self.defaults, **givenValues))
+        self.assertEqual(sorted(set([p.name for p in parameters.poses.values()])),
+                         ['jA__base', 'jB__link1', 'jC__link2'])
+        numeric = numericTransforms(models.geometry)
+        for name, ppose in parameters.poses.items() :
+            X = parametricTransform(ppose, parameters.values)
+            if name == ppose.name_inv :
+                X = inverseTransforms(X)
+            np.testing.assert_allclose(X, numeric[name], rtol=0, atol=1e-14)
+
+    def test_defaults(self):
+        self.check({})
+
+    def test_values(self):
+        self.check({'l1': 0.4, 'tw': -0.3, 'off': 0.0})
+
+
+if __name__ == "__main__" :
+    unittest.main()
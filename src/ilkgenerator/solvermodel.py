@@ -10,7 +10,9 @@ from ilkgenerator import optcompose
 from ilkgenerator.optcompose import HomogenoeusComposable
 from ilkgenerator import query
 from ilkgenerator import jacobians
+from ilkgenerator import pathindex
 from ilkgenerator import utils
+from ilkgenerator import instrument
 
 from kgprim import core as gr
 from robmodel.frames import FrameRelationKind
@@ -23,6 +25,23 @@ from robmodel.connectivity import JointKind
 
 
 
+class JacobianFamilySpecs:
+    '''A set of Jacobians with the same reference, sharing their columns'''
+    def __init__(self, name, jacobians):
+        self.name = name
+        self.jacobians = tuple(jacobians)
+
+    def __eq__(self, rhs):
+        return (isinstance(rhs, JacobianFamilySpecs) and
+                self.name == rhs.name and self.jacobians == rhs.jacobians )
+    def __hash__(self):
+        return 61 * hash(self.name) + hash(self.jacobians)
+    def __str__(self):
+        return "Jacobian family '{0}': {1}".format(self.name, self.jacobians)
+    def __repr__(self):
+        return self.__str__()
+
+
 class JacobianSpecs:
     def __init__(self, velocity):
         self.velocity = velocity
@@ -43,6 +62,8 @@ VelocitySpecs = namedtuple('VelocitySpecs', ['vel', 'kind', 'cframe'])
 
 JointVel = namedtuple('JointVel', ['joint', 'vel', 'polarity'])
 
+ComposeOpsCount = namedtuple('ComposeOpsCount', ['poses', 'velocities'])
+
 class FKSolverSpecs:
     '''Data required to specify a declarative model of a FK solver.
 
@@ -63,10 +84,16 @@ class FKSolverSpecs:
             self.requests['jacobian'] = []
         if 'velocity' not in self.requests :
             self.requests['velocity'] = []
+        if 'jacobian-family' not in self.requests :
+            self.requests['jacobian-family'] = []
+        if 'jdot_qdot' not in self.requests :
+            self.requests['jdot_qdot'] = []
 
         self.poses = tuple( self.requests['pose'] )
         self.jacs  = tuple( self.requests['jacobian'] )
         self.vels  = tuple( self.requests['velocity'] )
+        self.jacFamilies = tuple( self.requests['jacobian-family'] )
+        self.jdotqdots   = tuple( self.requests['jdot_qdot'] )
 
     def __eq__(self, rhs):
         almost = (isinstance(rhs, FKSolverSpecs) and
@@ -75,7 +102,7 @@ class FKSolverSpecs:
                self.rmodels['robot'].name == rhs.rmodels['robot'].name) # weak check...
         ret = False
         if almost :
-            ret = (self.poses==rhs.poses) and (self.jacs==rhs.jacs) and (self.vels==rhs.vels)
+            ret = (self.poses==rhs.poses) and (self.jacs==rhs.jacs) and (self.vels==rhs.vels) and (self.jacFamilies==rhs.jacFamilies) and (self.jdotqdots==rhs.jdotqdots)
         return ret
 
     def __hash__(self) :
@@ -84,7 +111,9 @@ class FKSolverSpecs:
                79 * hash(self.rmodels['robot'].name) +
                11 * hash(self.poses) +
                13 * hash(self.jacs) +
-               83 * hash(self.vels))
+               83 * hash(self.vels) +
+               17 * hash(self.jacFamilies) +
+               7  * hash(self.jdotqdots))
 
     def __str__(self):
         return "Solver '{0}' of {1} kind, for robot {2}, requesting: {3} {4}".format(
@@ -92,6 +121,28 @@ class FKSolverSpecs:
             self.poses, self.jacs)
 
 
+def fusedSolverSpecs(specsList, name):
+    '''The specs of a single sweeping solver computing all the outputs of the
+    given FK solvers, each one only once.
+
+    The compositions of the resulting solver are searched over all the paths
+    together, thus the ones shared by different solvers are computed once.
+    Passing a single specs object gives an equivalent copy of it, which does
+    not share the requests with the original.
+    '''
+    requests = {'pose': [], 'velocity': [], 'jacobian': [], 'jacobian-family': [], 'jdot_qdot': []}
+    for specs in specsList :
+        for key, items in [('pose', specs.poses), ('velocity', specs.vels), ('jacobian', specs.jacs),
+                           ('jacobian-family', specs.jacFamilies), ('jdot_qdot', specs.jdotqdots)] :
+            for item in items :
+                if item not in requests[key] :
+                    requests[key].append( item )
+    # a Jacobian requested by a solver could be part of a family of another one
+    members = [J for F in requests['jacobian-family'] for J in F.jacobians]
+    requests['jacobian'] = [J for J in requests['jacobian'] if J not in members]
+    return FKSolverSpecs(name=name, kind="sweeping", rmodels=specsList[0].rmodels, requests=requests)
+
+
 class _ComposablePose(HomogenoeusComposable):
     def __init__(self, pose):
         super().__init__([pose])
@@ -129,15 +180,32 @@ class FKSolverModel:
     '''A declarative model of a FK solver, with information about the optimal
     pose/velocity compositions to perform.
 
-    An instance must be constructed from a FKSolverSpecs instance.
+    An instance must be constructed from a FKSolverSpecs instance. The optional
+    `composeEngine` is passed to optcompose.allComposes(). The optional
+    `planCache` (a plancache.PlanCache) provides the compositions computed
+    previously for the same paths, if any. The optional `planner` is one of
+    the functions in optcompose.planners, and defaults to the greedy
+    optcompose.allComposes(). If `baseSweep` is True, the poses relative to
+    the robot base are computed with optcompose.sweepComposes(), and the
+    planner is used only for the other poses, reusing the results of the
+    sweep (see optcompose.seededPaths()).
     '''
 
-    def __init__(self, solverSpec):
+    def __init__(self, solverSpec, composeEngine=None, planCache=None, planner=None, baseSweep=False):
         self.name    = solverSpec.name
         self.rmodels = solverSpec.rmodels
         self.constPoses = set()
         self.jointPoses = set()
         self.output = solverSpec.requests
+        # Small integer IDs for the distance-1 poses and the joint velocities,
+        # used by the search of the compositions
+        self.interner = optcompose.Interner()
+        if planner is None :
+            planner = optcompose.allComposes
+        if planCache is not None :
+            allComposes = lambda paths, engine: planCache.allComposes(paths, engine, planner)
+        else :
+            allComposes = planner
 
         framesModel = self.rmodels['frames']
 
@@ -151,11 +219,23 @@ class FKSolverModel:
             allPoses.update(jac.jointPoses)
             allPoses.add(jac.targetPose)
             self.geometricJacobians.append(jac)
-        self.output['jacobian'] = self.geometricJacobians
+        # The members of the Jacobian families are outputs like the other
+        # Jacobians, but their columns are computed by the family
+        self.jacobianFamilies = []
+        for F in self.output['jacobian-family'] :
+            family = jacobians.GeometricJacobianFamily(framesModel, F.name, [J.velocity for J in F.jacobians])
+            for jac in family.members :
+                allPoses.update(jac.jointPoses)
+                allPoses.add(jac.targetPose)
+            self.jacobianFamilies.append(family)
+        self.output['jacobian'] = self.geometricJacobians + [J for F in self.jacobianFamilies for J in F.members]
 
         self.jointVelocities = {}
+        # The bias accelerations require the corresponding velocities
         velComposePaths = [self.velocityPath(v) for v in self.output['velocity']]
-        self.velComposes = optcompose.allComposes( velComposePaths )
+        velComposePaths.extend( [self.velocityPath(v) for v in self.output['jdot_qdot'] if v not in self.output['velocity']] )
+        with instrument.span('compose-velocities') :
+            self.velComposes = allComposes( velComposePaths, composeEngine )
         self.velBinaryComposes = []
 
         # The composition of velocities, on the other hand, requires certain
@@ -195,6 +275,8 @@ class FKSolverModel:
             if v in self.jointVelocities.keys() :
                 self.jointVelocitiesExplicit.add( v )
 
+        self._planAccelerations()
+
         # Joint velocities with opposite polarity (that is, velocity of predecessor
         # relative to successor), require the coordinate transform from joint
         # frame to predecessor frame. We add here the corresponding pose to make
@@ -206,8 +288,67 @@ class FKSolverModel:
                 pose = gr.Pose(target=tgtF, reference=refF)
                 allPoses.add( pose )
 
-        poseComposePaths = [self._posePath(pose) for pose in allPoses ]
-        self.poseComposes = optcompose.allComposes( poseComposePaths )
+        if baseSweep :
+            base = framesModel.byLink[self.robot.base]
+            rooted = [self._posePath(pose) for pose in allPoses if pose.reference == base]
+            others = [self._posePath(pose) for pose in allPoses if pose.reference != base]
+            with instrument.span('compose-poses') :
+                rootedComposes = optcompose.sweepComposes( rooted )
+                # the other paths may cross the base, then they reuse the
+                # poses computed by the sweep
+                others = optcompose.seededPaths( others, rootedComposes )
+                self.poseComposes = rootedComposes + allComposes( others, composeEngine )
+        else :
+            poseComposePaths = [self._posePath(pose) for pose in allPoses ]
+            with instrument.span('compose-poses') :
+                self.poseComposes = allComposes( poseComposePaths, composeEngine )
+
+    def _planAccelerations(self):
+        '''
+        Plans the bias accelerations (J-dot q-dot) requested in the output.
+
+        The bias acceleration of a relative velocity is the acceleration with
+        zero joint accelerations. It is computed along the same binary
+        compositions of the velocity, from the accelerations of the two
+        arguments, which are zero for joint velocities. Both arguments of such
+        compositions must then be computed explicitly.
+        '''
+        producers = {}
+        for vbc in self.velBinaryComposes :
+            producers[ (vbc.result.target, vbc.result.reference) ] = vbc
+
+        self.accBiasComposes = []  # binary velocity compositions, in order
+        self.accBiasZero = []      # requested accelerations which are zero
+        done = set()
+        for v in self.output['jdot_qdot'] :
+            root = producers.get( (v.target, v.reference) )
+            if root is None :
+                # a joint velocity
+                self.accBiasZero.append( v )
+                continue
+            # post-order visit of the compositions leading to the velocity
+            stack = [(root, False)]
+            while len(stack) > 0 :
+                vbc, expanded = stack.pop()
+                key = (vbc.result.target, vbc.result.reference)
+                if key in done :
+                    continue
+                if expanded :
+                    done.add( key )
+                    self.accBiasComposes.append( vbc )
+                    continue
+                stack.append( (vbc, True) )
+                for arg in (vbc.arg2, vbc.arg1) :
+                    if arg.v in self.jointVelocities.keys() :
+                        self.jointVelocitiesExplicit.add( arg.v )
+                    else :
+                        stack.append( (producers[(arg.target, arg.reference)], False) )
+
+    def composeOpsCount(self):
+        '''The number of binary compositions of poses and of velocities that
+        the solver performs'''
+        return ComposeOpsCount(poses=optcompose.composeOpsCount(self.poseComposes),
+                               velocities=len(self.velBinaryComposes))
 
     @property
     def robot(self):
@@ -234,7 +375,7 @@ class FKSolverModel:
         '''
         composablesList = []
         framesGraph = self.rmodels['frames']
-        graphPath   = framesGraph.path(givenpose.target, givenpose.reference)
+        graphPath   = pathindex.of(framesGraph).path(givenpose.target, givenpose.reference)
         tgt = givenpose.target
         for ref in graphPath[1:] :
             pose = _ComposablePose( gr.Pose(tgt, ref) )
@@ -255,7 +396,7 @@ class FKSolverModel:
             composablesList.append( pose )
             tgt = ref
 
-        return optcompose.Path(composablesList)
+        return optcompose.Path(composablesList, interner=self.interner)
 
     def velocityPath(self, v):
         ref = v.reference # should always be a robot link
@@ -272,7 +413,7 @@ class FKSolverModel:
                 "of robot {0} (found '{1}' and '{2}')".format(
                     self.robot.name, tgt.name, ref.name))
 
-        path = self.robot.path(ref, tgt)
+        path = pathindex.of(self.robot).path(ref, tgt)
         composablesList = []
         for tgt in path[1:] :
             vel = gr.Velocity(tgt, ref) # tgt and ref are neighbour links, so this should be a joint velocity
@@ -287,7 +428,7 @@ class FKSolverModel:
             composablesList.append( vel )
             ref = tgt
 
-        return optcompose.Path(composablesList, True)
+        return optcompose.Path(composablesList, True, self.interner)
 
 
 # Data required to represent a declarative model of an IK solver